@@ -21,12 +21,16 @@
         'account',
         'product',
     ],
+    'external_dependencies': {
+        'python': ['routeros_api'],
+    },
     'data': [
         # Security
         'security/ir.model.access.csv',
         
         # Data
         'data/ir_sequence_data.xml',
+        'data/ir_config_parameter_data.xml',
         'data/whatsapp_template_data.xml',
         'data/cron_jobs.xml',
         
@@ -44,14 +48,21 @@
         'views/isp_report_views.xml',
         'views/isp_invoice_views.xml',
         'views/isp_discount_views.xml',
+        'views/isp_billing_run_views.xml',
+        'views/isp_router_command_views.xml',
+        'views/isp_router_reconcile_views.xml',
+        'views/isp_revenue_snapshot_views.xml',
         
         # Wizards
         'wizards/isp_adopt_secret_wizard_views.xml',
+        'wizards/isp_billing_backfill_wizard_views.xml',
+        'wizards/isp_billing_forecast_wizard_views.xml',
         
         # Menu (harus terakhir karena bergantung pada action)
         'views/menu_views.xml',
         
         # Reports
+        'reports/isp_report.xml',
         'reports/isp_report_templates.xml',
     ],
     'demo': [],
@@ -0,0 +1,67 @@
+from odoo import http
+from odoo.http import request, content_disposition
+from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import wrap_file
+import re
+import tempfile
+
+# Script ditulis ke spool: di memori sampai 4 MB, selebihnya ke file sementara
+RSC_SPOOL_SIZE = 4 * 1024 * 1024
+EXPORT_SPOOL_SIZE = 4 * 1024 * 1024
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class ISPRouterExportController(http.Controller):
+
+    @http.route(['/dkt_isp_billing/mikrotik/<int:config_id>/provision.rsc',
+                 '/dkt_isp_billing/mikrotik/<int:config_id>/verify.rsc'], type='http', auth='user')
+    def export_rsc(self, config_id, **kwargs):
+        """Unduh script provisioning/verifikasi RouterOS untuk satu router"""
+        config = request.env['isp.mikrotik.config'].browse(config_id).exists()
+        if not config:
+            raise NotFound()
+        config.check_access_rights('read')
+        config.check_access_rule('read')
+
+        verify = request.httprequest.path.endswith('/verify.rsc')
+        spool = tempfile.SpooledTemporaryFile(max_size=RSC_SPOOL_SIZE)
+        for chunk in config._iter_rsc_script(verify=verify):
+            spool.write(chunk.encode('utf-8'))
+        size = spool.tell()
+        spool.seek(0)
+
+        slug = re.sub(r'[^A-Za-z0-9_-]+', '_', config.name or str(config.id))
+        filename = f'{slug}_{"verify" if verify else "provision"}.rsc'
+        return request.make_response(wrap_file(request.httprequest.environ, spool), headers=[
+            ('Content-Type', 'text/plain; charset=utf-8'),
+            ('Content-Length', str(size)),
+            ('Content-Disposition', content_disposition(filename)),
+        ])
+
+
+class ISPReportExportController(http.Controller):
+
+    @http.route('/dkt_isp_billing/report/<int:report_id>/export', type='http', auth='user')
+    def export_report(self, report_id, **kwargs):
+        """Unduh laporan CSV/XLSX; baris ditulis per chunk ke spool lalu dialirkan ke browser"""
+        report = request.env['isp.report'].browse(report_id).exists()
+        if not report:
+            raise NotFound()
+        report.check_access_rights('read')
+        report.check_access_rule('read')
+
+        export_format = report.export_format if report.export_format != 'pdf' else 'csv'
+        spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        report._write_export(spool, export_format)
+        size = spool.tell()
+        spool.seek(0)
+
+        return request.make_response(wrap_file(request.httprequest.environ, spool), headers=[
+            ('Content-Type', EXPORT_MIMETYPES[export_format]),
+            ('Content-Length', str(size)),
+            ('Content-Disposition', content_disposition(report._get_export_filename())),
+        ])
\ No newline at end of file
@@ -6,8 +6,16 @@ from . import isp_installation_type
 from . import isp_installation_fee
 from . import isp_subscription_template
 from . import isp_subscription
+from . import isp_billing_run
 from . import isp_mikrotik
+from . import isp_mikrotik_export
+from . import isp_mikrotik_health
 from . import isp_mikrotik_profile
+from . import isp_router_command
+from . import isp_router_reconcile
 from . import isp_report
+from . import isp_report_export
+from . import isp_report_job
+from . import isp_revenue_snapshot
 from . import account_move
 from . import isp_discount 
\ No newline at end of file
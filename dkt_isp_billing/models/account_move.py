@@ -1,4 +1,5 @@
 from odoo import models, fields, api
+from odoo.tools.sql import create_index
 
 class AccountMove(models.Model):
     _inherit = 'account.move'
@@ -6,8 +7,29 @@ class AccountMove(models.Model):
     subscription_id = fields.Many2one('isp.subscription', string='Subscription', tracking=True,
                                     domain="[('customer_id', '=', partner_id)]")
 
+    def init(self):
+        super().init()
+        # Index komposit untuk guard invoice ganda per periode subscription
+        create_index(
+            self._cr, 'account_move_isp_subscription_period_idx', self._table,
+            ['subscription_id', 'move_type', 'invoice_date']
+        )
+
     @api.onchange('partner_id')
     def _onchange_partner_subscription(self):
         """Reset subscription when partner changes"""
         if self.partner_id != self.subscription_id.customer_id:
-            self.subscription_id = False 
\ No newline at end of file
+            self.subscription_id = False
+
+
+class AccountMoveLine(models.Model):
+    _inherit = 'account.move.line'
+
+    isp_subscription_id = fields.Many2one('isp.subscription', string='Subscription ISP', index='btree_not_null',
+                                          help="Subscription yang ditagih oleh line ini (dipakai pada invoice gabungan)")
+    # Paket dan router saat line ditagih, sehingga snapshot pendapatan tidak ikut berpindah
+    # ketika paket atau router subscription diganti setelah invoice dibuat
+    isp_package_id = fields.Many2one('isp.package', string='Paket ISP', readonly=True, ondelete='set null',
+                                     help="Paket subscription saat line ini ditagih")
+    isp_mikrotik_id = fields.Many2one('isp.mikrotik.config', string='Router ISP', readonly=True, ondelete='set null',
+                                      help="Router subscription saat line ini ditagih") 
\ No newline at end of file
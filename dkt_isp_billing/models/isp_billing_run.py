@@ -0,0 +1,437 @@
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+from datetime import datetime, timedelta
+import logging
+import psycopg2.errors
+import pytz
+import threading
+import time
+from .isp_subscription import BillingContext
+
+_logger = logging.getLogger(__name__)
+
+class ISPBillingRun(models.Model):
+    _name = 'isp.billing.run'
+    _description = 'Billing Run'
+    _inherit = ['mail.thread']
+    _order = 'id desc'
+
+    name = fields.Char('Nomor', readonly=True, copy=False)
+    billing_date = fields.Date('Tanggal Billing', required=True, readonly=True)
+    worker = fields.Integer('Worker', default=1, readonly=True)
+    batch_size = fields.Integer('Ukuran Batch', readonly=True)
+    state = fields.Selection([
+        ('running', 'Berjalan'),
+        ('paused', 'Menunggu Slot'),
+        ('done', 'Selesai'),
+        ('failed', 'Gagal')
+    ], string='Status', default='running', tracking=True)
+
+    date_started = fields.Datetime('Mulai', readonly=True)
+    date_finished = fields.Datetime('Selesai', readonly=True)
+    duration = fields.Float('Durasi (detik)', readonly=True, help="Total durasi batch yang sudah di-commit")
+    checkpoint_id = fields.Integer('Checkpoint', readonly=True,
+                                help="ID subscription terakhir pada batch yang sudah di-commit. "
+                                     "Run yang dilanjutkan hanya mengklaim subscription setelah ID ini.")
+
+    batch_count = fields.Integer('Jumlah Batch', readonly=True)
+    subscription_count = fields.Integer('Subscription Diproses', readonly=True)
+    invoice_count = fields.Integer('Invoice Dibuat', readonly=True)
+    failed_count = fields.Integer('Subscription Gagal', readonly=True)
+    failed_subscription_ids = fields.Many2many('isp.subscription', string='Daftar Subscription Gagal', readonly=True)
+    batch_ids = fields.One2many('isp.billing.run.batch', 'run_id', string='Batch', readonly=True)
+    error_message = fields.Text('Pesan Error', readonly=True)
+
+    # Jadwal load-levelling
+    tick_quota = fields.Integer('Kuota per Slot', readonly=True,
+                                help="Jumlah subscription maksimum per eksekusi cron. 0 berarti tanpa batas.")
+    slice_count = fields.Integer('Jumlah Slot', readonly=True)
+    window_start = fields.Datetime('Awal Jendela', readonly=True)
+    window_end = fields.Datetime('Akhir Jendela', readonly=True,
+                                 help="Setelah waktu ini sisa backlog diproses tanpa kuota")
+    scheduled_count = fields.Integer('Jatuh Tempo Saat Dijadwalkan', readonly=True)
+    backlog_count = fields.Integer('Backlog', compute='_compute_backlog_count',
+                                   help="Subscription yang masih jatuh tempo pada tanggal billing run ini")
+    invoice_rate = fields.Float('Invoice/Menit', compute='_compute_invoice_rate')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if not vals.get('name'):
+                vals['name'] = self.env['ir.sequence'].next_by_code('isp.billing.run.sequence')
+        return super().create(vals_list)
+
+    def _compute_backlog_count(self):
+        Subscription = self.env['isp.subscription']
+        for run in self:
+            if run.state == 'done':
+                run.backlog_count = 0
+                continue
+            run.backlog_count = Subscription.search_count([
+                ('state', '=', 'open'),
+                ('next_invoice_date', '<=', run.billing_date)
+            ])
+
+    @api.depends('invoice_count', 'duration')
+    def _compute_invoice_rate(self):
+        for run in self:
+            run.invoice_rate = run.invoice_count * 60 / run.duration if run.duration else 0.0
+
+    def _get_tick_quota(self):
+        """Kuota subscription untuk eksekusi ini; 0 berarti proses sampai habis"""
+        self.ensure_one()
+        if not self.tick_quota or (self.window_end and fields.Datetime.now() >= self.window_end):
+            return 0
+        return self.tick_quota
+
+    def _record_batch(self, chunk, invoices, failed, duration):
+        """Simpan checkpoint batch dalam transaksi yang sama dengan invoice batch tersebut"""
+        self.ensure_one()
+        self.env['isp.billing.run.batch'].create({
+            'run_id': self.id,
+            'sequence': self.batch_count + 1,
+            'first_subscription_id': chunk.ids[0],
+            'last_subscription_id': chunk.ids[-1],
+            'subscription_count': len(chunk),
+            'invoice_count': len(invoices),
+            'failed_count': len(failed),
+            'duration': duration,
+            'date': fields.Datetime.now(),
+        })
+        vals = {
+            'checkpoint_id': chunk.ids[-1],
+            'batch_count': self.batch_count + 1,
+            'subscription_count': self.subscription_count + len(chunk),
+            'invoice_count': self.invoice_count + len(invoices),
+            'failed_count': self.failed_count + len(failed),
+            'duration': self.duration + duration,
+        }
+        if failed:
+            vals['failed_subscription_ids'] = [(4, subscription_id) for subscription_id in failed.ids]
+        self.write(vals)
+
+    def _execute(self):
+        """
+        Menjalankan billing run mulai dari checkpoint terakhir.
+        Setiap batch diklaim dengan SKIP LOCKED, ditagih, lalu di-commit bersama checkpoint-nya.
+        """
+        self.ensure_one()
+        Subscription = self.env['isp.subscription']
+        billing_context = BillingContext(self.env)
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        quota = self._get_tick_quota()
+        processed = 0
+        if self.state != 'running':
+            self.write({'state': 'running'})
+        _logger.info(
+            f'Billing run {self.name} ({self.billing_date}, worker {self.worker}): '
+            f'mulai dari checkpoint {self.checkpoint_id}, batch {self.batch_size}, kuota {quota or "-"}'
+        )
+
+        try:
+            while True:
+                if quota and processed >= quota:
+                    # Kuota slot habis, sisa backlog diproses pada slot berikutnya
+                    self.write({'state': 'paused'})
+                    if auto_commit:
+                        self.env.cr.commit()
+                    _logger.info(
+                        f'Billing run {self.name}: kuota slot {quota} tercapai, '
+                        f'dilanjutkan pada slot berikutnya'
+                    )
+                    return self._get_summary()
+
+                if auto_commit:
+                    # Mulai snapshot baru sebelum klaim agar baris yang baru ditagih worker lain tidak terlihat jatuh tempo
+                    self.env.cr.commit()
+                try:
+                    chunk = Subscription._claim_due_subscriptions(
+                        self.billing_date,
+                        min(self.batch_size, quota - processed) if quota else self.batch_size,
+                        after_id=self.checkpoint_id
+                    )
+                except psycopg2.errors.SerializationFailure:
+                    if not auto_commit:
+                        raise
+                    # Baris diubah worker lain setelah snapshot diambil, ulangi klaim
+                    self.env.cr.rollback()
+                    self.env.invalidate_all()
+                    continue
+                if not chunk:
+                    break
+
+                chunk_started = time.monotonic()
+                invoices, failed = chunk._process_billing_chunk(self.billing_date, billing_context)
+                duration = time.monotonic() - chunk_started
+                self._record_batch(chunk, invoices, failed, duration)
+                processed += len(chunk)
+                if auto_commit:
+                    self.env.cr.commit()
+
+                _logger.info(
+                    f'Billing run {self.name} batch {self.batch_count}: {len(invoices)} invoice dari '
+                    f'{len(chunk)} subscription dalam {duration:.2f} detik '
+                    f'({len(chunk) / max(duration, 0.001):.1f} subscription/detik)'
+                )
+                # Kosongkan cache agar memori tetap stabil di antara batch
+                self.env.invalidate_all()
+        except Exception as e:
+            _logger.error(f'Billing run {self.name} gagal: {str(e)}', exc_info=True)
+            if auto_commit:
+                self.env.cr.rollback()
+                self.env.invalidate_all()
+            self.write({
+                'state': 'failed',
+                'error_message': str(e),
+            })
+            self._post_summary()
+            return self._get_summary()
+
+        self.write({
+            'state': 'done',
+            'date_finished': fields.Datetime.now(),
+            'error_message': False,
+        })
+        _logger.info(
+            f'Billing run {self.name} selesai: {self.invoice_count} invoice dari {self.subscription_count} '
+            f'subscription, {self.failed_count} gagal, {self.duration:.2f} detik'
+        )
+        self._post_summary()
+        return self._get_summary()
+
+    def _post_summary(self):
+        """Satu ringkasan di chatter billing run sebagai pengganti pesan per subscription"""
+        self.ensure_one()
+        status = 'selesai' if self.state == 'done' else 'gagal'
+        self.message_post(
+            body=f'Billing {self.billing_date} {status}: {self.invoice_count} invoice dari '
+                 f'{self.subscription_count} subscription dalam {self.batch_count} batch, '
+                 f'{self.failed_count} gagal, {self.duration:.2f} detik',
+            message_type='notification',
+        )
+
+    def _get_summary(self):
+        """Ringkasan hasil billing run"""
+        self.ensure_one()
+        return {
+            'run_id': self.id,
+            'billing_date': self.billing_date,
+            'worker': self.worker,
+            'state': self.state,
+            'subscription_count': self.subscription_count,
+            'invoice_count': self.invoice_count,
+            'failed_ids': self.failed_subscription_ids.ids,
+            'duration': self.duration,
+        }
+
+    @api.model
+    def _run_worker(self, worker=1, batch_size=None):
+        """
+        Jalankan billing untuk satu worker: lanjutkan run yang terputus,
+        lalu buat run baru bila masih ada subscription jatuh tempo hari ini.
+        """
+        for run in self.search([('worker', '=', worker), ('state', 'in', ['running', 'paused'])], order='id'):
+            run._execute()
+
+        if self._is_load_levelling_enabled():
+            # Run baru hanya dibuat oleh cron_schedule_billing
+            return False
+
+        billing_date = self._get_billing_date()
+        has_due = self.env['isp.subscription'].search_count([
+            ('state', '=', 'open'),
+            ('next_invoice_date', '<=', billing_date)
+        ], limit=1)
+        if not has_due:
+            return False
+
+        run = self.create({
+            'billing_date': billing_date,
+            'worker': worker,
+            'batch_size': batch_size or self.env['isp.subscription']._get_billing_batch_size(),
+            'date_started': fields.Datetime.now(),
+        })
+        return run._execute()
+
+    @api.model
+    def _is_load_levelling_enabled(self):
+        """Load-levelling aktif jika cron penjadwal billing aktif"""
+        scheduler = self.env.ref('dkt_isp_billing.ir_cron_schedule_billing', raise_if_not_found=False)
+        return bool(scheduler and scheduler.active)
+
+    @api.model
+    def _get_schedule_config(self):
+        """Konfigurasi jendela billing dari ir.config_parameter"""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        config = {
+            'window_start': get_param('dkt_isp_billing.billing_window_start', '01:00'),
+            'window_end': get_param('dkt_isp_billing.billing_window_end', '05:00'),
+        }
+        for key, default in [('slice_minutes', 15), ('rate_per_minute', 0)]:
+            try:
+                config[key] = max(int(get_param(f'dkt_isp_billing.billing_{key}', default)), 0)
+            except (TypeError, ValueError):
+                config[key] = default
+        config['slice_minutes'] = config['slice_minutes'] or 15
+        return config
+
+    @api.model
+    def _get_billing_tz(self):
+        """
+        Zona waktu jendela dan tanggal billing: parameter dkt_isp_billing.billing_window_tz,
+        atau zona waktu perusahaan. Zona waktu user cron tidak dipakai karena biasanya kosong/UTC.
+        """
+        tz_name = (self.env['ir.config_parameter'].sudo().get_param('dkt_isp_billing.billing_window_tz')
+                   or self.env.company.partner_id.tz or 'UTC')
+        try:
+            return pytz.timezone(tz_name.strip())
+        except pytz.UnknownTimeZoneError:
+            raise ValidationError(f'Zona waktu billing tidak valid: {tz_name}')
+
+    @api.model
+    def _get_billing_date(self):
+        """Tanggal billing hari ini menurut zona waktu billing, dipakai worker dan penjadwal"""
+        return datetime.now(self._get_billing_tz()).date()
+
+    @api.model
+    def _get_billing_window(self, billing_date, config):
+        """
+        Jendela billing sebagai datetime UTC (naive) pada billing_date menurut zona waktu billing.
+        Jendela yang melewati tengah malam (mis. 23:00-02:00) berakhir pada hari berikutnya.
+        """
+        tz = self._get_billing_tz()
+        window = []
+        for value in (config['window_start'], config['window_end']):
+            try:
+                local_time = datetime.strptime(value.strip(), '%H:%M').time()
+            except (AttributeError, ValueError):
+                raise ValidationError(f'Format jam jendela billing tidak valid: {value} (gunakan HH:MM)')
+            local_dt = tz.localize(datetime.combine(billing_date, local_time))
+            window.append(local_dt.astimezone(pytz.utc).replace(tzinfo=None))
+        window_start, window_end = window
+        if window_end <= window_start:
+            window_end += timedelta(days=1)
+        return window_start, window_end
+
+    @api.model
+    def cron_schedule_billing(self):
+        """
+        Penjadwal billing dengan load-levelling.
+        Subscription jatuh tempo hari ini dibagi ke slot waktu sepanjang jendela billing;
+        cron billing dipicu pada awal setiap slot dan setiap eksekusi hanya memproses
+        kuota slot tersebut. Kuota = target invoice per menit x panjang slot, atau
+        dibagi rata ke semua slot bila target tidak diatur. Sisa backlog setelah akhir
+        jendela diproses tanpa kuota.
+        """
+        billing_date = self._get_billing_date()
+        if self.search_count([
+            ('worker', '=', 1),
+            ('billing_date', '=', billing_date),
+            ('state', 'in', ['running', 'paused'])
+        ], limit=1):
+            return False
+
+        due_count = self.env['isp.subscription'].search_count([
+            ('state', '=', 'open'),
+            ('next_invoice_date', '<=', billing_date)
+        ])
+        if not due_count:
+            return False
+
+        config = self._get_schedule_config()
+        window_start, window_end = self._get_billing_window(billing_date, config)
+        now = fields.Datetime.now()
+        slice_times = []
+        slice_time = max(window_start, now)
+        while slice_time < window_end:
+            slice_times.append(slice_time)
+            slice_time += timedelta(minutes=config['slice_minutes'])
+        if not slice_times:
+            # Jendela sudah lewat, proses semua sekarang
+            slice_times = [now]
+
+        if config['rate_per_minute']:
+            tick_quota = config['rate_per_minute'] * config['slice_minutes']
+        else:
+            tick_quota = -(-due_count // len(slice_times))
+
+        run = self.create({
+            'billing_date': billing_date,
+            'worker': 1,
+            'batch_size': self.env['isp.subscription']._get_billing_batch_size(),
+            'date_started': now,
+            'state': 'paused',
+            'tick_quota': tick_quota,
+            'slice_count': len(slice_times),
+            'window_start': slice_times[0],
+            'window_end': max(window_end, slice_times[-1]),
+            'scheduled_count': due_count,
+        })
+        cron = self.env.ref('dkt_isp_billing.ir_cron_generate_subscription_invoices')
+        cron._trigger(at=slice_times + [run.window_end])
+        _logger.info(
+            f'Billing run {run.name}: {due_count} subscription dijadwalkan dalam {len(slice_times)} slot '
+            f'{run.window_start} - {run.window_end} UTC, kuota {tick_quota} per slot'
+        )
+        return run
+
+    def action_resume(self):
+        """Lanjutkan billing run dari checkpoint terakhir"""
+        self.ensure_one()
+        if self.state == 'done':
+            raise ValidationError('Billing run sudah selesai!')
+        self.write({'state': 'running'})
+        summary = self._execute()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses' if summary['state'] != 'failed' else 'Peringatan',
+                'message': f'Billing run {self.name}: {summary["invoice_count"]} invoice, {len(summary["failed_ids"])} gagal',
+                'type': 'success' if summary['state'] != 'failed' else 'warning',
+            }
+        }
+
+    def action_retry_failed(self):
+        """Ulangi billing untuk subscription yang gagal pada run ini"""
+        self.ensure_one()
+        failed_subscriptions = self.failed_subscription_ids.filtered(
+            lambda s: s.state == 'open' and s.next_invoice_date and s.next_invoice_date <= self.billing_date
+        )
+        if not failed_subscriptions:
+            raise ValidationError('Tidak ada subscription gagal yang masih perlu ditagih!')
+
+        chunk_started = time.monotonic()
+        invoices, failed = failed_subscriptions._process_billing_chunk(self.billing_date)
+        retried = failed_subscriptions - failed
+        self.write({
+            'invoice_count': self.invoice_count + len(invoices),
+            'failed_count': len(self.failed_subscription_ids - retried),
+            'failed_subscription_ids': [(3, subscription_id) for subscription_id in retried.ids],
+            'duration': self.duration + time.monotonic() - chunk_started,
+        })
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses' if not failed else 'Peringatan',
+                'message': f'{len(invoices)} invoice dibuat, {len(failed)} subscription masih gagal',
+                'type': 'success' if not failed else 'warning',
+            }
+        }
+
+
+class ISPBillingRunBatch(models.Model):
+    _name = 'isp.billing.run.batch'
+    _description = 'Billing Run Batch'
+    _order = 'run_id, sequence'
+
+    run_id = fields.Many2one('isp.billing.run', string='Billing Run', required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer('Batch')
+    first_subscription_id = fields.Integer('ID Subscription Awal')
+    last_subscription_id = fields.Integer('ID Subscription Akhir')
+    subscription_count = fields.Integer('Subscription')
+    invoice_count = fields.Integer('Invoice')
+    failed_count = fields.Integer('Gagal')
+    duration = fields.Float('Durasi (detik)')
+    date = fields.Datetime('Waktu Commit')
@@ -1,8 +1,11 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from odoo.tools.sql import create_index
 import random
 import string
 import logging
+import threading
+import time
 
 _logger = logging.getLogger(__name__)
 
@@ -17,6 +20,8 @@ class ISPCPE(models.Model):
     ip_address = fields.Char('IP Address', tracking=True)
     outdoor_unit = fields.Char('Outdoor Unit')
     router = fields.Char('Router')
+    mikrotik_id = fields.Many2one('isp.mikrotik.config', string='Router Mikrotik', tracking=True, index=True,
+                                  help='Router tempat secret PPPoE CPE ini. Kosongkan untuk memakai router paket atau router default.')
     pppoe_username = fields.Char('PPPoE Username', required=True, tracking=True)
     pppoe_password = fields.Char('PPPoE Password', required=True, tracking=True)
     ownership = fields.Selection([
@@ -37,6 +42,13 @@ class ISPCPE(models.Model):
     subscription_id = fields.Many2one('isp.subscription', string='Active Subscription',
                                     compute='_compute_subscription', store=True)
     subscription_state = fields.Selection(related='subscription_id.state', string='Status Subscription')
+
+    # Delta sync: secret hanya ditulis ke router jika isi yang diinginkan berubah
+    secret_fingerprint = fields.Char('Fingerprint Secret', compute='_compute_secret_fingerprint', store=True, copy=False,
+                                     help="Hash isi secret yang diinginkan Odoo: profile, status, password, "
+                                          "remote address dan comment")
+    secret_applied_fingerprint = fields.Char('Fingerprint Diterapkan', readonly=True, copy=False,
+                                             help="Fingerprint terakhir yang sudah sama dengan isi secret di router")
     
     _sql_constraints = [
         ('mac_address_uniq', 'unique(mac_address)', 'MAC Address harus unik!'),
@@ -98,6 +110,171 @@ class ISPCPE(models.Model):
             chars = string.ascii_letters + string.digits
             self.pppoe_password = ''.join(random.choice(chars) for _ in range(8))
     
+    def init(self):
+        # Index parsial untuk cron sinkronisasi: hanya CPE yang secret-nya belum sinkron
+        create_index(
+            self._cr, 'isp_cpe_secret_out_of_sync_idx', self._table, ['id'],
+            where="secret_fingerprint IS DISTINCT FROM secret_applied_fingerprint"
+        )
+
+    def _prepare_secret_values(self):
+        """
+        Isi secret PPPoE yang diinginkan Odoo, atau None jika CPE tidak punya
+        subscription open/terisolir (secret tidak dikelola).
+        """
+        self.ensure_one()
+        subscription = self.subscription_id
+        if not self.pppoe_username or subscription.state not in ('open', 'isolated'):
+            return None
+        return {
+            'username': self.pppoe_username,
+            'profile': subscription.package_id.profile_id.name or '',
+            'disabled': subscription.state == 'isolated',
+            'password': self.pppoe_password or '',
+            'remote_address': self.ip_address or '',
+            'comment': f'Customer: {self.customer_id.name} ({self.customer_id.customer_id})',
+        }
+
+    @api.depends('pppoe_username', 'pppoe_password', 'ip_address', 'customer_id.name', 'customer_id.customer_id',
+                 'subscription_id.state', 'subscription_id.package_id.profile_id.name')
+    def _compute_secret_fingerprint(self):
+        Mikrotik = self.env['isp.mikrotik.config']
+        for record in self:
+            values = record._prepare_secret_values()
+            record.secret_fingerprint = Mikrotik._secret_fingerprint(
+                values['profile'], values['disabled'], values['password'],
+                values['remote_address'], values['comment'],
+            ) if values else False
+
+    def _sync_secrets(self, force=False):
+        """
+        Delta sync secret CPE ke router masing-masing (paralel per router).
+        CPE yang fingerprint-nya sama dengan fingerprint terakhir diterapkan dilewati tanpa
+        menghubungi router (kecuali force); sisanya dibandingkan dengan snapshot router dan
+        hanya secret yang isinya berbeda yang ditulis.
+        Returns: dict jumlah {'checked', 'skipped', 'unchanged', 'written', 'missing', 'failed'}
+        """
+        stats = {'checked': len(self), 'skipped': 0, 'unchanged': 0, 'written': 0, 'missing': 0, 'failed': 0}
+        desired_by_router = {}
+        targets = {}
+        for cpe in self:
+            if not cpe.secret_fingerprint or (not force and cpe.secret_fingerprint == cpe.secret_applied_fingerprint):
+                stats['skipped'] += 1
+                continue
+            mikrotik = cpe._get_mikrotik_config()
+            if not mikrotik:
+                stats['failed'] += 1
+                continue
+            values = cpe._prepare_secret_values()
+            values['fingerprint'] = cpe.secret_fingerprint
+            desired_by_router.setdefault(mikrotik.id, []).append(values)
+            targets[(mikrotik.id, cpe.pppoe_username)] = cpe
+        if not desired_by_router:
+            return stats
+
+        results = self.env['isp.mikrotik.config']._sync_secrets_per_router(desired_by_router)
+        applied = self.browse()
+        for config_id, result in results.items():
+            for key in ('unchanged', 'written', 'missing', 'failed'):
+                stats[key] += len(result[key])
+            for username in result['written'] + result['unchanged']:
+                applied |= targets[(config_id, username)]
+        applied._set_secret_applied()
+        return stats
+
+    def _set_secret_applied(self):
+        """Catat fingerprint saat ini sebagai fingerprint yang sudah diterapkan di router"""
+        if not self:
+            return
+        # Satu UPDATE untuk semua CPE yang sudah sinkron, tanpa write per record
+        self.flush_model(['secret_fingerprint'])
+        self.env.cr.execute("""
+            UPDATE isp_cpe cpe
+               SET secret_applied_fingerprint = applied.fingerprint
+              FROM unnest(%s::int[], %s::varchar[]) AS applied(id, fingerprint)
+             WHERE cpe.id = applied.id
+        """, [self.ids, [cpe.secret_fingerprint for cpe in self]])
+        self.invalidate_model(['secret_applied_fingerprint'])
+
+    def _mark_secrets_applied(self, mikrotik):
+        """
+        Setelah enable/disable/ganti profile berhasil (atau dilewati karena sudah sama), tandai
+        CPE yang isi secret-nya di snapshot router sudah sama dengan isi yang diinginkan Odoo,
+        sehingga delta sync berikutnya tidak menghubungi router untuk CPE tersebut.
+        """
+        Mikrotik = self.env['isp.mikrotik.config']
+        applied = self.browse()
+        for cpe in self:
+            values = cpe._prepare_secret_values()
+            entry = mikrotik._get_cached_secret(cpe.pppoe_username) if values else None
+            if entry and Mikrotik._router_secret_fingerprint(entry, values) == cpe.secret_fingerprint:
+                applied |= cpe
+        applied._set_secret_applied()
+
+    @api.model
+    def cron_sync_secrets(self):
+        """
+        Cron delta sync: proses CPE yang fingerprint secret-nya berubah sejak terakhir diterapkan,
+        per batch dengan commit per batch, lalu laporkan berapa penulisan yang dilewati.
+        """
+        started = time.monotonic()
+        try:
+            batch_size = max(int(self.env['ir.config_parameter'].sudo().get_param(
+                'dkt_isp_billing.router_command_batch_size', 500)), 1)
+        except (TypeError, ValueError):
+            batch_size = 500
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+
+        self.flush_model(['secret_fingerprint', 'secret_applied_fingerprint'])
+        self.env.cr.execute("""
+            SELECT id
+              FROM isp_cpe
+             WHERE secret_fingerprint IS DISTINCT FROM secret_applied_fingerprint
+               AND secret_fingerprint IS NOT NULL
+          ORDER BY id
+        """)
+        cpe_ids = [row[0] for row in self.env.cr.fetchall()]
+        total = {'checked': 0, 'skipped': 0, 'unchanged': 0, 'written': 0, 'missing': 0, 'failed': 0}
+        for index in range(0, len(cpe_ids), batch_size):
+            stats = self.browse(cpe_ids[index:index + batch_size])._sync_secrets()
+            for key, value in stats.items():
+                total[key] += value
+            if auto_commit:
+                self.env.cr.commit()
+
+        _logger.info(
+            f'Sinkronisasi secret: {total["checked"]} CPE dicek, {total["written"]} ditulis, '
+            f'{total["skipped"] + total["unchanged"]} penulisan dilewati '
+            f'({total["unchanged"]} sudah sama di router), {total["missing"]} tidak ada di router, '
+            f'{total["failed"]} gagal, {time.monotonic() - started:.2f} detik'
+        )
+        return total
+
+    def action_sync_secret(self):
+        """Sinkronkan isi secret CPE ini ke router, dilewati jika isinya sudah sama"""
+        stats = self._sync_secrets(force=True)
+        if stats['failed'] or stats['missing']:
+            raise ValidationError(
+                f'Sinkronisasi secret gagal: {stats["missing"]} tidak ada di router, {stats["failed"]} gagal'
+            )
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses',
+                'message': f'{stats["written"]} secret ditulis, '
+                           f'{stats["unchanged"] + stats["skipped"]} dilewati karena tidak berubah',
+                'type': 'success',
+            }
+        }
+
+    def _get_mikrotik_config(self):
+        """Router CPE ini: router CPE, router paket subscription, atau router default"""
+        self.ensure_one()
+        return (self.mikrotik_id
+                or self.subscription_id.package_id.mikrotik_id
+                or self.env['isp.mikrotik.config'].get_default_config())
+
     def _check_mikrotik_secret(self):
         """
         Cek apakah secret sudah ada di Mikrotik dan statusnya di Odoo
@@ -107,25 +284,19 @@ class ISPCPE(models.Model):
         if not self.pppoe_username:
             return False, False, 'PPPoE Username tidak boleh kosong!', None
             
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+        mikrotik = self._get_mikrotik_config()
         if not mikrotik:
             return False, False, 'Konfigurasi Mikrotik tidak ditemukan!', None
             
-        api = mikrotik.get_connection()
-        if not api:
-            return False, False, 'Gagal terhubung ke Mikrotik!', None
-            
         try:
-            secret_api = api.get_resource('/ppp/secret')
-            secrets = secret_api.get(name=self.pppoe_username)
-            if secrets:
-                return True, secrets[0].get('.id'), None, secrets[0]
-            return False, False, None, None
+            with mikrotik._borrow_api() as api:
+                secret_api = api.get_resource('/ppp/secret')
+                secrets = secret_api.get(name=self.pppoe_username)
+                if secrets:
+                    return True, mikrotik._resolve_secret_id(secrets[0]), None, secrets[0]
+                return False, False, None, None
         except Exception as e:
             return False, False, str(e), None
-        finally:
-            if api and hasattr(api, 'connection_pool'):
-                api.connection_pool.disconnect()
 
     def adopt_mikrotik_secret(self):
         """
@@ -192,46 +363,40 @@ class ISPCPE(models.Model):
             }
             
         # Jika secret belum ada, buat baru di Mikrotik
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+        mikrotik = self._get_mikrotik_config()
         if not mikrotik:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
             
-        api = mikrotik.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
         try:
-            secret_api = api.get_resource('/ppp/secret')
-            secret_data = {
-                'name': self.pppoe_username,
-                'password': self.pppoe_password,
-                'service': 'pppoe',
-                'profile': self.subscription_id.package_id.profile_id.name,
-                'comment': f'Customer: {self.customer_id.name} ({self.customer_id.customer_id})',
-                'disabled': 'yes'  # Default disabled, akan di-enable oleh subscription
-            }
+            with mikrotik._borrow_api() as api:
+                secret_api = api.get_resource('/ppp/secret')
+                secret_data = {
+                    'name': self.pppoe_username,
+                    'password': self.pppoe_password,
+                    'service': 'pppoe',
+                    'profile': self.subscription_id.package_id.profile_id.name,
+                    'comment': f'Customer: {self.customer_id.name} ({self.customer_id.customer_id})',
+                    'disabled': 'yes'  # Default disabled, akan di-enable oleh subscription
+                }
             
-            secret_api.add(**secret_data)
-            self.write({'state': 'open'})
+                secret_api.add(**secret_data)
+                self.write({'state': 'open'})
             
-            # Aktifkan subscription jika masih draft
-            if self.subscription_id.state == 'draft':
-                self.subscription_id.action_open()
+                # Aktifkan subscription jika masih draft
+                if self.subscription_id.state == 'draft':
+                    self.subscription_id.action_open()
                 
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'Sukses',
-                    'message': 'CPE berhasil diaktifkan dengan membuat secret baru',
-                    'type': 'success',
+                return {
+                    'type': 'ir.actions.client',
+                    'tag': 'display_notification',
+                    'params': {
+                        'title': 'Sukses',
+                        'message': 'CPE berhasil diaktifkan dengan membuat secret baru',
+                        'type': 'success',
+                    }
                 }
-            }
         except Exception as e:
             raise ValidationError(f'Gagal mengaktifkan CPE di Mikrotik: {str(e)}')
-        finally:
-            if api and hasattr(api, 'connection_pool'):
-                api.connection_pool.disconnect()
     
     def action_isolate(self):
         """Isolir CPE"""
@@ -271,21 +436,17 @@ class ISPCPE(models.Model):
             raise ValidationError(error)
             
         if exists:
-            mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+            mikrotik = self._get_mikrotik_config()
             if not mikrotik:
                 raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
                 
-            api = mikrotik.get_connection()
-            if not api:
-                raise ValidationError('Gagal terhubung ke Mikrotik!')
-                
             try:
-                secret_api = api.get_resource('/ppp/secret')
-                secret_api.remove(id=user_id)
+                with mikrotik._borrow_api() as api:
+                    secret_api = api.get_resource('/ppp/secret')
+                    secret_api.remove(id=user_id)
+                    mikrotik._forget_secrets([self.pppoe_username])
             except Exception as e:
                 raise ValidationError(f'Gagal menghapus secret di Mikrotik: {str(e)}')
-            finally:
-                api.disconnect()
                 
         self.write({'state': 'terminated'})
         return {
@@ -223,54 +223,45 @@ class ISPCustomer(models.Model):
             raise ValidationError('Pelanggan harus memiliki minimal satu CPE!')
             
         cpe = self.cpe_ids[0]
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+        mikrotik = cpe._get_mikrotik_config()
         if not mikrotik:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
             
-        api = mikrotik.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
         try:
-            user_api = api.get_resource('/ppp/secret')
-            existing_user = user_api.get(name=cpe.pppoe_username)
+            with mikrotik._borrow_api() as api:
+                user_api = api.get_resource('/ppp/secret')
+                existing_user = user_api.get(name=cpe.pppoe_username)
             
-            if existing_user and len(existing_user) > 0:
-                user_id = existing_user[0].get('.id')
-                # Update profile dan informasi lainnya
-                user_api.set(
-                    id=user_id,
-                    profile=cpe.profile_id.name,
-                    password=cpe.pppoe_password,
-                    service='pppoe',
-                    remote_address=cpe.ip_address,
-                    comment=f'Customer: {self.name} - {self.customer_id}',
-                    disabled='no'
-                )
-                self.write({
-                    'mikrotik_user_id': user_id,
-                    'state': 'open',
-                    'is_adopted_secret': True
-                })
-                if self.cpe_ids:
-                    self.cpe_ids[0].state = 'active'
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'display_notification',
-                    'params': {
-                        'title': 'Sukses',
-                        'message': f'Secret/User PPPoE {cpe.pppoe_username} berhasil diadopsi',
-                        'type': 'success',
+                if existing_user and len(existing_user) > 0:
+                    user_id = mikrotik._resolve_secret_id(existing_user[0])
+                    # Update profile dan informasi lainnya
+                    user_api.set(
+                        id=user_id,
+                        profile=cpe.profile_id.name,
+                        password=cpe.pppoe_password,
+                        service='pppoe',
+                        remote_address=cpe.ip_address,
+                        comment=f'Customer: {self.name} - {self.customer_id}',
+                        disabled='no'
+                    )
+                    self.write({
+                        'mikrotik_user_id': user_id,
+                        'state': 'open',
+                        'is_adopted_secret': True
+                    })
+                    if self.cpe_ids:
+                        self.cpe_ids[0].state = 'active'
+                    return {
+                        'type': 'ir.actions.client',
+                        'tag': 'display_notification',
+                        'params': {
+                            'title': 'Sukses',
+                            'message': f'Secret/User PPPoE {cpe.pppoe_username} berhasil diadopsi',
+                            'type': 'success',
+                        }
                     }
-                }
         except Exception as e:
             raise ValidationError(f'Gagal mengadopsi secret: {str(e)}')
-        finally:
-            if api:
-                try:
-                    api.disconnect()
-                except:
-                    pass
 
     def _create_mikrotik_user(self):
         self.ensure_one()
@@ -281,115 +272,106 @@ class ISPCustomer(models.Model):
         if not cpe.pppoe_username or not cpe.pppoe_password:
             raise ValidationError('PPPoE Username dan Password harus diisi di CPE!')
             
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+        mikrotik = cpe._get_mikrotik_config()
         if not mikrotik:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
             
-        api = mikrotik.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
         try:
-            user_api = api.get_resource('/ppp/secret')
+            with mikrotik._borrow_api() as api:
+                user_api = api.get_resource('/ppp/secret')
             
-            # Cek apakah user sudah ada di Mikrotik
-            try:
-                existing_user = user_api.get(name=cpe.pppoe_username)
-            except Exception as e:
-                existing_user = []
+                # Cek apakah user sudah ada di Mikrotik
+                try:
+                    existing_user = user_api.get(name=cpe.pppoe_username)
+                except Exception as e:
+                    existing_user = []
                 
-            if existing_user and len(existing_user) > 0:
-                user_id = existing_user[0].get('.id')
-                if user_id:
-                    # Cek apakah secret sudah digunakan oleh pelanggan lain di Odoo
-                    existing_customer = self._check_existing_mikrotik_user(cpe.pppoe_username, user_id)
-                    if existing_customer:
-                        raise ValidationError(
-                            f'Secret/User PPPoE {cpe.pppoe_username} sudah digunakan oleh pelanggan: '
-                            f'{existing_customer.name} ({existing_customer.customer_id})\n'
-                            f'Silahkan gunakan username PPPoE yang lain.'
-                        )
+                if existing_user and len(existing_user) > 0:
+                    user_id = mikrotik._resolve_secret_id(existing_user[0])
+                    if user_id:
+                        # Cek apakah secret sudah digunakan oleh pelanggan lain di Odoo
+                        existing_customer = self._check_existing_mikrotik_user(cpe.pppoe_username, user_id)
+                        if existing_customer:
+                            raise ValidationError(
+                                f'Secret/User PPPoE {cpe.pppoe_username} sudah digunakan oleh pelanggan: '
+                                f'{existing_customer.name} ({existing_customer.customer_id})\n'
+                                f'Silahkan gunakan username PPPoE yang lain.'
+                            )
                     
-                    # Jika belum digunakan di Odoo, tampilkan wizard konfirmasi adopsi
-                    return {
-                        'type': 'ir.actions.act_window',
-                        'name': 'Konfirmasi Adopsi Secret',
-                        'res_model': 'isp.adopt.secret.wizard',
-                        'view_mode': 'form',
-                        'target': 'new',
-                        'context': {
-                            'default_customer_id': self.id,
-                            'default_secret_name': cpe.pppoe_username,
-                            'default_secret_id': user_id,
+                        # Jika belum digunakan di Odoo, tampilkan wizard konfirmasi adopsi
+                        return {
+                            'type': 'ir.actions.act_window',
+                            'name': 'Konfirmasi Adopsi Secret',
+                            'res_model': 'isp.adopt.secret.wizard',
+                            'view_mode': 'form',
+                            'target': 'new',
+                            'context': {
+                                'default_customer_id': self.id,
+                                'default_secret_name': cpe.pppoe_username,
+                                'default_secret_id': user_id,
+                            }
                         }
-                    }
             
-            # Jika user belum ada di Mikrotik, buat baru
-            try:
-                result = user_api.add(
-                    name=cpe.pppoe_username,
-                    password=cpe.pppoe_password,
-                    service='pppoe',
-                    profile=cpe.profile_id.name,
-                    remote_address=cpe.ip_address,
-                    comment=f'Customer: {self.name} - {self.customer_id}',
-                    disabled='no'
-                )
+                # Jika user belum ada di Mikrotik, buat baru
+                try:
+                    result = user_api.add(
+                        name=cpe.pppoe_username,
+                        password=cpe.pppoe_password,
+                        service='pppoe',
+                        profile=cpe.profile_id.name,
+                        remote_address=cpe.ip_address,
+                        comment=f'Customer: {self.name} - {self.customer_id}',
+                        disabled='no'
+                    )
                 
-                if isinstance(result, list) and len(result) > 0:
-                    self.write({
-                        'mikrotik_user_id': result[0].get('.id'),
-                        'state': 'open'
-                    })
-                    if self.cpe_ids:
-                        self.cpe_ids[0].state = 'active'
-                    return {
-                        'type': 'ir.actions.client',
-                        'tag': 'display_notification',
-                        'params': {
-                            'title': 'Sukses',
-                            'message': f'User PPPoE {cpe.pppoe_username} berhasil dibuat',
-                            'type': 'success',
+                    if isinstance(result, list) and len(result) > 0:
+                        self.write({
+                            'mikrotik_user_id': result[0].get('.id'),
+                            'state': 'open'
+                        })
+                        if self.cpe_ids:
+                            self.cpe_ids[0].state = 'active'
+                        return {
+                            'type': 'ir.actions.client',
+                            'tag': 'display_notification',
+                            'params': {
+                                'title': 'Sukses',
+                                'message': f'User PPPoE {cpe.pppoe_username} berhasil dibuat',
+                                'type': 'success',
+                            }
                         }
-                    }
-                return False
+                    return False
                 
-            except Exception as e:
-                if 'already exists' in str(e):
-                    # Jika error karena secret sudah ada, coba cek lagi dan tampilkan wizard adopsi
-                    try:
-                        existing_user = user_api.get(name=cpe.pppoe_username)
-                        if existing_user and len(existing_user) > 0:
-                            user_id = existing_user[0].get('.id')
-                            if user_id:
-                                existing_customer = self._check_existing_mikrotik_user(cpe.pppoe_username, user_id)
-                                if existing_customer:
-                                    raise ValidationError(
-                                        f'Secret/User PPPoE {cpe.pppoe_username} sudah digunakan oleh pelanggan: '
-                                        f'{existing_customer.name} ({existing_customer.customer_id})\n'
-                                        f'Silahkan gunakan username PPPoE yang lain.'
-                                    )
+                except Exception as e:
+                    if 'already exists' in str(e):
+                        # Jika error karena secret sudah ada, coba cek lagi dan tampilkan wizard adopsi
+                        try:
+                            existing_user = user_api.get(name=cpe.pppoe_username)
+                            if existing_user and len(existing_user) > 0:
+                                user_id = mikrotik._resolve_secret_id(existing_user[0])
+                                if user_id:
+                                    existing_customer = self._check_existing_mikrotik_user(cpe.pppoe_username, user_id)
+                                    if existing_customer:
+                                        raise ValidationError(
+                                            f'Secret/User PPPoE {cpe.pppoe_username} sudah digunakan oleh pelanggan: '
+                                            f'{existing_customer.name} ({existing_customer.customer_id})\n'
+                                            f'Silahkan gunakan username PPPoE yang lain.'
+                                        )
                                 
-                                return {
-                                    'type': 'ir.actions.act_window',
-                                    'name': 'Konfirmasi Adopsi Secret',
-                                    'res_model': 'isp.adopt.secret.wizard',
-                                    'view_mode': 'form',
-                                    'target': 'new',
-                                    'context': {
-                                        'default_customer_id': self.id,
-                                        'default_secret_name': cpe.pppoe_username,
-                                        'default_secret_id': user_id,
+                                    return {
+                                        'type': 'ir.actions.act_window',
+                                        'name': 'Konfirmasi Adopsi Secret',
+                                        'res_model': 'isp.adopt.secret.wizard',
+                                        'view_mode': 'form',
+                                        'target': 'new',
+                                        'context': {
+                                            'default_customer_id': self.id,
+                                            'default_secret_name': cpe.pppoe_username,
+                                            'default_secret_id': user_id,
+                                        }
                                     }
-                                }
-                    except Exception as e2:
-                        _logger.error(f'Error checking existing secret after add failed: {str(e2)}')
-                raise ValidationError(f'Gagal membuat user PPPoE di Mikrotik: {str(e)}')
+                        except Exception as e2:
+                            _logger.error(f'Error checking existing secret after add failed: {str(e2)}')
+                    raise ValidationError(f'Gagal membuat user PPPoE di Mikrotik: {str(e)}')
         except Exception as e:
-            raise ValidationError(f'Gagal membuat user PPPoE di Mikrotik: {str(e)}')
-        finally:
-            if api:
-                try:
-                    api.disconnect()
-                except:
-                    pass 
\ No newline at end of file
+            raise ValidationError(f'Gagal membuat user PPPoE di Mikrotik: {str(e)}')
\ No newline at end of file
@@ -14,6 +14,7 @@ class ISPInstallationFee(models.Model):
     amount = fields.Float('Jumlah', required=True, tracking=True)
     state = fields.Selection([
         ('draft', 'Draft'),
+        ('confirmed', 'Dikonfirmasi'),
         ('paid', 'Lunas'),
         ('cancelled', 'Dibatalkan')
     ], string='Status', default='draft', tracking=True)
@@ -38,8 +39,18 @@ class ISPInstallationFee(models.Model):
         for record in self:
             if record.state == 'draft':
                 record.state = 'confirmed'
-                # Buat invoice
-                record._create_invoice()
+                # Pada mode invoice gabungan, biaya instalasi ditagih bersama invoice subscription berikutnya
+                if not self.env['isp.subscription']._get_billing_flag('billing_consolidated'):
+                    record._create_invoice()
+
+    def _prepare_invoice_line(self):
+        """Nilai line invoice untuk biaya instalasi"""
+        self.ensure_one()
+        return {
+            'name': f'Biaya Instalasi - {self.installation_type_id.name}',
+            'quantity': 1,
+            'price_unit': self.amount,
+        }
 
     def _create_invoice(self):
         self.ensure_one()
@@ -47,11 +58,7 @@ class ISPInstallationFee(models.Model):
             'move_type': 'out_invoice',
             'partner_id': self.customer_id.partner_id.id,
             'invoice_date': self.date,
-            'invoice_line_ids': [(0, 0, {
-                'name': f'Biaya Instalasi - {self.installation_type_id.name}',
-                'quantity': 1,
-                'price_unit': self.amount,
-            })],
+            'invoice_line_ids': [(0, 0, self._prepare_invoice_line())],
         }
         invoice = self.env['account.move'].create(invoice_vals)
         self.invoice_id = invoice.id 
\ No newline at end of file
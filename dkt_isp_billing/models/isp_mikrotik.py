@@ -1,11 +1,574 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from types import MappingProxyType
+import hashlib
 import routeros_api
 import socket
 import logging
+import os
+import threading
+import time
+
+from ..tools.routeros_async import RouterOsAsyncPool
 
 _logger = logging.getLogger(__name__)
 
+# Error yang berarti koneksi tidak bisa dipakai lagi dan harus dibuang dari pool
+CONNECTION_ERRORS = (
+    routeros_api.exceptions.RouterOsApiConnectionError,
+    routeros_api.exceptions.FatalRouterOsApiError,
+    OSError,
+)
+
+
+class PoolExhaustedError(TimeoutError):
+    """Semua koneksi pool sedang dipakai; bukan tanda router bermasalah"""
+
+
+class RouterCircuitOpenError(ValidationError):
+    """Router ditolak tanpa membuka socket karena circuit-nya sedang terbuka"""
+
+    def __init__(self, message, retry_in):
+        super().__init__(message)
+        self.retry_in = retry_in
+
+
+class RouterOsConnectionPool:
+    """
+    Pool koneksi RouterOS API yang sudah login, dipakai bersama oleh semua request dan cron
+    dalam satu proses. Kunci pool adalah (database, config, pid) sehingga proses hasil fork
+    tidak memakai socket milik proses induk. Setiap koneksi menyimpan fingerprint kredensial;
+    perubahan host/username/password membuat koneksi lama dibuang saat dipinjam.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._idle = {}
+        self._borrowed = {}
+
+    def acquire(self, key, fingerprint, connect, max_size, idle_timeout, check_interval, wait_timeout):
+        """
+        Pinjam koneksi dari pool. Koneksi idle yang lebih lama dari check_interval dicek dulu
+        dengan perintah ringan; jika gagal, koneksi baru dibuat dengan connect().
+        Menunggu sampai wait_timeout detik jika jumlah koneksi sudah mencapai max_size.
+        """
+        deadline = time.monotonic() + wait_timeout
+        with self._lock:
+            self._evict_idle(idle_timeout)
+            while True:
+                connection, last_used = self._pop_idle(key, fingerprint)
+                if connection or self._borrowed.get(key, 0) < max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f'Semua {max_size} koneksi Mikrotik sedang dipakai')
+                self._lock.wait(remaining)
+            self._borrowed[key] = self._borrowed.get(key, 0) + 1
+
+        # Health check dan koneksi baru di luar lock agar tidak menahan thread lain
+        try:
+            if connection and time.monotonic() - last_used > check_interval and not self._ping(connection):
+                _logger.info(f'Koneksi Mikrotik {key[1]} tidak merespons, membuat koneksi baru')
+                self._close(connection)
+                connection = None
+            return connection or connect()
+        except Exception:
+            self.release(key, None, fingerprint, discard=True)
+            raise
+
+    def release(self, key, connection, fingerprint, discard=False):
+        """Kembalikan koneksi ke pool, atau tutup jika rusak/dibuang"""
+        with self._lock:
+            self._borrowed[key] = max(self._borrowed.get(key, 0) - 1, 0)
+            if connection:
+                if discard or not connection.connected:
+                    self._close(connection)
+                else:
+                    self._idle.setdefault(key, []).append((connection, fingerprint, time.monotonic()))
+            self._lock.notify()
+
+    def clear(self, dbname, config_ids):
+        """Tutup semua koneksi idle milik config tertentu"""
+        with self._lock:
+            for key in [key for key in self._idle if key[0] == dbname and key[1] in config_ids]:
+                for connection, _fingerprint, _last_used in self._idle.pop(key):
+                    self._close(connection)
+
+    def _pop_idle(self, key, fingerprint):
+        """Ambil koneksi idle terbaru yang kredensialnya masih sama"""
+        idle = self._idle.get(key, [])
+        while idle:
+            connection, connection_fingerprint, last_used = idle.pop()
+            if connection_fingerprint == fingerprint and connection.connected:
+                return connection, last_used
+            self._close(connection)
+        return None, None
+
+    def _evict_idle(self, idle_timeout):
+        """Tutup koneksi yang tidak dipakai lebih lama dari idle_timeout"""
+        now = time.monotonic()
+        for key, idle in self._idle.items():
+            expired = [entry for entry in idle if now - entry[2] > idle_timeout]
+            if expired:
+                idle[:] = [entry for entry in idle if now - entry[2] <= idle_timeout]
+                for connection, _fingerprint, _last_used in expired:
+                    self._close(connection)
+
+    @staticmethod
+    def _ping(connection):
+        try:
+            connection.get_api().get_resource('/system/identity').get()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.disconnect()
+        except Exception:
+            pass
+
+
+_connection_pool = RouterOsConnectionPool()
+
+
+def _resolve_secret_id(secret):
+    """ID secret dari baris /ppp/secret (routeros_api mengembalikan .id sebagai 'id')"""
+    if not secret:
+        return False
+    return secret.get('id') or secret.get('.id') or secret.get('.uid') or False
+
+
+def _is_disabled(value):
+    return str(value).lower() in ('true', 'yes')
+
+
+def _hash_password(password):
+    return hashlib.sha256((password or '').encode()).hexdigest()
+
+
+class SecretSnapshotCache:
+    """
+    Snapshot /ppp/secret per router dalam bentuk index ringkas
+    nama -> {'id', 'profile', 'disabled', 'password_hash', 'remote_address', 'comment'}.
+    Snapshot berlaku selama TTL dan dibuang saat kredensial router berubah
+    atau diinvalidasi secara eksplisit. Password hanya disimpan sebagai hash.
+    Index yang dikembalikan hanya-baca dan tidak pernah berubah ukuran: add/forget membuat
+    index baru (copy-on-write) di bawah lock, sehingga thread worker bisa mengiterasi
+    index lama tanpa "dictionary changed size during iteration".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def get(self, key, fingerprint, ttl):
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if not snapshot or snapshot[1] != fingerprint or time.monotonic() - snapshot[0] > ttl:
+                return None
+            return MappingProxyType(snapshot[2])
+
+    def set(self, key, fingerprint, index):
+        with self._lock:
+            index = dict(index)
+            self._snapshots[key] = (time.monotonic(), fingerprint, index)
+            return MappingProxyType(index)
+
+    def add(self, key, name, entry):
+        """Tambahkan entri yang dibaca langsung dari router (secret baru) ke snapshot"""
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot:
+                index = dict(snapshot[2])
+                index[name] = entry
+                self._snapshots[key] = (snapshot[0], snapshot[1], index)
+
+    def update(self, key, name, **values):
+        """Perbarui satu entri setelah perubahan yang dilakukan sendiri ke router"""
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot and name in snapshot[2]:
+                snapshot[2][name].update(values)
+
+    def lookup(self, key, name):
+        """Salinan satu entri dari snapshot yang masih tersimpan, tanpa memeriksa TTL"""
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            entry = snapshot[2].get(name) if snapshot else None
+            return dict(entry) if entry else None
+
+    def forget(self, key, names):
+        """Hapus entri sehingga lookup berikutnya membaca langsung dari router"""
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot and any(name in snapshot[2] for name in names):
+                index = dict(snapshot[2])
+                for name in names:
+                    index.pop(name, None)
+                self._snapshots[key] = (snapshot[0], snapshot[1], index)
+
+    def invalidate(self, dbname, config_ids):
+        with self._lock:
+            for key in [key for key in self._snapshots if key[0] == dbname and key[1] in config_ids]:
+                del self._snapshots[key]
+
+
+_secret_snapshots = SecretSnapshotCache()
+
+
+class HostResolverCache:
+    """
+    Cache resolusi DNS host router per proses. Hasil yang berhasil disimpan selama ttl detik,
+    kegagalan disimpan lebih singkat sehingga host yang tidak bisa di-resolve langsung gagal
+    tanpa menunggu resolver di setiap request.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def resolve(self, host):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(host)
+        if entry and entry[0] > now:
+            if entry[2]:
+                raise socket.gaierror(entry[2])
+            return entry[1]
+        # Resolver dipanggil di luar lock agar host lain tidak ikut menunggu
+        try:
+            address = socket.gethostbyname(host)
+        except socket.gaierror as e:
+            with self._lock:
+                self._entries[host] = (now + self.negative_ttl, None, str(e))
+            raise
+        with self._lock:
+            self._entries[host] = (now + self.ttl, address, None)
+        return address
+
+    def forget(self, hosts):
+        with self._lock:
+            for host in hosts:
+                self._entries.pop(host, None)
+
+
+_host_resolver = HostResolverCache()
+
+
+class RouterCircuitBreaker:
+    """
+    Status kesehatan router per proses: healthy, degraded (ada kegagalan) lalu open setelah
+    kegagalan berturut-turut mencapai threshold. Selama circuit open pemanggilan langsung
+    ditolak tanpa membuka socket. Setelah cooldown satu pemanggilan percobaan diizinkan;
+    jika berhasil circuit tertutup, jika gagal circuit terbuka lagi selama cooldown berikutnya.
+    Kunci sama dengan snapshot secret: (database, config).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def _get(self, key):
+        return self._states.setdefault(key, {'failures': 0, 'opened_at': None, 'trial': False})
+
+    def before_call(self, key, cooldown, open_until=None):
+        """
+        Returns: sisa detik circuit terbuka (pemanggilan harus ditolak), atau 0 jika boleh lanjut.
+        open_until: epoch akhir circuit terbuka menurut probe terakhir di database, dipakai
+        proses yang belum pernah bicara dengan router ini.
+        """
+        now = time.time()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return max((open_until or 0) - now, 0)
+            if state['opened_at'] is None:
+                return 0
+            remaining = state['opened_at'] + cooldown - now
+            if remaining > 0:
+                return remaining
+            if state['trial']:
+                # Percobaan half-open dari thread lain sedang berjalan
+                return 1
+            state['trial'] = True
+            return 0
+
+    def release_trial(self, key):
+        """Lepas jatah percobaan half-open tanpa hasil (koneksi tidak sempat dicoba)"""
+        with self._lock:
+            state = self._states.get(key)
+            if state:
+                state['trial'] = False
+
+    def record_success(self, key):
+        with self._lock:
+            state = self._get(key)
+            state.update(failures=0, opened_at=None, trial=False)
+
+    def record_failure(self, key, threshold):
+        with self._lock:
+            state = self._get(key)
+            state['failures'] += 1
+            state['trial'] = False
+            if state['failures'] >= threshold:
+                state['opened_at'] = time.time()
+            return state['failures']
+
+    def get_state(self, key):
+        """Returns: (status, jumlah gagal berturut-turut)"""
+        with self._lock:
+            state = self._states.get(key)
+            if not state or not state['failures']:
+                return 'healthy', 0
+            return 'open' if state['opened_at'] else 'degraded', state['failures']
+
+    def reset(self, dbname, config_ids):
+        with self._lock:
+            for key in [key for key in self._states if key[0] == dbname and key[1] in config_ids]:
+                del self._states[key]
+
+
+_circuit_breakers = RouterCircuitBreaker()
+
+
+@contextmanager
+def _borrow_from_pool(spec, probe=False):
+    """
+    Pinjam koneksi API dari pool proses berdasarkan spec router (lihat _get_router_spec).
+    Tidak mengakses ORM sehingga aman dipakai di thread worker.
+    Router dengan circuit terbuka langsung ditolak dengan RouterCircuitOpenError;
+    probe=True melewati pengecekan ini agar probe bisa menutup circuit lagi.
+    """
+    pool_config = spec['pool_config']
+    breaker_key = spec['snapshot_key']
+    if not probe:
+        retry_in = _circuit_breakers.before_call(
+            breaker_key, pool_config['breaker_cooldown'], spec.get('circuit_open_until')
+        )
+        if retry_in:
+            raise RouterCircuitOpenError(
+                f'Mikrotik {spec["name"]} sedang tidak dapat dihubungi, '
+                f'dicoba lagi dalam {int(retry_in) + 1} detik', retry_in
+            )
+    try:
+        connection = _connection_pool.acquire(
+            spec['pool_key'], spec['fingerprint'], spec['connect'],
+            max_size=pool_config['pool_size'],
+            idle_timeout=pool_config['pool_idle_timeout'],
+            check_interval=pool_config['pool_check_interval'],
+            wait_timeout=pool_config['pool_wait_timeout'],
+        )
+    except PoolExhaustedError as e:
+        # Pool penuh bukan tanda router mati: circuit tidak berubah, tetapi jatah percobaan
+        # half-open dilepas agar pemanggilan berikutnya bisa mencoba lagi
+        _circuit_breakers.release_trial(breaker_key)
+        raise ValidationError(f'Gagal terhubung ke Mikrotik {spec["name"]}: {str(e)}')
+    except Exception as e:
+        failures = _circuit_breakers.record_failure(breaker_key, pool_config['breaker_threshold'])
+        _logger.error(f'Get connection error {spec["name"]} (gagal ke-{failures}): {str(e)}')
+        raise ValidationError(f'Gagal terhubung ke Mikrotik {spec["name"]}: {str(e)}')
+
+    discard = False
+    try:
+        yield connection.get_api()
+    except CONNECTION_ERRORS:
+        discard = True
+        _circuit_breakers.record_failure(breaker_key, pool_config['breaker_threshold'])
+        raise
+    finally:
+        if not discard:
+            _circuit_breakers.record_success(breaker_key)
+        _connection_pool.release(spec['pool_key'], connection, spec['fingerprint'], discard=discard)
+
+
+def _secret_entry(secret):
+    return {
+        'id': _resolve_secret_id(secret),
+        'profile': secret.get('profile'),
+        'disabled': _is_disabled(secret.get('disabled')),
+        'password_hash': _hash_password(secret.get('password')),
+        'remote_address': secret.get('remote-address') or '',
+        'comment': secret.get('comment') or '',
+    }
+
+
+def _secret_fingerprint(profile, disabled, password_hash, remote_address, comment):
+    """Hash isi secret yang dikelola Odoo; sama di sisi Odoo dan snapshot router"""
+    content = '\0'.join([
+        profile or '', 'yes' if disabled else 'no', password_hash or '', remote_address or '', comment or '',
+    ])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _router_secret_fingerprint(entry, desired):
+    """
+    Fingerprint isi secret di router (entri snapshot) dengan aturan yang sama seperti isi
+    yang diinginkan Odoo, sehingga bisa dibandingkan langsung dengan fingerprint CPE
+    """
+    return _secret_fingerprint(
+        # Profile kosong di Odoo (paket tanpa profile) berarti profile router tidak dikelola
+        entry['profile'] if desired['profile'] else desired['profile'],
+        entry['disabled'], entry['password_hash'],
+        # Remote address kosong di Odoo berarti dikelola router (pool), bukan dikosongkan
+        entry.get('remote_address') if desired['remote_address'] else '',
+        entry.get('comment'),
+    )
+
+
+def _sync_secret_values(api, spec, desired_list):
+    """
+    Tulis isi secret yang berbeda dari snapshot router (di thread worker, tanpa ORM).
+    Secret yang fingerprint-nya di router sudah sama tidak dikirim. Semua set dikirim
+    dulu (pipelining) baru balasannya ditunggu.
+    desired_list: list dict {'username', 'profile', 'disabled', 'password', 'remote_address',
+                             'comment', 'fingerprint'}
+    Returns: dict {'written': [...], 'unchanged': [...], 'missing': [...], 'failed': [...]} berisi username
+    """
+    index = _load_secret_index(api, spec)
+    secret_api = api.get_resource('/ppp/secret')
+    result = {'written': [], 'unchanged': [], 'missing': [], 'failed': []}
+    pending = []
+    for desired in desired_list:
+        entry = index.get(desired['username'])
+        if not entry or not entry['id']:
+            result['missing'].append(desired['username'])
+            continue
+        if _router_secret_fingerprint(entry, desired) == desired['fingerprint']:
+            result['unchanged'].append(desired['username'])
+            continue
+        values = {
+            'id': entry['id'],
+            'disabled': 'yes' if desired['disabled'] else 'no',
+            'password': desired['password'],
+            'comment': desired['comment'],
+        }
+        # Paket tanpa profile: profile di router dibiarkan, profile='' ditolak RouterOS
+        if desired['profile']:
+            values['profile'] = desired['profile']
+        if desired['remote_address']:
+            values['remote-address'] = desired['remote_address']
+        pending.append((desired, secret_api.call_async('set', values)))
+
+    for desired, promise in pending:
+        try:
+            promise.get()
+        except routeros_api.exceptions.RouterOsApiCommunicationError as e:
+            _logger.warning(f'Gagal sinkronisasi secret {desired["username"]} di {spec["name"]}: {str(e)}')
+            result['failed'].append(desired['username'])
+            continue
+        _secret_snapshots.update(
+            spec['snapshot_key'], desired['username'],
+            profile=desired['profile'] or index[desired['username']]['profile'],
+            disabled=desired['disabled'],
+            password_hash=_hash_password(desired['password']),
+            remote_address=desired['remote_address'] or index[desired['username']].get('remote_address'),
+            comment=desired['comment'],
+        )
+        result['written'].append(desired['username'])
+    return result
+
+
+def _load_secret_index(api, spec, force=False):
+    """Index secret PPPoE sebuah router dari snapshot, dibaca ulang dari router jika kedaluwarsa"""
+    index = None if force else _secret_snapshots.get(spec['snapshot_key'], spec['fingerprint'], spec['secret_ttl'])
+    if index is None:
+        started = time.monotonic()
+        secrets = api.get_resource('/ppp/secret').call(
+            'print', {'.proplist': '.id,name,profile,disabled,password,remote-address,comment'}
+        )
+        index = _secret_snapshots.set(spec['snapshot_key'], spec['fingerprint'], {
+            secret['name']: _secret_entry(secret) for secret in secrets if secret.get('name')
+        })
+        _logger.info(
+            f'Snapshot secret {spec["name"]}: {len(index)} secret dalam {time.monotonic() - started:.2f} detik'
+        )
+    return index
+
+
+def _find_secret_entry(api, spec, name):
+    """Entri secret dari snapshot, dengan fallback lookup langsung untuk secret yang baru dibuat"""
+    if not name:
+        return None
+    index = _load_secret_index(api, spec)
+    entry = index.get(name)
+    if entry:
+        return entry
+    secrets = api.get_resource('/ppp/secret').get(name=name)
+    if not secrets:
+        return None
+    entry = _secret_entry(secrets[0])
+    _secret_snapshots.add(spec['snapshot_key'], name, entry)
+    return entry
+
+
+def _apply_secrets_disabled(api, spec, usernames, disabled):
+    """
+    Enable/disable banyak secret sekaligus pada satu router. ID di-resolve dari snapshot
+    tanpa lookup per user, lalu set dikirim per kelompok ID (RouterOS menerima daftar .id dipisah koma).
+    Returns: (username yang berhasil, username yang tidak ditemukan/gagal)
+    """
+    index = _load_secret_index(api, spec)
+    value = 'yes' if disabled else 'no'
+    found = {}
+    missing = []
+    for username in usernames:
+        entry = index.get(username)
+        if entry and entry['id']:
+            if entry['disabled'] != disabled:
+                found[username] = entry['id']
+        else:
+            missing.append(username)
+
+    secret_api = api.get_resource('/ppp/secret')
+    names = list(found)
+    chunks = [names[start:start + 100] for start in range(0, len(names), 100)]
+    # Semua perintah dikirim dulu (pipelining) baru balasannya ditunggu
+    promises = [
+        secret_api.call_async('set', {'id': ','.join(found[name] for name in chunk), 'disabled': value})
+        for chunk in chunks
+    ]
+    failed_chunks = []
+    for chunk, promise in zip(chunks, promises):
+        try:
+            promise.get()
+        except routeros_api.exceptions.RouterOsApiCommunicationError:
+            failed_chunks.append(chunk)
+    for chunk in failed_chunks:
+        # Satu ID tidak valid menggagalkan seluruh kelompok, ulangi per secret
+        for name in chunk:
+            try:
+                secret_api.set(id=found[name], disabled=value)
+            except routeros_api.exceptions.RouterOsApiCommunicationError as e:
+                _logger.warning(f'Gagal mengubah secret {name} di {spec["name"]}: {str(e)}')
+                missing.append(name)
+    for name in names:
+        if name not in missing:
+            _secret_snapshots.update(spec['snapshot_key'], name, disabled=disabled)
+    done = [username for username in usernames if username not in missing]
+    return done, missing
+
+
+def _push_profile(api, spec, profile_data):
+    """
+    Buat/update profile PPPoE di satu router (dijalankan di thread worker, tanpa ORM).
+    Returns: ID profile di router
+    """
+    profile_api = api.get_resource('/ppp/profile')
+    existing_profile = profile_api.get(name=profile_data['name'])
+    if existing_profile:
+        profile_api.set(id=existing_profile[0]['id'], **profile_data)
+        return existing_profile[0]['id']
+    profile_api.add(**profile_data)
+    created = profile_api.get(name=profile_data['name'])
+    return created[0]['id'] if created else False
+
+
 class ISPMikrotikConfig(models.Model):
     _name = 'isp.mikrotik.config'
     _description = 'Mikrotik Configuration'
@@ -17,6 +580,8 @@ class ISPMikrotikConfig(models.Model):
     username = fields.Char('Username', required=True, tracking=True)
     password = fields.Char('Password', required=True, tracking=True)
     active = fields.Boolean('Active', default=True, tracking=True)
+    async_api = fields.Boolean('Client Asyncio', tracking=True,
+                               help='Gunakan client RouterOS asyncio: banyak perintah in-flight dalam satu socket')
 
     @api.constrains('host')
     def _check_host_format(self):
@@ -40,7 +605,7 @@ class ISPMikrotikConfig(models.Model):
                 # Validasi host/IP
                 host = host_parts[0].strip()
                 try:
-                    socket.gethostbyname(host)
+                    _host_resolver.resolve(host)
                 except socket.gaierror:
                     raise ValidationError('Host/IP tidak valid')
             except Exception as e:
@@ -70,8 +635,8 @@ class ISPMikrotikConfig(models.Model):
             
             # Cek dulu apakah host bisa di-ping
             try:
-                socket.create_connection((host, port), timeout=5)
-                _logger.info('Koneksi socket berhasil')
+                with socket.create_connection((_host_resolver.resolve(host), port), timeout=5):
+                    _logger.info('Koneksi socket berhasil')
             except (socket.timeout, socket.gaierror, ConnectionRefusedError) as e:
                 raise ValidationError(f'Tidak dapat terhubung ke {host}:{port} - {str(e)}')
             
@@ -118,7 +683,260 @@ class ISPMikrotikConfig(models.Model):
                 raise ValidationError('Koneksi timeout atau ditolak oleh server')
             raise ValidationError(f'Koneksi gagal: {str(e)}')
 
+    def write(self, vals):
+        if 'host' in vals:
+            _host_resolver.forget([record.host.split(':')[0].strip() for record in self if record.host])
+        res = super().write(vals)
+        if any(field in vals for field in ['host', 'port', 'username', 'password', 'active', 'async_api']):
+            _connection_pool.clear(self.env.cr.dbname, self.ids)
+            _secret_snapshots.invalidate(self.env.cr.dbname, self.ids)
+            _circuit_breakers.reset(self.env.cr.dbname, self.ids)
+        return res
+
+    def unlink(self):
+        _connection_pool.clear(self.env.cr.dbname, self.ids)
+        _secret_snapshots.invalidate(self.env.cr.dbname, self.ids)
+        _circuit_breakers.reset(self.env.cr.dbname, self.ids)
+        return super().unlink()
+
+    def _get_pool_config(self):
+        """Konfigurasi pool koneksi dari ir.config_parameter"""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        config = {}
+        for key, default in [('pool_size', 4), ('pool_idle_timeout', 300),
+                             ('pool_check_interval', 60), ('pool_wait_timeout', 10),
+                             ('breaker_threshold', 3), ('breaker_cooldown', 60)]:
+            try:
+                config[key] = max(int(get_param(f'dkt_isp_billing.mikrotik_{key}', default)), 1)
+            except (TypeError, ValueError):
+                config[key] = default
+        return config
+
+    def _get_credential_fingerprint(self):
+        """Hash host dan kredensial untuk mendeteksi koneksi pool yang sudah kedaluwarsa"""
+        self.ensure_one()
+        credential = f'{self.host}\0{self.username}\0{self.password}\0{self.async_api}'
+        return hashlib.sha256(credential.encode()).hexdigest()
+
+    def _connect(self):
+        """
+        Buat koneksi RouterOS API baru yang sudah login dengan TCP keepalive aktif.
+        Host di-resolve lewat cache DNS proses, bukan di setiap koneksi.
+        """
+        self.ensure_one()
+        host, port = self._parse_host_port()
+        username, password = self.username, self.password
+
+        if self.async_api:
+            def connect():
+                _logger.info(f'Membuat koneksi pool asyncio ke {host}:{port}')
+                connection = RouterOsAsyncPool(host=_host_resolver.resolve(host), username=username,
+                                               password=password, port=port)
+                connection.get_api()
+                return connection
+            return connect
+
+        def connect():
+            _logger.info(f'Membuat koneksi pool ke {host}:{port}')
+            connection = routeros_api.RouterOsApiPool(
+                host=_host_resolver.resolve(host),
+                username=username,
+                password=password,
+                port=port,
+                plaintext_login=True
+            )
+            connection.get_api()
+            return connection
+        return connect
+
+    def _get_secret_ttl(self):
+        try:
+            return int(self.env['ir.config_parameter'].sudo().get_param('dkt_isp_billing.mikrotik_secret_ttl', 60))
+        except (TypeError, ValueError):
+            return 60
+
+    def _get_router_spec(self):
+        """
+        Semua data yang dibutuhkan untuk bicara dengan router ini dalam bentuk dict biasa,
+        sehingga bisa dibawa ke thread worker tanpa cursor atau akses ORM.
+        """
+        self.ensure_one()
+        return {
+            'id': self.id,
+            'name': self.name,
+            'pool_key': (self.env.cr.dbname, self.id, os.getpid()),
+            'snapshot_key': self._get_secret_snapshot_key(),
+            'fingerprint': self._get_credential_fingerprint(),
+            'connect': self._connect(),
+            'pool_config': self._get_pool_config(),
+            'secret_ttl': self._get_secret_ttl(),
+        }
+
+    @contextmanager
+    def _borrow_api(self):
+        """
+        Pinjam koneksi API yang sudah login dari pool proses:
+            with mikrotik._borrow_api() as api:
+                api.get_resource('/ppp/secret').get(name=username)
+        Koneksi dikembalikan ke pool setelah blok selesai, atau dibuang jika terjadi error koneksi.
+        """
+        self.ensure_one()
+        with _borrow_from_pool(self._get_router_spec()) as api:
+            yield api
+
+    def _get_max_workers(self):
+        try:
+            return max(int(self.env['ir.config_parameter'].sudo().get_param(
+                'dkt_isp_billing.mikrotik_max_workers', 16)), 1)
+        except (TypeError, ValueError):
+            return 16
+
+    def _run_on_routers(self, task, payloads=None, probe=False):
+        """
+        Jalankan task(api, spec, payload) di setiap router pada recordset ini secara paralel,
+        satu worker per router, sehingga total waktu mengikuti router paling lambat.
+        task berjalan di thread lain: tidak boleh mengakses self.env/ORM, cukup api dan spec.
+        payloads: dict {config_id: payload}; router tanpa payload menerima None.
+        Router dengan circuit terbuka langsung gagal dengan RouterCircuitOpenError, kecuali probe=True.
+        Returns: dict {config_id: (hasil, error)}
+        """
+        payloads = payloads or {}
+        results = {}
+        specs = {}
+        for config in self:
+            try:
+                specs[config.id] = config._get_router_spec()
+            except ValidationError as e:
+                results[config.id] = (None, e)
+
+        def run(spec):
+            try:
+                with _borrow_from_pool(spec, probe=probe) as api:
+                    return task(api, spec, payloads.get(spec['id'])), None
+            except RouterCircuitOpenError as e:
+                _logger.warning(str(e))
+                return None, e
+            except Exception as e:
+                _logger.error(f'Task router {spec["name"]} gagal: {str(e)}', exc_info=True)
+                return None, e
+
+        if len(specs) <= 1:
+            results.update({config_id: run(spec) for config_id, spec in specs.items()})
+            return results
+
+        started = time.monotonic()
+        workers = min(len(specs), self._get_max_workers())
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='isp_router') as executor:
+            futures = {config_id: executor.submit(run, spec) for config_id, spec in specs.items()}
+        results.update({config_id: future.result() for config_id, future in futures.items()})
+        _logger.info(
+            f'Task dijalankan di {len(specs)} router ({workers} worker) dalam '
+            f'{time.monotonic() - started:.2f} detik'
+        )
+        return results
+
+    @api.model
+    def _resolve_secret_id(self, secret):
+        """ID secret dari hasil /ppp/secret, tanpa menebak key di setiap caller"""
+        return _resolve_secret_id(secret)
+
+    def _get_secret_snapshot_key(self):
+        self.ensure_one()
+        return (self.env.cr.dbname, self.id)
+
+    def _get_secret_index(self, api, force=False):
+        """
+        Index secret PPPoE router ini: nama -> {'id', 'profile', 'disabled', 'password_hash',
+        'remote_address', 'comment'}.
+        /ppp/secret dibaca sekali dengan proplist ringkas lalu disimpan selama
+        dkt_isp_billing.mikrotik_secret_ttl detik (default 60).
+        """
+        self.ensure_one()
+        return _load_secret_index(api, self._get_router_spec(), force=force)
+
+    def _invalidate_secret_index(self):
+        """Buang snapshot secret router ini, misalnya setelah perubahan dari luar Odoo"""
+        _secret_snapshots.invalidate(self.env.cr.dbname, self.ids)
+
+    def _find_secret(self, api, name):
+        """
+        Entri secret berdasarkan nama dari snapshot. Nama yang tidak ada di snapshot dicek
+        langsung ke router (secret bisa baru dibuat) dan hasilnya ditambahkan ke snapshot.
+        """
+        self.ensure_one()
+        return _find_secret_entry(api, self._get_router_spec(), name)
+
+    def _update_secret_index(self, name, **values):
+        """Sesuaikan snapshot setelah secret diubah oleh Odoo"""
+        self.ensure_one()
+        _secret_snapshots.update(self._get_secret_snapshot_key(), name, **values)
+
+    def _get_cached_secret(self, name):
+        """Entri secret dari snapshot router ini tanpa menghubungi router, None jika tidak ada"""
+        self.ensure_one()
+        return _secret_snapshots.lookup(self._get_secret_snapshot_key(), name)
+
+    def _forget_secrets(self, names):
+        """Hapus secret dari snapshot setelah dibuat/dihapus oleh Odoo"""
+        self.ensure_one()
+        _secret_snapshots.forget(self._get_secret_snapshot_key(), names)
+
+    def _set_secrets_disabled(self, api, usernames, disabled):
+        """
+        Enable/disable banyak secret sekaligus di router ini.
+        Returns: (username yang berhasil, username yang tidak ditemukan/gagal)
+        """
+        self.ensure_one()
+        return _apply_secrets_disabled(api, self._get_router_spec(), usernames, disabled)
+
+    @api.model
+    def _secret_fingerprint(self, profile, disabled, password, remote_address, comment):
+        """Fingerprint isi secret yang diinginkan Odoo, dibandingkan dengan fingerprint snapshot router"""
+        return _secret_fingerprint(profile, disabled, _hash_password(password), remote_address, comment)
+
+    @api.model
+    def _router_secret_fingerprint(self, entry, desired):
+        """Fingerprint entri snapshot router untuk dibandingkan dengan fingerprint secret CPE"""
+        return _router_secret_fingerprint(entry, desired)
+
+    def _sync_secrets_per_router(self, desired_by_router):
+        """
+        Delta sync isi secret ke banyak router secara paralel.
+        desired_by_router: dict {config_id: [desired]} (lihat _sync_secret_values)
+        Returns: dict {config_id: hasil}; router yang gagal total menandai semua secret-nya failed.
+        """
+        routers = self.browse(list(desired_by_router))
+        results = routers._run_on_routers(_sync_secret_values, desired_by_router)
+        return {
+            config_id: result if error is None else {
+                'written': [], 'unchanged': [], 'missing': [],
+                'failed': [desired['username'] for desired in desired_by_router[config_id]],
+            }
+            for config_id, (result, error) in results.items()
+        }
+
+    def _set_secrets_disabled_per_router(self, usernames_by_router, disabled):
+        """
+        Enable/disable secret di banyak router secara paralel.
+        usernames_by_router: dict {config_id: [username]}
+        Returns: dict {config_id: (done, missing)}; router yang gagal total
+        mengembalikan ([], semua username).
+        """
+        routers = self.browse(list(usernames_by_router))
+        results = routers._run_on_routers(
+            lambda api, spec, usernames: _apply_secrets_disabled(api, spec, usernames, disabled),
+            usernames_by_router,
+        )
+        return {
+            config_id: result if error is None else ([], list(usernames_by_router[config_id]))
+            for config_id, (result, error) in results.items()
+        }
+
     def get_connection(self):
+        """
+        Koneksi baru di luar pool; caller wajib memanggil api.connection_pool.disconnect().
+        Gunakan _borrow_api() untuk koneksi dari pool.
+        """
         self.ensure_one()
         try:
             host, port = self._parse_host_port()
@@ -143,46 +961,22 @@ class ISPMikrotikConfig(models.Model):
     def enable_user(self, username):
         """Mengaktifkan user PPPoE di Mikrotik"""
         self.ensure_one()
-        api = self.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
         try:
-            secret_api = api.get_resource('/ppp/secret')
-            secrets = secret_api.get(name=username)
-            if secrets:
-                secret_id = secrets[0].get('id', '')
-                if secret_id:
-                    secret_api.set(id=secret_id, disabled='no')
-                    return True
-            return False
+            with self._borrow_api() as api:
+                done, missing = self._set_secrets_disabled(api, [username], disabled=False)
+                return bool(done)
         except Exception as e:
             raise ValidationError(f'Gagal mengaktifkan user di Mikrotik: {str(e)}')
-        finally:
-            if api and hasattr(api, 'connection_pool'):
-                api.connection_pool.disconnect()
 
     def disable_user(self, username):
         """Menonaktifkan user PPPoE di Mikrotik"""
         self.ensure_one()
-        api = self.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
         try:
-            secret_api = api.get_resource('/ppp/secret')
-            secrets = secret_api.get(name=username)
-            if secrets:
-                secret_id = secrets[0].get('id', '')
-                if secret_id:
-                    secret_api.set(id=secret_id, disabled='yes')
-                    return True
-            return False
+            with self._borrow_api() as api:
+                done, missing = self._set_secrets_disabled(api, [username], disabled=True)
+                return bool(done)
         except Exception as e:
             raise ValidationError(f'Gagal menonaktifkan user di Mikrotik: {str(e)}')
-        finally:
-            if api and hasattr(api, 'connection_pool'):
-                api.connection_pool.disconnect()
 
     @api.model
     def get_default_config(self):
@@ -253,29 +1047,26 @@ class ISPCustomer(models.Model):
                 return False, message
             return True, message
             
-        # Buat secret baru
+        # Buat secret baru di router CPE
+        mikrotik = cpe._get_mikrotik_config()
+        if not mikrotik:
+            return False, 'Konfigurasi Mikrotik tidak ditemukan'
         try:
-            api = self.get_connection()
-            if not api:
-                return False, 'Gagal terhubung ke Mikrotik'
+            with mikrotik._borrow_api() as api:
+                secret_api = api.get_resource('/ppp/secret')
+                secret_data = {
+                    'name': cpe.pppoe_username,
+                    'password': cpe.pppoe_password,
+                    'service': 'pppoe',
+                    'profile': cpe.active_subscription_id.package_id.profile_id.name if cpe.active_subscription_id else 'default',
+                    'comment': f'Customer: {cpe.customer_id.name} ({cpe.customer_id.customer_id})'
+                }
                 
-            secret_api = api.get_resource('/ppp/secret')
-            secret_data = {
-                'name': cpe.pppoe_username,
-                'password': cpe.pppoe_password,
-                'service': 'pppoe',
-                'profile': cpe.active_subscription_id.package_id.profile_id.name if cpe.active_subscription_id else 'default',
-                'comment': f'Customer: {cpe.customer_id.name} ({cpe.customer_id.customer_id})'
-            }
-            
-            secret_api.add(**secret_data)
-            return True, 'Secret berhasil dibuat'
+                secret_api.add(**secret_data)
+                return True, 'Secret berhasil dibuat'
         except Exception as e:
             _logger.error(f'Create Mikrotik user error: {str(e)}', exc_info=True)
             return False, str(e)
-        finally:
-            if api and hasattr(api, 'connection_pool'):
-                api.connection_pool.disconnect()
 
     def action_activate(self):
         """Aktivasi pelanggan"""
@@ -283,56 +1074,39 @@ class ISPCustomer(models.Model):
         if self.state == 'draft':
             return self.create_mikrotik_user(self.cpe_ids[0])
 
+    def _set_cpes_disabled(self, cpes, disabled):
+        """
+        Enable/disable secret CPE di router masing-masing, paralel per router.
+        Returns: CPE yang berhasil diubah
+        """
+        usernames_by_router = {}
+        for cpe in cpes:
+            mikrotik = cpe._get_mikrotik_config()
+            if not mikrotik:
+                raise ValidationError(f'Konfigurasi Mikrotik untuk CPE {cpe.name} tidak ditemukan')
+            usernames_by_router.setdefault(mikrotik.id, []).append(cpe.pppoe_username)
+        results = self.env['isp.mikrotik.config']._set_secrets_disabled_per_router(usernames_by_router, disabled)
+        done = {(config_id, username) for config_id, (usernames, missing) in results.items() for username in usernames}
+        return cpes.filtered(lambda c: (c._get_mikrotik_config().id, c.pppoe_username) in done)
+
     def action_isolate(self):
         self.ensure_one()
         if self.state == 'active':
-            mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
-            if not mikrotik:
-                raise ValidationError('Konfigurasi Mikrotik tidak ditemukan')
-                
-            api = mikrotik.get_connection()
-            if not api:
-                raise ValidationError('Gagal terhubung ke Mikrotik')
-                
             try:
-                # Isolir semua CPE aktif
-                for cpe in self.cpe_ids.filtered(lambda c: c.state == 'active'):
-                    user_api = api.get_resource('/ppp/secret')
-                    secrets = user_api.get(name=cpe.pppoe_username)
-                    if secrets:
-                        user_id = secrets[0].get('.id')
-                        user_api.set(id=user_id, disabled='yes')
-                        cpe.state = 'isolated'
+                # Isolir semua CPE aktif di router masing-masing, ID secret di-resolve dari snapshot
+                cpes = self.cpe_ids.filtered(lambda c: c.state == 'active')
+                self._set_cpes_disabled(cpes, disabled=True).write({'state': 'isolated'})
                 self.state = 'isolated'
             except Exception as e:
                 raise ValidationError(f'Gagal isolir: {str(e)}')
-            finally:
-                if api and hasattr(api, 'connection_pool'):
-                    api.connection_pool.disconnect()
 
     def action_enable(self):
         self.ensure_one()
         if self.state == 'isolated':
-            mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
-            if not mikrotik:
-                raise ValidationError('Konfigurasi Mikrotik tidak ditemukan')
-                
-            api = mikrotik.get_connection()
-            if not api:
-                raise ValidationError('Gagal terhubung ke Mikrotik')
-                
             try:
-                # Aktifkan semua CPE yang terisolir
-                for cpe in self.cpe_ids.filtered(lambda c: c.state == 'isolated'):
-                    user_api = api.get_resource('/ppp/secret')
-                    secrets = user_api.get(name=cpe.pppoe_username)
-                    if secrets:
-                        user_id = secrets[0].get('.id')
-                        user_api.set(id=user_id, disabled='no')
-                        cpe.state = 'active'
+                # Aktifkan semua CPE yang terisolir di router masing-masing
+                cpes = self.cpe_ids.filtered(lambda c: c.state == 'isolated')
+                self._set_cpes_disabled(cpes, disabled=False).write({'state': 'active'})
                 self.state = 'active'
             except Exception as e:
-                raise ValidationError(f'Gagal buka isolir: {str(e)}')
-            finally:
-                if api and hasattr(api, 'connection_pool'):
-                    api.connection_pool.disconnect() 
\ No newline at end of file
+                raise ValidationError(f'Gagal buka isolir: {str(e)}')
\ No newline at end of file
@@ -0,0 +1,179 @@
+from odoo import models, fields, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Jumlah CPE yang dibaca per chunk; cache ORM dibuang setiap chunk
+RSC_CHUNK_SIZE = 1000
+
+# Setiap baris hasil /import punya scope sendiri, variabel global harus dideklarasikan ulang
+RSC_VERIFY_GLOBALS = ':global ispVerifyErrors; :global ispVerifyChecked; '
+
+
+def _rsc_quote(value):
+    """String RouterOS script dengan escape untuk \\, ", $ dan baris baru"""
+    value = str(value or '')
+    for char, escaped in [('\\', '\\\\'), ('"', '\\"'), ('$', '\\$'), ('\n', '\\n'), ('\r', '\\r')]:
+        value = value.replace(char, escaped)
+    return f'"{value}"'
+
+
+def _rsc_args(values):
+    return ' '.join(f'{key}={_rsc_quote(value)}' if not isinstance(value, bool) else f'{key}={"yes" if value else "no"}'
+                    for key, value in values.items())
+
+
+class ISPMikrotikConfigExport(models.Model):
+    _inherit = 'isp.mikrotik.config'
+
+    def _get_export_profiles(self):
+        """Profile PPPoE yang dipakai paket untuk router ini (paket tanpa router berlaku di semua router)"""
+        self.ensure_one()
+        packages = self.env['isp.package'].search([
+            '|', ('mikrotik_id', '=', self.id), ('mikrotik_id', '=', False),
+        ])
+        return packages.profile_id.filtered('active')
+
+    def _get_export_cpe_ids(self):
+        """ID CPE dengan subscription open/terisolir yang secret-nya berada di router ini"""
+        self.ensure_one()
+        self.env['isp.cpe'].flush_model()
+        self.env['isp.subscription'].flush_model()
+        default = self.get_default_config()
+        self.env.cr.execute("""
+            SELECT cpe.id
+              FROM isp_cpe cpe
+              JOIN isp_subscription sub ON sub.id = cpe.subscription_id
+         LEFT JOIN isp_package package ON package.id = sub.package_id
+             WHERE cpe.pppoe_username IS NOT NULL
+               AND sub.state IN ('open', 'isolated')
+               AND COALESCE(cpe.mikrotik_id, package.mikrotik_id, %(default)s) = %(router_id)s
+          ORDER BY cpe.id
+        """, {'default': default.id or None, 'router_id': self.id})
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _iter_cpe_secret_values(self):
+        """Isi secret yang diinginkan per CPE, dibaca per chunk agar memori tetap kecil"""
+        cpe_ids = self._get_export_cpe_ids()
+        Cpe = self.env['isp.cpe']
+        for start in range(0, len(cpe_ids), RSC_CHUNK_SIZE):
+            for cpe in Cpe.browse(cpe_ids[start:start + RSC_CHUNK_SIZE]):
+                values = cpe._prepare_secret_values()
+                if values:
+                    yield values
+            self.env.invalidate_all()
+
+    def _iter_rsc_script(self, verify=False):
+        """
+        Script RouterOS (.rsc) untuk router ini, dihasilkan per chunk baris.
+        Script provisioning bersifat idempotent: item dibuat jika belum ada lalu di-set
+        ke status yang diinginkan, sehingga aman di-import ulang. Script verify hanya
+        membandingkan dan mencetak selisih tanpa mengubah router.
+        """
+        self.ensure_one()
+        header = [
+            f'# {"Verifikasi" if verify else "Provisioning"} PPPoE {self.name} dari Odoo',
+            f'# Dibuat {fields.Datetime.now()} UTC',
+        ]
+        if verify:
+            header += [':global ispVerifyErrors 0', ':global ispVerifyChecked 0']
+        yield '\n'.join(header) + '\n'
+
+        lines = ['/ppp profile']
+        for profile in self._get_export_profiles():
+            values = {'rate-limit': profile.rate_limit}
+            if profile.local_address:
+                values['local-address'] = profile.local_address
+            if profile.remote_address:
+                values['remote-address'] = profile.remote_address
+            if profile.parent_queue:
+                values['parent-queue'] = profile.parent_queue
+            if profile.only_one:
+                values['only-one'] = True
+            lines.append(self._rsc_profile_line(profile.name, values, verify))
+        yield '\n'.join(lines) + '\n'
+
+        yield '/ppp secret\n'
+        lines = []
+        count = 0
+        for values in self._iter_cpe_secret_values():
+            lines.append(self._rsc_secret_line(values, verify))
+            count += 1
+            if len(lines) >= RSC_CHUNK_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+        if verify:
+            yield (
+                f'{RSC_VERIFY_GLOBALS}:put ("Verifikasi selesai: " . $ispVerifyChecked . " item dicek, " '
+                f'. $ispVerifyErrors . " selisih")\n'
+            )
+        else:
+            yield f':log info {_rsc_quote(f"Provisioning Odoo selesai: {count} secret")}\n'
+        _logger.info(f'Export RSC {self.name}: {count} secret (verify={verify})')
+
+    @api.model
+    def _rsc_profile_line(self, name, values, verify):
+        find = f'[find name={_rsc_quote(name)}]'
+        if not verify:
+            return (
+                f':if ([:len {find}] = 0) do={{ add name={_rsc_quote(name)} }}\n'
+                f'set {find} {_rsc_args(values)}'
+            )
+        return (
+            f'{RSC_VERIFY_GLOBALS}:set ispVerifyChecked ($ispVerifyChecked + 1); '
+            f':if ([:len {find}] = 0) do={{ :put ("TIDAK ADA profile " . {_rsc_quote(name)}); '
+            f':set ispVerifyErrors ($ispVerifyErrors + 1) }} else={{ '
+            f':if ([get {find} rate-limit] != {_rsc_quote(values["rate-limit"])}) '
+            f'do={{ :put ("SELISIH profile " . {_rsc_quote(name)}); :set ispVerifyErrors ($ispVerifyErrors + 1) }} }}'
+        )
+
+    @api.model
+    def _rsc_secret_line(self, values, verify):
+        name = values['username']
+        find = f'[find name={_rsc_quote(name)}]'
+        if not verify:
+            args = {
+                'password': values['password'],
+                'disabled': values['disabled'],
+                'comment': values['comment'],
+            }
+            # Paket tanpa profile: profile di router dibiarkan, profile="" ditolak RouterOS
+            if values['profile']:
+                args['profile'] = values['profile']
+            if values['remote_address']:
+                args['remote-address'] = values['remote_address']
+            return (
+                f':if ([:len {find}] = 0) do={{ add name={_rsc_quote(name)} service=pppoe }}\n'
+                f'set {find} {_rsc_args(args)}'
+            )
+        # Profile hanya dibandingkan jika dikelola Odoo (paket memiliki profile)
+        profile_check = f'[get {find} profile] != {_rsc_quote(values["profile"])} || ' if values['profile'] else ''
+        return (
+            f'{RSC_VERIFY_GLOBALS}:set ispVerifyChecked ($ispVerifyChecked + 1); '
+            f':if ([:len {find}] = 0) do={{ :put ("TIDAK ADA " . {_rsc_quote(name)}); '
+            f':set ispVerifyErrors ($ispVerifyErrors + 1) }} else={{ '
+            f':if ({profile_check}[get {find} disabled] != {"true" if values["disabled"] else "false"} '
+            f'|| [get {find} password] != {_rsc_quote(values["password"])}) '
+            f'do={{ :put ("SELISIH " . {_rsc_quote(name)}); :set ispVerifyErrors ($ispVerifyErrors + 1) }} }}'
+        )
+
+    def action_export_rsc(self):
+        """Unduh script provisioning .rsc router ini"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/dkt_isp_billing/mikrotik/{self.id}/provision.rsc',
+            'target': 'self',
+        }
+
+    def action_export_rsc_verify(self):
+        """Unduh script verifikasi .rsc router ini"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/dkt_isp_billing/mikrotik/{self.id}/verify.rsc',
+            'target': 'self',
+        }
\ No newline at end of file
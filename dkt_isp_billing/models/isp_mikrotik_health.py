@@ -0,0 +1,138 @@
+from odoo import models, fields, api
+from datetime import timedelta, timezone
+import logging
+import time
+
+from .isp_mikrotik import _circuit_breakers
+
+_logger = logging.getLogger(__name__)
+
+HEALTH_STATES = [
+    ('healthy', 'Sehat'),
+    ('degraded', 'Terganggu'),
+    ('open', 'Circuit Terbuka'),
+]
+
+
+def _probe_identity(api, spec, payload):
+    """Perintah ringan untuk mengukur latensi router dalam milidetik (di thread worker, tanpa ORM)"""
+    started = time.monotonic()
+    api.get_resource('/system/identity').get()
+    return (time.monotonic() - started) * 1000
+
+
+class ISPMikrotikConfigHealth(models.Model):
+    _inherit = 'isp.mikrotik.config'
+
+    health_state = fields.Selection(HEALTH_STATES, string='Kesehatan', default='healthy', readonly=True, copy=False)
+    health_checked = fields.Datetime('Probe Terakhir', readonly=True, copy=False)
+    health_latency = fields.Float('Latensi (ms)', readonly=True, copy=False)
+    health_failures = fields.Integer('Gagal Berturut-turut', readonly=True, copy=False)
+    health_message = fields.Text('Error Terakhir', readonly=True, copy=False)
+    health_ids = fields.One2many('isp.mikrotik.health', 'mikrotik_id', string='Riwayat Kesehatan')
+
+    def _get_router_spec(self):
+        """
+        Proses yang belum pernah bicara dengan router ini memakai hasil probe terakhir:
+        circuit dianggap terbuka sampai cooldown sejak probe gagal terakhir habis.
+        """
+        spec = super()._get_router_spec()
+        if self.health_state == 'open' and self.health_checked:
+            opened_at = self.health_checked.replace(tzinfo=timezone.utc).timestamp()
+            spec['circuit_open_until'] = opened_at + spec['pool_config']['breaker_cooldown']
+        return spec
+
+    def _get_health_config(self):
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        config = {}
+        for key, default in [('mikrotik_degraded_latency', 1000), ('mikrotik_health_history_days', 7)]:
+            try:
+                config[key] = max(int(get_param(f'dkt_isp_billing.{key}', default)), 1)
+            except (TypeError, ValueError):
+                config[key] = default
+        return config
+
+    def _probe_health(self):
+        """
+        Probe semua router pada recordset ini secara paralel, melewati circuit breaker,
+        lalu simpan status kesehatan dan riwayatnya.
+        """
+        config = self._get_health_config()
+        results = self._run_on_routers(_probe_identity, probe=True)
+        now = fields.Datetime.now()
+        history = []
+        for router in self:
+            latency, error = results[router.id]
+            state, failures = _circuit_breakers.get_state(router._get_secret_snapshot_key())
+            if error is None:
+                state = 'degraded' if latency > config['mikrotik_degraded_latency'] else 'healthy'
+            elif state == 'healthy':
+                # Gagal sebelum koneksi dibuat (misalnya format host), tidak tercatat di breaker
+                state, failures = 'degraded', router.health_failures + 1
+            if state != router.health_state:
+                _logger.warning(f'Kesehatan Mikrotik {router.name}: {router.health_state} -> {state}')
+            values = {
+                'health_state': state,
+                'health_checked': now,
+                'health_latency': latency or 0.0,
+                'health_failures': failures,
+                'health_message': str(error) if error is not None else False,
+            }
+            router.write(values)
+            history.append({
+                'mikrotik_id': router.id,
+                'date': now,
+                'state': state,
+                'latency': values['health_latency'],
+                'failures': failures,
+                'message': values['health_message'],
+            })
+        self.env['isp.mikrotik.health'].create(history)
+        return results
+
+    @api.model
+    def cron_probe_routers(self):
+        """Probe berkala semua router aktif dan buang riwayat kesehatan yang sudah lama"""
+        routers = self.search([('active', '=', True)])
+        if routers:
+            routers._probe_health()
+        days = self._get_health_config()['mikrotik_health_history_days']
+        self.env['isp.mikrotik.health']._prune(fields.Datetime.now() - timedelta(days=days))
+
+    def action_probe_health(self):
+        self.ensure_one()
+        self._probe_health()
+        labels = dict(HEALTH_STATES)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Probe Selesai',
+                'message': f'{self.name}: {labels[self.health_state]} ({self.health_latency:.0f} ms)',
+                'type': 'success' if self.health_state == 'healthy' else 'warning',
+            }
+        }
+
+
+class ISPMikrotikHealth(models.Model):
+    _name = 'isp.mikrotik.health'
+    _description = 'Riwayat Kesehatan Mikrotik'
+    _order = 'date desc, id desc'
+    _rec_name = 'mikrotik_id'
+
+    mikrotik_id = fields.Many2one('isp.mikrotik.config', string='Router', required=True,
+                                  ondelete='cascade', index=True)
+    date = fields.Datetime('Waktu', required=True, default=fields.Datetime.now, index=True)
+    state = fields.Selection(HEALTH_STATES, string='Kesehatan', required=True)
+    latency = fields.Float('Latensi (ms)')
+    failures = fields.Integer('Gagal Berturut-turut')
+    message = fields.Text('Error')
+
+    @api.model
+    def _prune(self, before):
+        """Hapus riwayat sebelum tanggal tertentu langsung dengan SQL (tabel log tanpa relasi masuk)"""
+        self.env.cr.execute("DELETE FROM isp_mikrotik_health WHERE date < %s", [before])
+        deleted = self.env.cr.rowcount
+        self.invalidate_model()
+        if deleted:
+            _logger.info(f'{deleted} riwayat kesehatan Mikrotik dihapus')
\ No newline at end of file
@@ -1,6 +1,14 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
+from .isp_mikrotik import _push_profile
+
+
+def _read_profiles(api, spec, payload):
+    """Baca semua profile PPPoE satu router (dijalankan di thread worker, tanpa ORM)"""
+    return api.get_resource('/ppp/profile').get()
+
+
 class ISPMikrotikProfile(models.Model):
     _name = 'isp.mikrotik.profile'
     _description = 'Mikrotik PPPoE Profile'
@@ -23,87 +31,97 @@ class ISPMikrotikProfile(models.Model):
         for record in self:
             record.package_count = len(record.package_ids)
 
+    def _get_target_routers(self):
+        """
+        Router tujuan profile: router paket yang memakai profile ini, atau semua router
+        aktif jika profile belum dipakai paket atau dipakai paket tanpa router.
+        """
+        packages = self.package_ids
+        if packages and all(packages.mapped('mikrotik_id')):
+            return packages.mapped('mikrotik_id').filtered('active')
+        return self.env['isp.mikrotik.config'].search([('active', '=', True)])
+
     def action_sync_from_mikrotik(self):
-        """Sinkronisasi profile dari Mikrotik Router"""
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
-        if not mikrotik:
+        """Sinkronisasi profile dari semua router aktif, dibaca paralel per router"""
+        routers = self.env['isp.mikrotik.config'].search([('active', '=', True)])
+        if not routers:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
-            
-        api = mikrotik.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
-        try:
-            profile_api = api.get_resource('/ppp/profile')
-            profiles = profile_api.get()
-            
-            for profile in profiles:
-                existing = self.search([('name', '=', profile['name'])], limit=1)
-                vals = {
-                    'name': profile['name'],
-                    'mikrotik_id': profile.get('id', ''),
-                    'rate_limit': profile.get('rate-limit', ''),
-                    'local_address': profile.get('local-address', ''),
-                    'remote_address': profile.get('remote-address', ''),
-                    'parent_queue': profile.get('parent-queue', ''),
-                    'only_one': profile.get('only-one', False),
-                }
-                
-                if existing:
-                    existing.write(vals)
-                else:
-                    self.create(vals)
-                    
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'Sukses',
-                    'message': 'Profile berhasil disinkronkan dari Mikrotik',
-                    'type': 'success',
-                }
+
+        results = routers._run_on_routers(_read_profiles)
+        failed = routers.filtered(lambda router: results[router.id][1] is not None)
+        if failed == routers:
+            errors = ', '.join(f'{router.name}: {results[router.id][1]}' for router in failed)
+            raise ValidationError(f'Gagal sinkronisasi profile dari Mikrotik: {errors}')
+
+        # Profile dengan nama sama di beberapa router digabung; router pertama menentukan isinya
+        profiles = {}
+        for router in routers - failed:
+            for profile in results[router.id][0]:
+                profiles.setdefault(profile['name'], profile)
+        existing = {profile.name: profile for profile in self.search([('name', 'in', list(profiles))])}
+        to_create = []
+        for name, profile in profiles.items():
+            vals = {
+                'name': name,
+                'mikrotik_id': profile.get('id', ''),
+                'rate_limit': profile.get('rate-limit', ''),
+                'local_address': profile.get('local-address', ''),
+                'remote_address': profile.get('remote-address', ''),
+                'parent_queue': profile.get('parent-queue', ''),
+                'only_one': profile.get('only-one', False),
             }
-        except Exception as e:
-            raise ValidationError(f'Gagal sinkronisasi profile dari Mikrotik: {str(e)}')
+            if name in existing:
+                existing[name].write(vals)
+            else:
+                to_create.append(vals)
+        self.create(to_create)
+
+        message = f'{len(profiles)} profile berhasil disinkronkan dari {len(routers - failed)} router Mikrotik'
+        if failed:
+            message += f'; gagal dibaca: {", ".join(failed.mapped("name"))}'
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses' if not failed else 'Peringatan',
+                'message': message,
+                'type': 'success' if not failed else 'warning',
+            }
+        }
 
     def action_create_in_mikrotik(self):
-        """Membuat profile baru di Mikrotik Router"""
+        """Membuat/memperbarui profile di router tujuan, paralel per router"""
         self.ensure_one()
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
-        if not mikrotik:
+        routers = self._get_target_routers()
+        if not routers:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
-            
-        api = mikrotik.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
-        try:
-            profile_api = api.get_resource('/ppp/profile')
-            profile_data = {
-                'name': self.name,
-                'rate-limit': self.rate_limit,
-            }
-            
-            if self.local_address:
-                profile_data['local-address'] = self.local_address
-            if self.remote_address:
-                profile_data['remote-address'] = self.remote_address
-            if self.parent_queue:
-                profile_data['parent-queue'] = self.parent_queue
-            if self.only_one:
-                profile_data['only-one'] = self.only_one
-                
-            result = profile_api.add(**profile_data)
-            self.mikrotik_id = result['ret']
-            
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'Sukses',
-                    'message': f'Profile {self.name} berhasil dibuat di Mikrotik',
-                    'type': 'success',
-                }
+
+        profile_data = {
+            'name': self.name,
+            'rate-limit': self.rate_limit,
+        }
+        if self.local_address:
+            profile_data['local-address'] = self.local_address
+        if self.remote_address:
+            profile_data['remote-address'] = self.remote_address
+        if self.parent_queue:
+            profile_data['parent-queue'] = self.parent_queue
+        if self.only_one:
+            profile_data['only-one'] = self.only_one
+
+        results = routers._run_on_routers(_push_profile, {router.id: profile_data for router in routers})
+        failed = routers.filtered(lambda router: results[router.id][1] is not None)
+        if failed:
+            errors = ', '.join(f'{router.name}: {results[router.id][1]}' for router in failed)
+            raise ValidationError(f'Gagal membuat profile di Mikrotik: {errors}')
+        self.mikrotik_id = results[routers[0].id][0]
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses',
+                'message': f'Profile {self.name} berhasil dibuat di {len(routers)} router Mikrotik',
+                'type': 'success',
             }
-        except Exception as e:
-            raise ValidationError(f'Gagal membuat profile di Mikrotik: {str(e)}') 
\ No newline at end of file
+        }
\ No newline at end of file
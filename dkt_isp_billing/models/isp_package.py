@@ -1,6 +1,9 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
+from .isp_mikrotik import _push_profile
+
+
 class ISPPackage(models.Model):
     _name = 'isp.package'
     _description = 'ISP Package'
@@ -15,6 +18,9 @@ class ISPPackage(models.Model):
     price = fields.Float('Harga', required=True, tracking=True)
     description = fields.Text('Deskripsi', tracking=True)
     active = fields.Boolean('Active', default=True, tracking=True)
+    mikrotik_id = fields.Many2one('isp.mikrotik.config', string='Router Mikrotik', tracking=True,
+                                  help="Router untuk subscription paket ini. Kosongkan agar profile "
+                                       "disinkronkan ke semua router aktif.")
     
     subscription_ids = fields.One2many('isp.subscription', 'package_id', string='Subscriptions')
     subscription_count = fields.Integer(compute='_compute_subscription_count')
@@ -114,44 +120,34 @@ class ISPPackage(models.Model):
             'comment': f'Created by Odoo - {self.name}'
         }
 
+    def _get_profile_routers(self):
+        """Router tujuan profile paket: router paket, atau semua router aktif"""
+        self.ensure_one()
+        return self.mikrotik_id or self.env['isp.mikrotik.config'].search([('active', '=', True)])
+
     def action_sync_to_mikrotik(self):
-        """Sinkronkan paket ke Mikrotik sebagai profile."""
+        """Sinkronkan paket ke Mikrotik sebagai profile, paralel ke setiap router tujuan."""
         self.ensure_one()
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
-        if not mikrotik:
+        routers = self._get_profile_routers()
+        if not routers:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
-            
-        api = mikrotik.get_connection()
-        if not api:
-            raise ValidationError('Gagal terhubung ke Mikrotik!')
-            
-        try:
-            profile_api = api.get_resource('/ppp/profile')
-            profile_data = self._prepare_mikrotik_profile_data()
-            
-            # Cek apakah profile sudah ada
-            existing_profile = profile_api.get(name=self.name)
-            
-            if existing_profile:
-                # Update profile yang ada
-                profile_api.set(id=existing_profile[0]['id'], **profile_data)
-            else:
-                # Buat profile baru
-                result = profile_api.add(**profile_data)
-                
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': 'Sukses',
-                    'message': f'Profile {self.name} berhasil disinkronkan ke Mikrotik',
-                    'type': 'success',
-                }
+
+        profile_data = self._prepare_mikrotik_profile_data()
+        results = routers._run_on_routers(_push_profile, {router.id: profile_data for router in routers})
+        failed = routers.filtered(lambda router: results[router.id][1] is not None)
+        if failed:
+            errors = ', '.join(f'{router.name}: {results[router.id][1]}' for router in failed)
+            raise ValidationError(f'Gagal sinkronisasi profile ke Mikrotik: {errors}')
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses',
+                'message': f'Profile {self.name} berhasil disinkronkan ke {len(routers)} router Mikrotik',
+                'type': 'success',
             }
-        except Exception as e:
-            raise ValidationError(f'Gagal sinkronisasi profile ke Mikrotik: {str(e)}')
-        finally:
-            api.disconnect()
+        }
 
     def write(self, vals):
         """Override write untuk update profile di Mikrotik jika ada perubahan bandwidth."""
@@ -1,5 +1,7 @@
 from odoo import models, fields, api
+from odoo.tools.misc import format_date
 from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
 
 class ISPReport(models.Model):
     _name = 'isp.report'
@@ -19,6 +21,17 @@ class ISPReport(models.Model):
         ('draft', 'Draft'),
         ('generated', 'Generated')
     ], default='draft', string='Status')
+
+    @api.onchange('report_type', 'date_from', 'date_to')
+    def _onchange_month_bounds(self):
+        """Laporan keuangan dan laba rugi dihitung per bulan penuh, tanggal disesuaikan ke awal/akhir bulan"""
+        if self.report_type in ['financial', 'profit_loss'] and self.date_from and self.date_to:
+            self.date_from, self.date_to = self._get_month_bounds(self.date_from, self.date_to)
+
+    @api.model
+    def _get_month_bounds(self, date_from, date_to):
+        """Rentang bulan penuh yang memuat date_from sampai date_to"""
+        return date_from.replace(day=1), date_to + relativedelta(day=31)
     
     def action_generate_report(self):
         self.ensure_one()
@@ -88,73 +101,231 @@ class ISPReport(models.Model):
         }
         return self.env.ref('dkt_isp_billing.action_report_profit_loss').report_action(self, data=data)
 
+    @api.model
+    def _get_subscription_revenue(self, date_from, date_to):
+        """
+        Pendapatan berlangganan per bulan dan paket dari isp.revenue.snapshot, sehingga biaya
+        laporan mengikuti jumlah bulan, bukan jumlah invoice. Periode dibulatkan ke bulan penuh.
+        Returns: list tuple (bulan, package_id, jumlah tagihan, pendapatan, terbayar, belum terbayar)
+        """
+        date_from, date_to = self._get_month_bounds(date_from, date_to)
+        groups = self.env['isp.revenue.snapshot']._read_group(
+            [('month', '>=', date_from), ('month', '<=', date_to)],
+            ['month:month', 'package_id'],
+            ['billed_count:sum', 'billed_amount:sum', 'discount_amount:sum',
+             'collected_amount:sum', 'outstanding_amount:sum'],
+        )
+        return [
+            (month, package.id, count, billed - discount, collected, outstanding)
+            for month, package, count, billed, discount, collected, outstanding in groups
+        ]
+
+    @api.model
+    def _get_financial_values(self, date_from, date_to):
+        """
+        Total dan rincian per bulan/paket/jenis instalasi untuk laporan keuangan dan laba rugi.
+        Pendapatan berlangganan, biaya instalasi dan biaya perangkat dihitung atas bulan penuh
+        yang sama, sehingga satu laporan tidak mencampur dua rentang periode.
+        """
+        date_from, date_to = self._get_month_bounds(date_from, date_to)
+        months = {}
+
+        def month_row(month):
+            return months.setdefault(month, {'subscription': 0.0, 'collected': 0.0, 'outstanding': 0.0,
+                                             'installation': 0.0, 'device_cost': 0.0})
+
+        package_totals = {}
+        for month, package_id, count, amount, collected, outstanding in self._get_subscription_revenue(date_from, date_to):
+            row = month_row(month)
+            row['subscription'] += amount
+            row['collected'] += collected
+            row['outstanding'] += outstanding
+            totals = package_totals.setdefault(package_id, {'count': 0, 'amount': 0.0})
+            totals['count'] += count
+            totals['amount'] += amount
+        package_names = {package.id: package.name for package in self.env['isp.package'].browse(list(package_totals))}
+        package_lines = sorted([
+            dict(totals, name=package_names.get(package_id) or '-')
+            for package_id, totals in package_totals.items()
+        ], key=lambda line: -line['amount'])
+
+        installation_domain = [
+            ('date', '>=', date_from),
+            ('date', '<=', date_to),
+            ('state', 'in', ['confirmed', 'paid']),
+        ]
+        Installation = self.env['isp.installation.fee']
+        for month, amount in Installation._read_group(installation_domain, ['date:month'], ['amount:sum']):
+            month_row(month)['installation'] += amount
+        installation_lines = sorted([
+            {'name': installation_type.name, 'count': count, 'amount': amount}
+            for installation_type, count, amount in Installation._read_group(
+                installation_domain, ['installation_type_id'], ['__count', 'amount:sum'])
+        ], key=lambda line: -line['amount'])
+
+        device_domain = [('date', '>=', date_from), ('date', '<=', date_to)]
+        for month, cost in self.env['isp.device.history']._read_group(device_domain, ['date:month'], ['cost:sum']):
+            month_row(month)['device_cost'] += cost
+
+        month_lines = []
+        for month in sorted(months):
+            row = months[month]
+            row.update({
+                'name': format_date(self.env, month, date_format='MMMM yyyy'),
+                'revenue': row['subscription'] + row['installation'],
+            })
+            month_lines.append(row)
+
+        total_subscription = sum(row['subscription'] for row in month_lines)
+        total_collected = sum(row['collected'] for row in month_lines)
+        total_outstanding = sum(row['outstanding'] for row in month_lines)
+        total_installation = sum(row['installation'] for row in month_lines)
+        total_device_cost = sum(row['device_cost'] for row in month_lines)
+        # Contoh biaya maintenance (bisa disesuaikan)
+        total_maintenance = 1000000
+        return {
+            'currency': self.env.company.currency_id,
+            'month_lines': month_lines,
+            'package_lines': package_lines,
+            'installation_lines': installation_lines,
+            'total_subscription': total_subscription,
+            'total_collected': total_collected,
+            'total_outstanding': total_outstanding,
+            'total_installation': total_installation,
+            'total_revenue': total_subscription + total_installation,
+            'total_device_cost': total_device_cost,
+            'total_maintenance': total_maintenance,
+            'total_cost': total_device_cost + total_maintenance,
+        }
+
+    def _selection_labels(self, model, field):
+        return dict(self.env[model]._fields[field]._description_selection(self.env))
+
+    @api.model
+    def _get_customer_lines(self, date_from, date_to):
+        """
+        Baris laporan pelanggan sebagai dict. Paket aktif dan jumlah CPE diagregasi dalam
+        satu query, sehingga jumlah query tidak bergantung pada jumlah pelanggan.
+        """
+        self.env['isp.customer'].flush_model()
+        self.env['isp.cpe'].flush_model()
+        self.env['isp.subscription'].flush_model()
+        self.env['isp.package'].flush_model()
+        self.env.cr.execute("""
+            SELECT c.customer_id, c.name, c.mobile, c.address, c.state, c.create_date,
+                   sub.packages, COALESCE(cpe.total, 0)
+              FROM isp_customer c
+         LEFT JOIN (
+                    SELECT sub.customer_id, string_agg(DISTINCT package.name, ', ') AS packages
+                      FROM isp_subscription sub
+                      JOIN isp_package package ON package.id = sub.package_id
+                     WHERE sub.state = 'open'
+                  GROUP BY sub.customer_id
+                   ) sub ON sub.customer_id = c.id
+         LEFT JOIN (
+                    SELECT customer_id, COUNT(*) AS total
+                      FROM isp_cpe
+                     WHERE active
+                  GROUP BY customer_id
+                   ) cpe ON cpe.customer_id = c.id
+             WHERE c.active
+               AND c.create_date >= %s
+               AND c.create_date < %s
+          ORDER BY c.id
+        """, [date_from, date_to + timedelta(days=1)])
+        states = self._selection_labels('isp.customer', 'state')
+        return [{
+            'customer_id': customer_id or '',
+            'name': name,
+            'mobile': mobile or '',
+            'address': address or '',
+            'packages': packages or '-',
+            'cpe_count': cpe_count,
+            'state': states.get(state, state or ''),
+            'create_date': create_date,
+        } for customer_id, name, mobile, address, state, create_date, packages, cpe_count in self.env.cr.fetchall()]
+
+    @api.model
+    def _get_cpe_lines(self, date_from, date_to):
+        """Baris laporan CPE sebagai dict, pelanggan dan paket di-join dalam satu query"""
+        self.env['isp.cpe'].flush_model()
+        self.env['isp.customer'].flush_model()
+        self.env['isp.subscription'].flush_model()
+        self.env['isp.package'].flush_model()
+        self.env.cr.execute("""
+            SELECT customer.name, cpe.name, cpe.ip_address, cpe.pppoe_username, package.name,
+                   cpe.ownership, cpe.state
+              FROM isp_cpe cpe
+              JOIN isp_customer customer ON customer.id = cpe.customer_id
+         LEFT JOIN isp_subscription sub ON sub.id = cpe.subscription_id
+         LEFT JOIN isp_package package ON package.id = sub.package_id
+             WHERE cpe.active
+               AND cpe.create_date >= %s
+               AND cpe.create_date < %s
+          ORDER BY cpe.id
+        """, [date_from, date_to + timedelta(days=1)])
+        ownerships = self._selection_labels('isp.cpe', 'ownership')
+        states = self._selection_labels('isp.cpe', 'state')
+        return [{
+            'customer': customer,
+            'name': name,
+            'ip_address': ip_address or '',
+            'pppoe_username': pppoe_username or '',
+            'package': package or '-',
+            'ownership': ownerships.get(ownership, ownership or ''),
+            'state': states.get(state, state or ''),
+        } for customer, name, ip_address, pppoe_username, package, ownership, state in self.env.cr.fetchall()]
+
+    @api.model
+    def _get_package_lines(self):
+        """Baris laporan paket sebagai dict dengan jumlah subscription dan pelanggan aktif per paket"""
+        self.env['isp.package'].flush_model()
+        self.env['isp.subscription'].flush_model()
+        self.env.cr.execute("""
+            SELECT package.name, package.price, package.bandwidth_up, package.bandwidth_down,
+                   COUNT(sub.id), COUNT(DISTINCT sub.customer_id)
+              FROM isp_package package
+         LEFT JOIN isp_subscription sub ON sub.package_id = package.id AND sub.state = 'open'
+             WHERE package.active
+          GROUP BY package.id
+          ORDER BY package.name, package.id
+        """)
+        return [{
+            'name': name,
+            'price': price or 0.0,
+            'bandwidth_up': bandwidth_up or 0,
+            'bandwidth_down': bandwidth_down or 0,
+            'subscription_count': subscription_count,
+            'customer_count': customer_count,
+        } for name, price, bandwidth_up, bandwidth_down, subscription_count, customer_count in self.env.cr.fetchall()]
+
     def _get_report_values(self, docids, data=None):
         docs = self.env['isp.report'].browse(docids)
-        date_from = data['form']['date_from']
-        date_to = data['form']['date_to']
-        
+        if data and data.get('form'):
+            date_from = fields.Date.to_date(data['form']['date_from'])
+            date_to = fields.Date.to_date(data['form']['date_to'])
+        else:
+            date_from, date_to = docs[:1].date_from, docs[:1].date_to
+
+        # Template hanya menerima dict yang sudah dihitung per baris; tidak ada akses relasi
+        # per baris di QWeb sehingga jumlah query tetap untuk berapa pun jumlah baris
+        values = {
+            'doc_ids': docids,
+            'doc_model': 'isp.report',
+            'docs': docs,
+        }
+        # Render bertahap (antrian laporan) mengirim potongan baris yang sudah dihitung lewat data['lines']
+        lines = data.get('lines') if data else None
         if docs.report_type == 'customer':
-            customers = self.env['isp.customer'].search([
-                ('create_date', '>=', date_from),
-                ('create_date', '<=', date_to)
-            ])
-            return {
-                'doc_ids': docids,
-                'doc_model': 'isp.report',
-                'docs': docs,
-                'customers': customers,
-            }
+            values['customer_lines'] = lines if lines is not None else self._get_customer_lines(date_from, date_to)
         elif docs.report_type == 'cpe':
-            cpes = self.env['isp.cpe'].search([
-                ('create_date', '>=', date_from),
-                ('create_date', '<=', date_to)
-            ])
-            return {
-                'doc_ids': docids,
-                'doc_model': 'isp.report',
-                'docs': docs,
-                'cpes': cpes,
-            }
+            values['cpe_lines'] = lines if lines is not None else self._get_cpe_lines(date_from, date_to)
         elif docs.report_type == 'package':
-            packages = self.env['isp.package'].search([])
-            return {
-                'doc_ids': docids,
-                'doc_model': 'isp.report',
-                'docs': docs,
-                'packages': packages,
-            }
+            values.update({
+                'currency': self.env.company.currency_id,
+                'package_lines': self._get_package_lines(),
+            })
         elif docs.report_type in ['financial', 'profit_loss']:
-            subscriptions = self.env['isp.subscription'].search([
-                ('recurring_next_date', '>=', date_from),
-                ('recurring_next_date', '<=', date_to)
-            ])
-            installations = self.env['isp.installation.fee'].search([
-                ('date', '>=', date_from),
-                ('date', '<=', date_to)
-            ])
-            
-            total_subscription = sum(subscriptions.mapped('recurring_total'))
-            total_installation = sum(installations.mapped('amount'))
-            
-            device_costs = self.env['isp.device.history'].search([
-                ('date', '>=', date_from),
-                ('date', '<=', date_to)
-            ])
-            total_device_cost = sum(device_costs.mapped('cost'))
-            
-            # Contoh biaya maintenance (bisa disesuaikan)
-            total_maintenance = 1000000
-            
-            return {
-                'doc_ids': docids,
-                'doc_model': 'isp.report',
-                'docs': docs,
-                'subscriptions': subscriptions,
-                'installations': installations,
-                'total_subscription': total_subscription,
-                'total_installation': total_installation,
-                'total_revenue': total_subscription + total_installation,
-                'total_device_cost': total_device_cost,
-                'total_maintenance': total_maintenance,
-                'total_cost': total_device_cost + total_maintenance,
-            } 
\ No newline at end of file
+            # Semua total dihitung dengan agregasi SQL/read_group, tanpa memuat recordset ke Python
+            values.update(self._get_financial_values(date_from, date_to))
+        return values
\ No newline at end of file
@@ -0,0 +1,295 @@
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+from datetime import timedelta
+import codecs
+import csv
+import io
+import logging
+import time
+import xlsxwriter
+
+_logger = logging.getLogger(__name__)
+
+# Jumlah baris yang diambil dari server-side cursor per putaran
+EXPORT_CHUNK_SIZE = 2000
+
+# Jenis laporan yang bisa diexport sebagai CSV/XLSX
+EXPORT_REPORT_TYPES = ('customer', 'cpe', 'subscription')
+
+
+class ISPReportExport(models.Model):
+    _inherit = 'isp.report'
+
+    report_type = fields.Selection(selection_add=[
+        ('subscription', 'Laporan Subscription'),
+    ], ondelete={'subscription': 'cascade'})
+    export_format = fields.Selection([
+        ('pdf', 'PDF'),
+        ('csv', 'CSV'),
+        ('xlsx', 'Excel (XLSX)'),
+    ], string='Format', default='pdf', required=True,
+        help='CSV/XLSX dialirkan per chunk langsung dari database, cocok untuk puluhan ribu baris')
+
+    def _check_export_format(self):
+        for report in self:
+            if report.export_format == 'pdf' and report.report_type == 'subscription':
+                raise ValidationError('Laporan subscription hanya tersedia dalam format CSV atau XLSX')
+            if report.export_format != 'pdf' and report.report_type not in EXPORT_REPORT_TYPES:
+                raise ValidationError('Export CSV/XLSX hanya tersedia untuk laporan pelanggan, CPE dan subscription')
+
+    def action_generate_report(self):
+        self.ensure_one()
+        if self.export_format != 'pdf':
+            return self.action_export()
+        self._check_export_format()
+        return super().action_generate_report()
+
+    def action_export(self):
+        """Unduh laporan sebagai CSV/XLSX"""
+        self.ensure_one()
+        if self.report_type not in EXPORT_REPORT_TYPES:
+            raise ValidationError('Export CSV/XLSX hanya tersedia untuk laporan pelanggan, CPE dan subscription')
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/dkt_isp_billing/report/{self.id}/export',
+            'target': 'self',
+        }
+
+    def _get_export_filename(self):
+        self.ensure_one()
+        extension = self.export_format if self.export_format != 'pdf' else 'csv'
+        return f'{self.report_type}_{self.date_from}_{self.date_to}.{extension}'
+
+    def _get_export_query(self):
+        """
+        Kolom dan query export untuk jenis laporan ini. Statistik (CPE aktif, tunggakan)
+        dihitung dengan agregasi di query yang sama, bukan per baris. Tunggakan pelanggan
+        dijumlah per partner sehingga invoice gabungan tidak terhitung ganda.
+        Returns: (kolom, sql, params) dengan kolom berupa list (judul, jenis) dan
+            jenis salah satu 'char', 'int', 'float', 'date', 'datetime' atau dict label selection
+        """
+        self.ensure_one()
+        params = {
+            'date_from': self.date_from,
+            'date_to': self.date_to + timedelta(days=1),
+            'today': fields.Date.context_today(self),
+            'default': self.env['isp.mikrotik.config'].get_default_config().id or None,
+        }
+        # Tunggakan: invoice posted belum lunas yang lewat jatuh tempo, aturan yang sama dengan
+        # isp.subscription.total_unpaid_amount dan _get_dunning_candidates
+        overdue_rule = """
+                   move.move_type = 'out_invoice'
+               AND move.state = 'posted'
+               AND move.payment_state IN ('not_paid', 'partial')
+               AND move.invoice_date_due < %(today)s
+        """
+        # Per subscription: invoice sendiri (subscription_id) penuh, invoice gabungan (line
+        # isp_subscription_id) sebesar porsi line subscription tersebut
+        overdue = f"""
+            SELECT subscription_id,
+                   COUNT(DISTINCT move_id) AS overdue_count,
+                   SUM(unpaid) AS unpaid
+              FROM (
+                    SELECT move.subscription_id, move.id AS move_id, move.amount_residual AS unpaid
+                      FROM account_move move
+                     WHERE move.subscription_id IS NOT NULL
+                       AND {overdue_rule}
+                 UNION ALL
+                    SELECT line.isp_subscription_id, move.id,
+                           COALESCE(SUM(line.price_total) * move.amount_residual / NULLIF(move.amount_total, 0), 0)
+                      FROM account_move_line line
+                      JOIN account_move move ON move.id = line.move_id
+                     WHERE line.isp_subscription_id IS NOT NULL
+                       AND move.subscription_id IS DISTINCT FROM line.isp_subscription_id
+                       AND {overdue_rule}
+                  GROUP BY line.isp_subscription_id, move.id, move.amount_residual, move.amount_total
+                   ) overdue_moves
+          GROUP BY subscription_id
+        """
+
+        if self.report_type == 'customer':
+            columns = [
+                ('ID Pelanggan', 'char'), ('Nama', 'char'), ('No KTP', 'char'), ('No HP', 'char'),
+                ('Email', 'char'), ('Alamat', 'char'),
+                ('Status', self._selection_labels('isp.customer', 'state')),
+                ('Tanggal Registrasi', 'datetime'), ('Total CPE', 'int'), ('CPE Aktif', 'int'),
+                ('Paket Aktif', 'char'), ('Total Tunggakan', 'float'),
+            ]
+            query = f"""
+                WITH customers AS (
+                    SELECT id, partner_id
+                      FROM isp_customer
+                     WHERE active
+                       AND create_date >= %(date_from)s
+                       AND create_date < %(date_to)s
+                )
+                SELECT c.customer_id, c.name, c.identity_number, c.mobile, c.email, c.address, c.state,
+                       c.create_date, COALESCE(cpe.total, 0), COALESCE(cpe.open_count, 0),
+                       sub.packages, COALESCE(inv.unpaid, 0)
+                  FROM customers
+                  JOIN isp_customer c ON c.id = customers.id
+             LEFT JOIN (
+                        SELECT customer_id, COUNT(*) AS total, COUNT(*) FILTER (WHERE state = 'open') AS open_count
+                          FROM isp_cpe
+                         WHERE active AND customer_id IN (SELECT id FROM customers)
+                      GROUP BY customer_id
+                       ) cpe ON cpe.customer_id = c.id
+             LEFT JOIN (
+                        SELECT sub.customer_id, string_agg(DISTINCT package.name, ', ') AS packages
+                          FROM isp_subscription sub
+                          JOIN isp_package package ON package.id = sub.package_id
+                         WHERE sub.state = 'open' AND sub.customer_id IN (SELECT id FROM customers)
+                      GROUP BY sub.customer_id
+                       ) sub ON sub.customer_id = c.id
+             LEFT JOIN (
+                        SELECT move.partner_id, SUM(move.amount_residual) AS unpaid
+                          FROM account_move move
+                         WHERE {overdue_rule}
+                           AND move.partner_id IN (SELECT partner_id FROM customers)
+                      GROUP BY move.partner_id
+                       ) inv ON inv.partner_id = c.partner_id
+              ORDER BY c.id
+            """
+        elif self.report_type == 'cpe':
+            columns = [
+                ('Perangkat', 'char'), ('ID Pelanggan', 'char'), ('Pelanggan', 'char'),
+                ('IP Address', 'char'), ('MAC Address', 'char'), ('PPPoE Username', 'char'),
+                ('Kepemilikan', self._selection_labels('isp.cpe', 'ownership')),
+                ('Status', self._selection_labels('isp.cpe', 'state')),
+                ('Router', 'char'), ('Paket', 'char'),
+                ('Status Subscription', self._selection_labels('isp.subscription', 'state')),
+                ('Tanggal Dibuat', 'datetime'), ('Total Tunggakan', 'float'),
+            ]
+            query = f"""
+                SELECT cpe.name, customer.customer_id, customer.name, cpe.ip_address, cpe.mac_address,
+                       cpe.pppoe_username, cpe.ownership, cpe.state, router.name, package.name, sub.state,
+                       cpe.create_date, COALESCE(overdue.unpaid, 0)
+                  FROM isp_cpe cpe
+                  JOIN isp_customer customer ON customer.id = cpe.customer_id
+             LEFT JOIN isp_subscription sub ON sub.id = cpe.subscription_id
+             LEFT JOIN isp_package package ON package.id = sub.package_id
+             LEFT JOIN isp_mikrotik_config router
+                       ON router.id = COALESCE(cpe.mikrotik_id, package.mikrotik_id, %(default)s)
+             LEFT JOIN ({overdue}) overdue ON overdue.subscription_id = sub.id
+                 WHERE cpe.active
+                   AND cpe.create_date >= %(date_from)s
+                   AND cpe.create_date < %(date_to)s
+              ORDER BY cpe.id
+            """
+        else:
+            columns = [
+                ('Nomor', 'char'), ('ID Pelanggan', 'char'), ('Pelanggan', 'char'), ('Paket', 'char'),
+                ('Router', 'char'), ('PPPoE Username', 'char'),
+                ('Status', self._selection_labels('isp.subscription', 'state')),
+                ('Tanggal Mulai', 'date'), ('Tagihan Berikutnya', 'date'), ('Jumlah Tagihan', 'float'),
+                ('Invoice Menunggak', 'int'), ('Total Tunggakan', 'float'),
+            ]
+            query = f"""
+                SELECT sub.name, customer.customer_id, customer.name, package.name, router.name,
+                       cpe.pppoe_username, sub.state, sub.date_start, sub.next_invoice_date, sub.final_amount,
+                       COALESCE(overdue.overdue_count, 0), COALESCE(overdue.unpaid, 0)
+                  FROM isp_subscription sub
+                  JOIN isp_customer customer ON customer.id = sub.customer_id
+                  JOIN isp_package package ON package.id = sub.package_id
+             LEFT JOIN isp_cpe cpe ON cpe.id = sub.cpe_id
+             LEFT JOIN isp_mikrotik_config router
+                       ON router.id = COALESCE(cpe.mikrotik_id, package.mikrotik_id, %(default)s)
+             LEFT JOIN ({overdue}) overdue ON overdue.subscription_id = sub.id
+                 WHERE sub.date_start >= %(date_from)s
+                   AND sub.date_start < %(date_to)s
+              ORDER BY sub.id
+            """
+        return columns, query, params
+
+    def _iter_export_rows(self):
+        """
+        Baris export per chunk dari server-side cursor (named cursor PostgreSQL), sehingga
+        hanya EXPORT_CHUNK_SIZE baris yang berada di memori pada satu waktu.
+        Returns: (kolom, generator list baris)
+        """
+        self.ensure_one()
+        for model in ('isp.customer', 'isp.cpe', 'isp.subscription', 'isp.package',
+                      'account.move', 'account.move.line'):
+            self.env[model].flush_model()
+        columns, query, params = self._get_export_query()
+
+        def rows():
+            with self.env.cr._cnx.cursor(name=f'isp_report_export_{self.id}') as cursor:
+                cursor.itersize = EXPORT_CHUNK_SIZE
+                cursor.execute(query, params)
+                while True:
+                    chunk = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        return columns, rows()
+
+    @api.model
+    def _format_export_value(self, value, kind):
+        if value is None:
+            return ''
+        if isinstance(kind, dict):
+            return kind.get(value, value)
+        return value
+
+    def _write_export(self, fileobj, export_format=None):
+        """
+        Tulis laporan ke file biner (spool, attachment atau response) baris demi baris.
+        CSV ditulis langsung; XLSX memakai mode constant_memory xlsxwriter yang menulis
+        setiap baris ke file sementara sehingga memori tidak bertambah dengan jumlah baris.
+        Returns: jumlah baris data
+        """
+        self.ensure_one()
+        export_format = export_format or self.export_format
+        started = time.monotonic()
+        columns, chunks = self._iter_export_rows()
+        kinds = [kind for _label, kind in columns]
+        count = 0
+
+        if export_format == 'xlsx':
+            workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True, 'remove_timezone': True})
+            sheet = workbook.add_worksheet(self.report_type)
+            styles = {
+                'header': workbook.add_format({'bold': True}),
+                'date': workbook.add_format({'num_format': 'yyyy-mm-dd'}),
+                'datetime': workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm'}),
+                'float': workbook.add_format({'num_format': '#,##0.00'}),
+            }
+            for col, (label, _kind) in enumerate(columns):
+                sheet.write_string(0, col, label, styles['header'])
+            for chunk in chunks:
+                for row in chunk:
+                    count += 1
+                    for col, value in enumerate(row):
+                        kind = kinds[col]
+                        if value is None:
+                            continue
+                        if kind in ('date', 'datetime'):
+                            sheet.write_datetime(count, col, value, styles[kind])
+                        elif kind in ('int', 'float'):
+                            sheet.write_number(count, col, float(value), styles.get(kind))
+                        else:
+                            sheet.write_string(count, col, str(self._format_export_value(value, kind)))
+            workbook.close()
+        else:
+            # Setiap chunk dirender ke buffer teks kecil lalu ditulis sebagai UTF-8;
+            # BOM di awal agar Excel membaca CSV sebagai UTF-8
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow([label for label, _kind in columns])
+            fileobj.write(codecs.BOM_UTF8 + buffer.getvalue().encode('utf-8'))
+            for chunk in chunks:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(
+                    [self._format_export_value(value, kinds[col]) for col, value in enumerate(row)]
+                    for row in chunk
+                )
+                fileobj.write(buffer.getvalue().encode('utf-8'))
+                count += len(chunk)
+
+        _logger.info(
+            f'Export {self.report_type} {export_format}: {count} baris dalam {time.monotonic() - started:.2f} detik'
+        )
+        return count
\ No newline at end of file
@@ -0,0 +1,361 @@
+from odoo import models, fields, api
+from odoo.tools.pdf import merge_pdf
+from datetime import timedelta
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Invoice customer subscription dalam lingkup laporan: invoice sendiri dan invoice gabungan
+SUBSCRIPTION_MOVES = ('moves', """
+    SELECT id, write_date
+      FROM account_move
+     WHERE move_type = 'out_invoice'
+       AND subscription_id IN (SELECT id FROM subs)
+ UNION
+    SELECT move.id, move.write_date
+      FROM account_move_line line
+      JOIN account_move move ON move.id = line.move_id
+     WHERE line.isp_subscription_id IN (SELECT id FROM subs)
+       AND move.move_type = 'out_invoice'
+""")
+ROUTERS = ('routers', "SELECT write_date FROM isp_mikrotik_config")
+REVENUE_SCOPE = [
+    ('snapshots', """
+        SELECT write_date FROM isp_revenue_snapshot
+         WHERE month >= date_trunc('month', %(date_from)s::date) AND month < %(date_to)s
+    """),
+    # Biaya instalasi dan perangkat dihitung atas bulan penuh yang sama dengan snapshot
+    ('installations', """
+        SELECT write_date FROM isp_installation_fee
+         WHERE date >= date_trunc('month', %(date_from)s::date)
+           AND date < date_trunc('month', %(date_to)s::date - 1) + interval '1 month'
+    """),
+    ('devices', """
+        SELECT write_date FROM isp_device_history
+         WHERE date >= date_trunc('month', %(date_from)s::date)
+           AND date < date_trunc('month', %(date_to)s::date - 1) + interval '1 month'
+    """),
+]
+
+# Baris yang dibaca setiap jenis laporan sebagai daftar CTE (nama, query). Fingerprint hanya
+# menghitung baris ini sehingga data di luar laporan (misalnya vendor bill) tidak membatalkan cache.
+FINGERPRINT_SCOPES = {
+    'customer': [
+        ('customers', """
+            SELECT id, partner_id, write_date FROM isp_customer
+             WHERE create_date >= %(date_from)s AND create_date < %(date_to)s
+        """),
+        ('cpes', "SELECT write_date FROM isp_cpe WHERE customer_id IN (SELECT id FROM customers)"),
+        ('subs', """
+            SELECT id, package_id, write_date FROM isp_subscription
+             WHERE customer_id IN (SELECT id FROM customers)
+        """),
+        ('packages', "SELECT write_date FROM isp_package WHERE id IN (SELECT package_id FROM subs)"),
+        ('moves', """
+            SELECT write_date FROM account_move
+             WHERE move_type = 'out_invoice' AND partner_id IN (SELECT partner_id FROM customers)
+        """),
+    ],
+    'cpe': [
+        ('cpes', """
+            SELECT customer_id, subscription_id, write_date FROM isp_cpe
+             WHERE create_date >= %(date_from)s AND create_date < %(date_to)s
+        """),
+        ('customers', "SELECT write_date FROM isp_customer WHERE id IN (SELECT customer_id FROM cpes)"),
+        ('subs', """
+            SELECT id, package_id, write_date FROM isp_subscription
+             WHERE id IN (SELECT subscription_id FROM cpes)
+        """),
+        ('packages', "SELECT write_date FROM isp_package WHERE id IN (SELECT package_id FROM subs)"),
+        ROUTERS,
+        SUBSCRIPTION_MOVES,
+    ],
+    'subscription': [
+        ('subs', """
+            SELECT id, customer_id, cpe_id, package_id, write_date FROM isp_subscription
+             WHERE date_start >= %(date_from)s AND date_start < %(date_to)s
+        """),
+        ('customers', "SELECT write_date FROM isp_customer WHERE id IN (SELECT customer_id FROM subs)"),
+        ('cpes', "SELECT write_date FROM isp_cpe WHERE id IN (SELECT cpe_id FROM subs)"),
+        ('packages', "SELECT write_date FROM isp_package WHERE id IN (SELECT package_id FROM subs)"),
+        ROUTERS,
+        SUBSCRIPTION_MOVES,
+    ],
+    'package': [
+        ('packages', "SELECT write_date FROM isp_package"),
+        ('subs', "SELECT write_date FROM isp_subscription"),
+    ],
+    'financial': REVENUE_SCOPE + [
+        ('packages', "SELECT write_date FROM isp_package"),
+        ('installation_types', "SELECT write_date FROM isp_installation_type"),
+    ],
+    'profit_loss': REVENUE_SCOPE,
+}
+
+# Model yang harus di-flush sebelum fingerprint dihitung
+FINGERPRINT_MODELS = ['isp.customer', 'isp.cpe', 'isp.subscription', 'isp.package', 'isp.mikrotik.config',
+                      'account.move', 'account.move.line', 'isp.revenue.snapshot', 'isp.installation.fee',
+                      'isp.installation.type', 'isp.device.history']
+
+# Parameter laporan; mengubahnya membuat hasil yang tersimpan tidak berlaku lagi
+REPORT_PARAMETERS = {'report_type', 'date_from', 'date_to', 'export_format'}
+
+# Jenis laporan PDF yang barisnya dirender per chunk lalu digabung
+CHUNKED_PDF_LINES = {
+    'customer': '_get_customer_lines',
+    'cpe': '_get_cpe_lines',
+}
+
+REPORT_SPOOL_SIZE = 4 * 1024 * 1024
+
+
+class ISPReportJob(models.Model):
+    _inherit = 'isp.report'
+
+    state = fields.Selection(selection_add=[
+        ('queued', 'Dalam Antrian'),
+        ('running', 'Diproses'),
+        ('generated',),
+        ('failed', 'Gagal'),
+    ], ondelete={'queued': 'set default', 'running': 'set default', 'failed': 'set default'})
+    attachment_id = fields.Many2one('ir.attachment', string='File Laporan', readonly=True, copy=False,
+                                    ondelete='set null')
+    data_fingerprint = fields.Char('Fingerprint Data', readonly=True, copy=False, index=True,
+                                   help='Hash parameter laporan dan kondisi data saat laporan dibuat; '
+                                        'laporan lain dengan fingerprint sama memakai file ini')
+    date_queued = fields.Datetime('Masuk Antrian', readonly=True, copy=False)
+    date_started = fields.Datetime('Mulai Diproses', readonly=True, copy=False)
+    date_generated = fields.Datetime('Tanggal Dibuat', readonly=True, copy=False)
+    job_attempts = fields.Integer('Percobaan', readonly=True, copy=False)
+    error_message = fields.Text('Error Terakhir', readonly=True, copy=False)
+
+    def write(self, vals):
+        if REPORT_PARAMETERS & vals.keys() and 'state' not in vals:
+            # Parameter berubah: file lama tidak lagi sesuai dengan laporan ini
+            attachments = self.attachment_id
+            vals = dict(vals, state='draft', attachment_id=False, data_fingerprint=False)
+            res = super().write(vals)
+            attachments.unlink()
+            return res
+        return super().write(vals)
+
+    def _get_job_config(self):
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        config = {}
+        for key, default in [('report_pdf_chunk_size', 2000), ('report_job_max_attempts', 3),
+                             ('report_job_timeout', 3600)]:
+            try:
+                config[key] = max(int(get_param(f'dkt_isp_billing.{key}', default)), 1)
+            except (TypeError, ValueError):
+                config[key] = default
+        return config
+
+    def _get_data_fingerprint(self):
+        """
+        Hash parameter laporan dan jumlah baris serta write_date terakhir dari baris yang
+        dibaca laporan ini (lihat FINGERPRINT_SCOPES), dihitung dengan satu query. Insert,
+        update dan delete pada baris tersebut mengubah salah satunya sehingga hasil yang
+        tersimpan hanya dipakai ulang selama datanya tidak berubah.
+        Tanggal hari ini ikut dihitung karena tunggakan bergantung pada tanggal jatuh tempo.
+        """
+        self.ensure_one()
+        state = []
+        scope = FINGERPRINT_SCOPES.get(self.report_type)
+        if scope:
+            for model in FINGERPRINT_MODELS:
+                self.env[model].flush_model()
+            ctes = ', '.join(f'{name} AS ({query})' for name, query in scope)
+            totals = ' UNION ALL '.join(
+                f"SELECT '{name}', COUNT(*), MAX(write_date) FROM {name}" for name, _query in scope
+            )
+            self.env.cr.execute(
+                f"WITH {ctes} {totals}",
+                {'date_from': self.date_from, 'date_to': self.date_to + timedelta(days=1)},
+            )
+            state = self.env.cr.fetchall()
+        key = (self.report_type, self.date_from, self.date_to, self.export_format,
+               fields.Date.context_today(self), state)
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def _reuse_cached_result(self, fingerprint):
+        """Salin file laporan lain yang dibuat dari data yang sama; True jika ada"""
+        self.ensure_one()
+        cached = self.search([
+            ('id', '!=', self.id),
+            ('state', '=', 'generated'),
+            ('data_fingerprint', '=', fingerprint),
+            ('attachment_id', '!=', False),
+        ], order='date_generated desc', limit=1)
+        if not cached:
+            return False
+        # Isi file di filestore dipakai bersama berdasarkan checksum, jadi salinan tidak menggandakan data
+        attachment = cached.attachment_id.copy({'res_model': self._name, 'res_id': self.id})
+        self._set_result(attachment, fingerprint)
+        _logger.info(f'Laporan {self.name}: memakai hasil laporan {cached.name} (data tidak berubah)')
+        return True
+
+    def _set_result(self, attachment, fingerprint):
+        old = self.attachment_id
+        self.write({
+            'state': 'generated',
+            'attachment_id': attachment.id,
+            'data_fingerprint': fingerprint,
+            'date_generated': fields.Datetime.now(),
+            'error_message': False,
+        })
+        old.unlink()
+
+    def _render_pdf(self):
+        """
+        Render PDF laporan. Laporan pelanggan/CPE dihitung sekali lalu dirender per chunk baris
+        dan digabung, sehingga satu proses wkhtmltopdf tidak perlu memuat seluruh tabel.
+        """
+        self.ensure_one()
+        report_ref = f'dkt_isp_billing.action_report_{self.report_type}'
+        data = {
+            'ids': self.ids,
+            'model': self._name,
+            'form': {
+                'date_from': self.date_from,
+                'date_to': self.date_to,
+            }
+        }
+        Report = self.env['ir.actions.report']
+        if self.report_type not in CHUNKED_PDF_LINES:
+            return Report._render_qweb_pdf(report_ref, res_ids=self.ids, data=data)[0]
+
+        lines = getattr(self, CHUNKED_PDF_LINES[self.report_type])(self.date_from, self.date_to)
+        chunk_size = self._get_job_config()['report_pdf_chunk_size']
+        documents = []
+        for start in range(0, max(len(lines), 1), chunk_size):
+            chunk_data = dict(data, lines=lines[start:start + chunk_size])
+            documents.append(Report._render_qweb_pdf(report_ref, res_ids=self.ids, data=chunk_data)[0])
+        return documents[0] if len(documents) == 1 else merge_pdf(documents)
+
+    def _generate_attachment(self):
+        """Buat file laporan (atau pakai hasil yang sama) dan simpan sebagai attachment"""
+        self.ensure_one()
+        self._check_export_format()
+        started = time.monotonic()
+        fingerprint = self._get_data_fingerprint()
+        if self._reuse_cached_result(fingerprint):
+            return
+        if self.export_format == 'pdf':
+            content = self._render_pdf()
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE) as spool:
+                self._write_export(spool, self.export_format)
+                spool.seek(0)
+                content = spool.read()
+        attachment = self.env['ir.attachment'].create({
+            'name': f'{self.report_type}_{self.date_from}_{self.date_to}.{self.export_format}',
+            'raw': content,
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+        self._set_result(attachment, fingerprint)
+        _logger.info(
+            f'Laporan {self.name} ({self.export_format}) dibuat dalam {time.monotonic() - started:.2f} detik'
+        )
+
+    def action_enqueue(self):
+        """Masukkan laporan ke antrian; hasil yang sama dengan data yang belum berubah langsung dipakai"""
+        self._check_export_format()
+        queued = self.browse()
+        for report in self:
+            if not report._reuse_cached_result(report._get_data_fingerprint()):
+                queued |= report
+        if queued:
+            queued.write({
+                'state': 'queued',
+                'date_queued': fields.Datetime.now(),
+                'job_attempts': 0,
+                'error_message': False,
+            })
+            self.env.ref('dkt_isp_billing.ir_cron_process_report_jobs')._trigger()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Laporan Dalam Antrian' if queued else 'Laporan Tersedia',
+                'message': ('Laporan dibuat di background, unduh setelah status menjadi Generated'
+                            if queued else 'Data tidak berubah, hasil laporan sebelumnya dipakai ulang'),
+                'type': 'info' if queued else 'success',
+                'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+            }
+        }
+
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            return self.action_enqueue()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/web/content/{self.attachment_id.id}?download=true',
+            'target': 'self',
+        }
+
+    def _claim_job(self, timeout):
+        """
+        Klaim satu laporan dalam antrian, baris yang sedang dikunci worker lain dilewati.
+        Laporan berstatus Diproses yang melewati timeout dianggap ditinggalkan worker yang
+        berhenti (misalnya kena batas waktu/memori) dan diklaim ulang.
+        """
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT id
+              FROM isp_report
+             WHERE state = 'queued'
+                OR (state = 'running'
+                    AND date_started < (now() AT TIME ZONE 'UTC') - make_interval(secs => %s))
+          ORDER BY date_queued, id
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """, [timeout])
+        row = self.env.cr.fetchone()
+        return self.browse(row[0] if row else [])
+
+    @api.model
+    def cron_process_report_jobs(self):
+        """
+        Worker antrian laporan: laporan dirender satu per satu di luar request HTTP dan
+        di-commit per laporan. Status Diproses dan jumlah percobaan di-commit sebelum render,
+        sehingga laporan yang membuat worker berhenti ditandai Gagal setelah batas percobaan
+        alih-alih diulang terus. Laporan yang gagal ditandai Gagal beserta pesan errornya.
+        """
+        config = self._get_job_config()
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        processed = 0
+        while True:
+            report = self._claim_job(config['report_job_timeout'])
+            if not report:
+                break
+            if report.job_attempts >= config['report_job_max_attempts']:
+                report.write({
+                    'state': 'failed',
+                    'error_message': f'Dihentikan setelah {report.job_attempts} percobaan: '
+                                     f'worker berhenti sebelum laporan selesai dibuat',
+                })
+            else:
+                report.write({
+                    'state': 'running',
+                    'date_started': fields.Datetime.now(),
+                    'job_attempts': report.job_attempts + 1,
+                })
+                if auto_commit:
+                    self.env.cr.commit()
+                try:
+                    with self.env.cr.savepoint():
+                        report._generate_attachment()
+                except Exception as e:
+                    _logger.exception(f'Gagal membuat laporan {report.name}')
+                    report.write({'state': 'failed', 'error_message': str(e)})
+            processed += 1
+            if not auto_commit:
+                break
+            self.env.cr.commit()
+        return processed
\ No newline at end of file
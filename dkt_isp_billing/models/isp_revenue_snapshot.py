@@ -0,0 +1,261 @@
+from odoo import models, fields, api
+from odoo.tools.sql import create_unique_index
+from contextlib import contextmanager
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Kolom nilai tagihan, dihitung ulang dari invoice saat rebuild
+AMOUNT_COLUMNS = ['billed_count', 'billed_amount', 'discount_amount', 'collected_amount', 'outstanding_amount']
+# Counter perubahan status subscription, hanya dicatat saat status berubah
+COUNT_COLUMNS = ['new_count', 'isolated_count', 'terminated_count']
+SNAPSHOT_COLUMNS = AMOUNT_COLUMNS + COUNT_COLUMNS
+
+# Status baru subscription -> counter yang bertambah; open dihitung sebagai aktivasi hanya dari draft
+STATE_COUNTERS = {
+    'isolated': 'isolated_count',
+    'terminated': 'terminated_count',
+}
+
+UPSERT_CHUNK_SIZE = 500
+
+
+class ISPRevenueSnapshot(models.Model):
+    """
+    Ringkasan pendapatan per (bulan, paket, router) yang diperbarui secara incremental:
+    nilai tagihan berubah saat invoice subscription diposting, dibatalkan atau dibayar,
+    counter status berubah saat status subscription berubah. Laporan membaca tabel ini
+    sehingga biayanya mengikuti jumlah bulan, bukan jumlah invoice.
+    Nilai tagihan memakai paket dan router yang dibekukan di line invoice saat ditagih,
+    sehingga penggantian paket/router subscription tidak memindahkan tagihan lama.
+    """
+    _name = 'isp.revenue.snapshot'
+    _description = 'Snapshot Pendapatan Bulanan'
+    _order = 'month desc, package_id, mikrotik_id'
+    _rec_name = 'month'
+
+    month = fields.Date('Bulan', required=True, readonly=True, index=True)
+    package_id = fields.Many2one('isp.package', string='Paket', required=True, readonly=True, ondelete='restrict')
+    mikrotik_id = fields.Many2one('isp.mikrotik.config', string='Router', readonly=True, ondelete='restrict')
+    billed_count = fields.Integer('Jumlah Tagihan', readonly=True)
+    billed_amount = fields.Float('Ditagih', readonly=True)
+    discount_amount = fields.Float('Diskon', readonly=True)
+    collected_amount = fields.Float('Terbayar', readonly=True)
+    outstanding_amount = fields.Float('Belum Terbayar', readonly=True)
+    new_count = fields.Integer('Aktivasi Baru', readonly=True)
+    isolated_count = fields.Integer('Diisolir', readonly=True)
+    terminated_count = fields.Integer('Terminasi', readonly=True)
+
+    def init(self):
+        # Router boleh kosong, sehingga kunci unik memakai COALESCE agar UPSERT tetap cocok
+        create_unique_index(
+            self._cr, 'isp_revenue_snapshot_key_uniq', self._table,
+            ['month', 'package_id', '(COALESCE(mikrotik_id, 0))']
+        )
+
+    @api.model
+    def _read_invoice_amounts(self, moves=None):
+        """
+        Kontribusi line invoice/credit note subscription yang posted, per (bulan, paket, router).
+        Paket dan router diambil dari line (dibekukan saat ditagih); line lama tanpa nilai tersebut
+        memakai subscription saat ini dengan urutan yang sama seperti _get_mikrotik_config.
+        Nilai terbayar/belum terbayar dibagi proporsional dari sisa tagihan invoice.
+        moves: batasi ke invoice tertentu (untuk delta); None berarti semua invoice.
+        Returns: dict {(bulan, package_id, router_id): {kolom: nilai}}
+        """
+        for model in ('account.move.line', 'account.move', 'isp.subscription', 'isp.cpe', 'isp.package'):
+            self.env[model].flush_model()
+        default = self.env['isp.mikrotik.config'].get_default_config()
+        params = {'default': default.id or None}
+        where = ''
+        if moves is not None:
+            where = 'AND line.move_id IN %(move_ids)s'
+            params['move_ids'] = tuple(moves.ids)
+        self.env.cr.execute(f"""
+            SELECT date_trunc('month', line.date)::date,
+                   COALESCE(line.isp_package_id, sub.package_id),
+                   CASE WHEN line.isp_package_id IS NOT NULL THEN line.isp_mikrotik_id
+                        ELSE COALESCE(cpe.mikrotik_id, package.mikrotik_id, %(default)s) END,
+                   SUM(CASE WHEN line.price_subtotal < 0 THEN 0
+                            WHEN move.move_type = 'out_refund' THEN -1 ELSE 1 END),
+                   SUM(CASE WHEN line.price_subtotal >= 0 THEN -line.balance ELSE 0 END),
+                   SUM(CASE WHEN line.price_subtotal < 0 THEN line.balance ELSE 0 END),
+                   SUM(-line.balance * COALESCE(move.amount_residual / NULLIF(move.amount_total, 0), 0))
+              FROM account_move_line line
+              JOIN account_move move ON move.id = line.move_id
+              JOIN isp_subscription sub ON sub.id = line.isp_subscription_id
+              JOIN isp_package package ON package.id = sub.package_id
+         LEFT JOIN isp_cpe cpe ON cpe.id = sub.cpe_id
+             WHERE line.isp_subscription_id IS NOT NULL
+               AND line.parent_state = 'posted'
+               AND line.display_type = 'product'
+               AND move.move_type IN ('out_invoice', 'out_refund')
+               {where}
+          GROUP BY 1, 2, 3
+        """, params)
+        amounts = {}
+        for month, package_id, router_id, count, billed, discount, outstanding in self.env.cr.fetchall():
+            amounts[(month, package_id, router_id)] = {
+                'billed_count': count,
+                'billed_amount': billed,
+                'discount_amount': discount,
+                'collected_amount': billed - discount - outstanding,
+                'outstanding_amount': outstanding,
+            }
+        return amounts
+
+    @api.model
+    def _apply_deltas(self, deltas):
+        """
+        Tambahkan selisih ke baris snapshot dengan UPSERT, baris baru dibuat bila belum ada.
+        deltas: dict {(bulan, package_id, router_id): {kolom: selisih}}
+        """
+        rows = []
+        for (month, package_id, router_id), values in deltas.items():
+            if all(abs(values.get(column, 0)) < 0.005 for column in SNAPSHOT_COLUMNS):
+                continue
+            rows.append((month, package_id, router_id, *[values.get(column, 0) for column in SNAPSHOT_COLUMNS]))
+        if not rows:
+            return
+        self.flush_model()
+        now = fields.Datetime.now()
+        uid = self.env.uid
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+            self.env.cr.execute(f"""
+                INSERT INTO isp_revenue_snapshot
+                       (month, package_id, mikrotik_id, {', '.join(SNAPSHOT_COLUMNS)},
+                        create_uid, create_date, write_uid, write_date)
+                VALUES {', '.join(['%s'] * len(chunk))}
+                ON CONFLICT (month, package_id, (COALESCE(mikrotik_id, 0))) DO UPDATE SET
+                       {', '.join(f'{column} = isp_revenue_snapshot.{column} + EXCLUDED.{column}'
+                                  for column in SNAPSHOT_COLUMNS)},
+                       write_uid = EXCLUDED.write_uid,
+                       write_date = EXCLUDED.write_date
+            """, [row + (uid, now, uid, now) for row in chunk])
+        self.invalidate_model()
+
+    @contextmanager
+    def _track_moves(self, moves):
+        """
+        Catat perubahan kontribusi invoice customer selama blok berjalan sebagai delta snapshot:
+            with self.env['isp.revenue.snapshot']._track_moves(moves) as tracked:
+                super(..., self.with_context(isp_revenue_tracking=tracked))._post()
+        tracked berisi ID invoice yang sudah dilacak operasi luar; operasi bersarang (misalnya
+        rekonsiliasi di dalam posting credit note) hanya mencatat invoice lain yang ikut berubah.
+        """
+        tracked = self.env.context.get('isp_revenue_tracking') or frozenset()
+        moves = moves.filtered(
+            lambda move: move.move_type in ('out_invoice', 'out_refund') and move.id not in tracked
+        )
+        if not moves:
+            yield tracked
+            return
+        before = self._read_invoice_amounts(moves)
+        yield tracked | frozenset(moves.ids)
+        after = self._read_invoice_amounts(moves)
+        deltas = {}
+        for key in set(before) | set(after):
+            old, new = before.get(key, {}), after.get(key, {})
+            deltas[key] = {column: new.get(column, 0) - old.get(column, 0) for column in AMOUNT_COLUMNS}
+        self._apply_deltas(deltas)
+
+    @api.model
+    def _record_state_changes(self, subscriptions, previous_states):
+        """
+        Tambah counter aktivasi (draft -> open), isolir dan terminasi pada bulan berjalan.
+        previous_states: dict {subscription_id: status sebelum write}
+        """
+        month = fields.Date.context_today(self).replace(day=1)
+        default = self.env['isp.mikrotik.config'].get_default_config()
+        deltas = {}
+        for subscription in subscriptions:
+            old_state = previous_states.get(subscription.id)
+            if old_state == subscription.state:
+                continue
+            if subscription.state == 'open':
+                column = 'new_count' if old_state == 'draft' else None
+            else:
+                column = STATE_COUNTERS.get(subscription.state)
+            if not column:
+                continue
+            router = subscription.cpe_id.mikrotik_id or subscription.package_id.mikrotik_id or default
+            key = (month, subscription.package_id.id, router.id or None)
+            deltas.setdefault(key, {})
+            deltas[key][column] = deltas[key].get(column, 0) + 1
+        self._apply_deltas(deltas)
+
+    @api.model
+    def action_rebuild(self):
+        """
+        Hitung ulang semua nilai tagihan dari invoice untuk memperbaiki snapshot.
+        Counter perubahan status dipertahankan karena riwayatnya tidak tersimpan lengkap
+        (perubahan massal berjalan tanpa tracking).
+        """
+        started = time.monotonic()
+        amounts = self._read_invoice_amounts()
+        self.flush_model()
+        self.env.cr.execute(f"""
+            UPDATE isp_revenue_snapshot
+               SET {', '.join(f'{column} = 0' for column in AMOUNT_COLUMNS)}
+        """)
+        self._apply_deltas(amounts)
+        self.env.cr.execute(f"""
+            DELETE FROM isp_revenue_snapshot
+             WHERE {' AND '.join(f'{column} = 0' for column in SNAPSHOT_COLUMNS)}
+        """)
+        self.invalidate_model()
+        duration = time.monotonic() - started
+        _logger.info(f'Snapshot pendapatan dibangun ulang: {len(amounts)} baris dalam {duration:.2f} detik')
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses',
+                'message': f'Snapshot pendapatan dibangun ulang ({len(amounts)} baris, {duration:.1f} detik)',
+                'type': 'success',
+            }
+        }
+
+
+class ISPSubscriptionRevenue(models.Model):
+    _inherit = 'isp.subscription'
+
+    def write(self, vals):
+        if 'state' not in vals:
+            return super().write(vals)
+        previous_states = {subscription.id: subscription.state for subscription in self}
+        res = super().write(vals)
+        self.env['isp.revenue.snapshot']._record_state_changes(self, previous_states)
+        return res
+
+
+class AccountMoveRevenue(models.Model):
+    _inherit = 'account.move'
+
+    def _post(self, soft=True):
+        with self.env['isp.revenue.snapshot']._track_moves(self) as tracked:
+            return super(AccountMoveRevenue, self.with_context(isp_revenue_tracking=tracked))._post(soft=soft)
+
+    def button_draft(self):
+        with self.env['isp.revenue.snapshot']._track_moves(self) as tracked:
+            return super(AccountMoveRevenue, self.with_context(isp_revenue_tracking=tracked)).button_draft()
+
+    def button_cancel(self):
+        with self.env['isp.revenue.snapshot']._track_moves(self) as tracked:
+            return super(AccountMoveRevenue, self.with_context(isp_revenue_tracking=tracked)).button_cancel()
+
+
+class AccountMoveLineRevenue(models.Model):
+    _inherit = 'account.move.line'
+
+    def reconcile(self):
+        # Pembayaran mengubah sisa tagihan invoice: nilai terbayar/belum terbayar ikut bergeser
+        with self.env['isp.revenue.snapshot']._track_moves(self.move_id) as tracked:
+            return super(AccountMoveLineRevenue, self.with_context(isp_revenue_tracking=tracked)).reconcile()
+
+    def remove_move_reconcile(self):
+        moves = self.move_id | self.matched_debit_ids.debit_move_id.move_id | self.matched_credit_ids.credit_move_id.move_id
+        with self.env['isp.revenue.snapshot']._track_moves(moves) as tracked:
+            return super(AccountMoveLineRevenue, self.with_context(isp_revenue_tracking=tracked)).remove_move_reconcile()
\ No newline at end of file
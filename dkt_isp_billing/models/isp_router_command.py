@@ -0,0 +1,362 @@
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+from datetime import timedelta
+import logging
+import routeros_api
+import threading
+import time
+
+from .isp_mikrotik import (
+    RouterCircuitOpenError, _apply_secrets_disabled, _find_secret_entry, _load_secret_index, _secret_snapshots,
+    _sync_secret_values,
+)
+
+_logger = logging.getLogger(__name__)
+
+
+def _execute_commands(api, spec, commands):
+    """
+    Jalankan perintah antrian untuk satu router (di thread worker, tanpa ORM).
+    Perintah dikelompokkan per jenis dan dikirim sebagai set/remove dengan daftar .id.
+    Enable/disable untuk secret yang di snapshot sudah memiliki status dan profile tujuan dilewati.
+    commands: list dict {'id', 'username', 'action', 'profile', 'secret'}; secret berisi isi secret
+        lengkap CPE (lihat _sync_secret_values) dan hanya dipakai aksi add
+    Returns: dict {command_id: pesan error atau None}
+    """
+    results = {}
+    skipped = 0
+    by_action = {}
+    for command in commands:
+        by_action.setdefault(command['action'], []).append(command)
+
+    # Add: secret yang belum ada dibuat, yang sudah ada disamakan isinya seperti delta sync
+    additions = by_action.get('add', [])
+    if additions:
+        index = _load_secret_index(api, spec)
+        secret_api = api.get_resource('/ppp/secret')
+        existing = [command for command in additions if command['username'] in index]
+        for command in additions:
+            if command['username'] in index:
+                continue
+            secret = command['secret']
+            values = {
+                'name': secret['username'],
+                'service': 'pppoe',
+                'password': secret['password'],
+                'disabled': 'yes' if secret['disabled'] else 'no',
+                'comment': secret['comment'],
+            }
+            if secret['profile']:
+                values['profile'] = secret['profile']
+            if secret['remote_address']:
+                values['remote-address'] = secret['remote_address']
+            try:
+                secret_api.add(**values)
+                results[command['id']] = None
+            except routeros_api.exceptions.RouterOsApiCommunicationError as e:
+                results[command['id']] = str(e)
+        # Secret baru dibaca ulang dari router saat lookup berikutnya
+        _secret_snapshots.forget(spec['snapshot_key'], [command['username'] for command in additions
+                                                         if command['username'] not in index])
+        if existing:
+            synced = _sync_secret_values(api, spec, [command['secret'] for command in existing])
+            for command in existing:
+                failed = command['username'] in synced['failed'] or command['username'] in synced['missing']
+                results[command['id']] = 'Gagal menulis secret ke router' if failed else None
+
+    # Disable dan enable tanpa ganti profile memakai jalur bulk yang sama dengan cron tunggakan
+    for action, disabled in [('disable', True), ('enable', False)]:
+        plain = [command for command in by_action.get(action, []) if not command['profile']]
+        if plain:
+            index = _load_secret_index(api, spec)
+            skipped += sum(
+                1 for command in plain
+                if command['username'] in index and index[command['username']]['disabled'] == disabled
+            )
+            done, missing = _apply_secrets_disabled(api, spec, [command['username'] for command in plain], disabled)
+            for command in plain:
+                results[command['id']] = None if command['username'] in done else 'Secret tidak ditemukan di router'
+
+    secret_api = api.get_resource('/ppp/secret')
+    secret_ids = {}
+    entries = {}
+    for command in commands:
+        if command['action'] == 'remove' or (command['action'] in ('enable', 'disable') and command['profile']):
+            entry = _find_secret_entry(api, spec, command['username'])
+            entries[command['username']] = entry
+            secret_ids[command['username']] = entry['id'] if entry else False
+
+    # Enable/disable dengan profile: satu set per (aksi, profile) untuk semua secret di kelompok itu
+    by_profile = {}
+    for command in commands:
+        if command['action'] in ('enable', 'disable') and command['profile']:
+            by_profile.setdefault((command['action'], command['profile']), []).append(command)
+    for (action, profile), group in by_profile.items():
+        disabled = action == 'disable'
+        found = [command for command in group if secret_ids[command['username']]]
+        for command in group:
+            if command not in found:
+                results[command['id']] = 'Secret tidak ditemukan di router'
+        # Secret yang sudah memiliki profile dan status tujuan tidak ditulis ulang
+        current = [
+            command for command in found
+            if entries[command['username']]['profile'] == profile
+            and entries[command['username']]['disabled'] == disabled
+        ]
+        for command in current:
+            results[command['id']] = None
+        skipped += len(current)
+        found = [command for command in found if command not in current]
+        if not found:
+            continue
+        try:
+            secret_api.set(
+                id=','.join(secret_ids[command['username']] for command in found),
+                profile=profile,
+                disabled='yes' if disabled else 'no',
+            )
+            for command in found:
+                _secret_snapshots.update(spec['snapshot_key'], command['username'], profile=profile, disabled=disabled)
+                results[command['id']] = None
+        except routeros_api.exceptions.RouterOsApiCommunicationError as e:
+            for command in found:
+                results[command['id']] = str(e)
+
+    # Remove: secret yang sudah tidak ada dianggap selesai
+    removals = by_action.get('remove', [])
+    existing = [command for command in removals if secret_ids[command['username']]]
+    for command in removals:
+        results[command['id']] = None
+    if existing:
+        try:
+            secret_api.remove(id=','.join(secret_ids[command['username']] for command in existing))
+        except routeros_api.exceptions.RouterOsApiCommunicationError as e:
+            for command in existing:
+                results[command['id']] = str(e)
+    _secret_snapshots.forget(
+        spec['snapshot_key'], [command['username'] for command in removals if results[command['id']] is None]
+    )
+    if skipped:
+        _logger.info(f'Antrian router {spec["name"]}: {skipped} perintah dilewati karena secret sudah sesuai')
+    return results
+
+
+class ISPRouterCommand(models.Model):
+    _name = 'isp.router.command'
+    _description = 'Antrian Perintah Router'
+    _order = 'id'
+
+    name = fields.Char('Perintah', compute='_compute_name', store=True)
+    mikrotik_id = fields.Many2one('isp.mikrotik.config', string='Router', required=True,
+                                  ondelete='cascade', index=True)
+    username = fields.Char('PPPoE Username', required=True, index=True)
+    action = fields.Selection([
+        ('add', 'Buat Secret'),
+        ('enable', 'Enable Secret'),
+        ('disable', 'Disable Secret'),
+        ('remove', 'Hapus Secret'),
+    ], string='Aksi', required=True)
+    profile = fields.Char('Profile', help='Profile yang dipasang bersama enable/disable; kosong berarti profile tidak diubah')
+    subscription_id = fields.Many2one('isp.subscription', string='Subscription', ondelete='set null', index=True)
+    cpe_id = fields.Many2one('isp.cpe', string='CPE', ondelete='set null',
+                             help='Sumber isi secret untuk aksi Buat Secret, dibaca saat perintah dikirim')
+    state = fields.Selection([
+        ('pending', 'Menunggu'),
+        ('done', 'Selesai'),
+        ('failed', 'Gagal'),
+        ('cancelled', 'Digantikan'),
+    ], string='Status', default='pending', required=True, index=True)
+    attempt_count = fields.Integer('Percobaan', readonly=True)
+    next_attempt = fields.Datetime('Percobaan Berikutnya', readonly=True, default=fields.Datetime.now)
+    date_done = fields.Datetime('Tanggal Selesai', readonly=True)
+    error_message = fields.Text('Error Terakhir', readonly=True)
+
+    @api.depends('action', 'username')
+    def _compute_name(self):
+        labels = dict(self._fields['action'].selection)
+        for record in self:
+            record.name = f'{labels.get(record.action, "")} {record.username or ""}'.strip()
+
+    def init(self):
+        # Index parsial untuk klaim worker: hanya baris pending yang dipindai
+        create_index(
+            self._cr, 'isp_router_command_pending_idx', self._table,
+            ['next_attempt', 'id'], where="state = 'pending'"
+        )
+
+    @api.model
+    def _enqueue(self, mikrotik, username, action, profile=False, subscription=False):
+        """
+        Catat perubahan secret di transaksi yang sama dengan perubahan status di Odoo.
+        Perintah pending dan gagal sebelumnya untuk secret yang sama digantikan karena setiap
+        perintah membawa status akhir, sehingga per secret paling banyak ada satu perintah
+        yang bisa dikirim dan perintah gagal yang lama tidak bisa dicoba ulang menimpa status baru.
+        """
+        return self._enqueue_many([{
+            'mikrotik_id': mikrotik.id,
+            'username': username,
+            'action': action,
+            'profile': profile or False,
+            'subscription_id': subscription.id if subscription else False,
+        }])
+
+    @api.model
+    def _enqueue_many(self, vals_list):
+        """Versi massal _enqueue: satu pencarian perintah lama, satu create dan satu trigger"""
+        if not vals_list:
+            return self.browse()
+        keys = {(vals['mikrotik_id'], vals['username']) for vals in vals_list}
+        pending = self.search([
+            ('mikrotik_id', 'in', list({key[0] for key in keys})),
+            ('username', 'in', list({key[1] for key in keys})),
+            ('state', 'in', ('pending', 'failed')),
+        ])
+        pending.filtered(lambda command: (command.mikrotik_id.id, command.username) in keys).write({'state': 'cancelled'})
+        commands = self.create(vals_list)
+        # Trigger ikut di-commit bersama transaksi ini, worker jalan segera setelahnya
+        self.env.ref('dkt_isp_billing.ir_cron_process_router_commands')._trigger()
+        return commands
+
+    def _get_worker_config(self):
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        config = {}
+        for key, default in [('router_command_batch_size', 500), ('router_command_max_attempts', 8),
+                             ('router_command_backoff', 30)]:
+            try:
+                config[key] = max(int(get_param(f'dkt_isp_billing.{key}', default)), 1)
+            except (TypeError, ValueError):
+                config[key] = default
+        return config
+
+    def _claim_batch(self, batch_size):
+        """Klaim perintah pending yang sudah waktunya, baris yang dikunci worker lain dilewati"""
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT id
+              FROM isp_router_command
+             WHERE state = 'pending'
+               AND (next_attempt IS NULL OR next_attempt <= (now() AT TIME ZONE 'UTC'))
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [batch_size])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _process(self, config):
+        """Kirim perintah ke router masing-masing secara paralel lalu catat hasilnya"""
+        now = fields.Datetime.now()
+        payloads = {}
+        obsolete = self.browse()
+        for command in self:
+            secret = None
+            if command.action == 'add':
+                # Isi secret diambil dari CPE saat dikirim sehingga selalu mengikuti status terbaru
+                secret = command.cpe_id._prepare_secret_values() if command.cpe_id else None
+                if not secret or secret['username'] != command.username:
+                    obsolete |= command
+                    continue
+                secret['fingerprint'] = command.cpe_id.secret_fingerprint
+            payloads.setdefault(command.mikrotik_id.id, []).append({
+                'id': command.id,
+                'username': command.username,
+                'action': command.action,
+                'profile': command.profile,
+                'secret': secret,
+            })
+        obsolete.write({
+            'state': 'cancelled',
+            'error_message': 'CPE tidak lagi memiliki subscription aktif/terisolir dengan username ini',
+        })
+        commands = self - obsolete
+        results = commands.mikrotik_id._run_on_routers(_execute_commands, payloads)
+
+        done = self.browse()
+        for command in commands:
+            outcome, router_error = results[command.mikrotik_id.id]
+            if isinstance(router_error, RouterCircuitOpenError):
+                # Router sedang ditandai mati: tunda sampai circuit dicoba lagi tanpa memakai jatah percobaan
+                command.write({
+                    'next_attempt': now + timedelta(seconds=int(router_error.retry_in) + 1),
+                    'error_message': str(router_error),
+                })
+                continue
+            error = str(router_error) if router_error is not None else outcome.get(command.id)
+            if error is None:
+                done |= command
+                continue
+            attempts = command.attempt_count + 1
+            if attempts >= config['router_command_max_attempts']:
+                command.write({'state': 'failed', 'attempt_count': attempts, 'error_message': error})
+            else:
+                delay = min(config['router_command_backoff'] * 2 ** (attempts - 1), 3600)
+                command.write({
+                    'attempt_count': attempts,
+                    'next_attempt': now + timedelta(seconds=delay),
+                    'error_message': error,
+                })
+        done.write({'state': 'done', 'date_done': now, 'error_message': False})
+        done._mark_secrets_applied()
+        return done
+
+    def _mark_secrets_applied(self):
+        """Perbarui fingerprint diterapkan CPE dari snapshot router setelah perintah secret selesai"""
+        for router in self.mikrotik_id:
+            cpes = self.env['isp.cpe']
+            for command in self.filtered(lambda command: command.mikrotik_id == router):
+                if command.action == 'remove':
+                    continue
+                cpe = command.cpe_id or command.subscription_id.cpe_id
+                if cpe.pppoe_username == command.username:
+                    cpes |= cpe
+            cpes._mark_secrets_applied(router)
+
+    @api.model
+    def cron_process_router_commands(self):
+        """
+        Worker antrian perintah router. Perintah diklaim per batch dengan SKIP LOCKED sehingga
+        beberapa worker bisa jalan bersamaan, dikirim paralel per router, lalu di-commit per batch.
+        Perintah yang gagal dicoba lagi dengan backoff eksponensial sampai batas percobaan.
+        """
+        started = time.monotonic()
+        config = self._get_worker_config()
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        processed = succeeded = 0
+        while True:
+            commands = self._claim_batch(config['router_command_batch_size'])
+            if not commands:
+                break
+            succeeded += len(commands._process(config))
+            processed += len(commands)
+            if not auto_commit:
+                break
+            self.env.cr.commit()
+        if processed:
+            _logger.info(
+                f'Antrian router: {succeeded}/{processed} perintah berhasil dalam '
+                f'{time.monotonic() - started:.2f} detik'
+            )
+        return {'processed': processed, 'done': succeeded}
+
+    def action_retry(self):
+        """Jadwalkan ulang perintah gagal yang belum digantikan perintah lebih baru untuk secret yang sama"""
+        failed = self.filtered(lambda command: command.state == 'failed')
+        commands = self.search([
+            ('mikrotik_id', 'in', failed.mikrotik_id.ids),
+            ('username', 'in', failed.mapped('username')),
+            ('state', '!=', 'cancelled'),
+        ])
+        latest = {}
+        for command in commands:
+            key = (command.mikrotik_id.id, command.username)
+            latest[key] = max(latest.get(key, 0), command.id)
+        stale = failed.filtered(lambda command: latest.get((command.mikrotik_id.id, command.username)) != command.id)
+        stale.write({'state': 'cancelled'})
+        (failed - stale).write({
+            'state': 'pending',
+            'attempt_count': 0,
+            'next_attempt': fields.Datetime.now(),
+        })
+        self.env.ref('dkt_isp_billing.ir_cron_process_router_commands')._trigger()
+
+    def action_cancel(self):
+        self.filtered(lambda command: command.state in ('pending', 'failed')).write({'state': 'cancelled'})
\ No newline at end of file
@@ -0,0 +1,315 @@
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+import logging
+import time
+
+from .isp_mikrotik import _load_secret_index
+
+_logger = logging.getLogger(__name__)
+
+# Jenis selisih -> aksi antrian router yang memperbaikinya
+ISSUE_ACTIONS = {
+    'missing': 'add',
+    'orphan': 'remove',
+    'enabled': 'disable',
+    'disabled': 'enable',
+    'profile': False,
+}
+
+
+def _snapshot_secrets(api, spec, payload):
+    """Snapshot /ppp/secret terbaru satu router (di thread worker, tanpa ORM)"""
+    return _load_secret_index(api, spec, force=True)
+
+
+class ISPRouterReconcile(models.Model):
+    _name = 'isp.router.reconcile'
+    _description = 'Rekonsiliasi Router'
+    _inherit = ['mail.thread']
+    _order = 'id desc'
+
+    name = fields.Char('Nomor', readonly=True, copy=False)
+    mikrotik_ids = fields.Many2many('isp.mikrotik.config', string='Router',
+                                    help="Kosongkan untuk merekonsiliasi semua router aktif")
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('compared', 'Sudah Dibandingkan'),
+        ('applied', 'Diterapkan'),
+    ], string='Status', default='draft', tracking=True)
+    date_compared = fields.Datetime('Waktu Snapshot', readonly=True)
+    duration = fields.Float('Durasi (detik)', readonly=True)
+    secret_count = fields.Integer('Secret di Router', readonly=True)
+    expected_count = fields.Integer('Secret yang Diharapkan', readonly=True)
+    error_message = fields.Text('Router Gagal', readonly=True)
+    line_ids = fields.One2many('isp.router.reconcile.line', 'reconcile_id', string='Selisih')
+
+    line_count = fields.Integer('Jumlah Selisih', compute='_compute_issue_counts')
+    missing_count = fields.Integer('Tidak Ada di Router', compute='_compute_issue_counts')
+    orphan_count = fields.Integer('Yatim', compute='_compute_issue_counts')
+    state_count = fields.Integer('Status Berbeda', compute='_compute_issue_counts')
+    profile_count = fields.Integer('Profile Berbeda', compute='_compute_issue_counts')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if not vals.get('name'):
+                vals['name'] = self.env['ir.sequence'].next_by_code('isp.router.reconcile.sequence')
+        return super().create(vals_list)
+
+    def _compute_issue_counts(self):
+        groups = self.env['isp.router.reconcile.line']._read_group(
+            [('reconcile_id', 'in', self.ids)], ['reconcile_id', 'issue'], ['__count']
+        )
+        counts = {}
+        for reconcile, issue, count in groups:
+            counts.setdefault(reconcile.id, {})[issue] = count
+        for record in self:
+            issues = counts.get(record.id, {})
+            record.line_count = sum(issues.values())
+            record.missing_count = issues.get('missing', 0)
+            record.orphan_count = issues.get('orphan', 0)
+            record.state_count = issues.get('enabled', 0) + issues.get('disabled', 0)
+            record.profile_count = issues.get('profile', 0)
+
+    def _get_routers(self):
+        self.ensure_one()
+        return self.mikrotik_ids or self.env['isp.mikrotik.config'].search([('active', '=', True)])
+
+    @api.model
+    def _read_expected_state(self, router_ids):
+        """
+        Status secret yang diharapkan Odoo dalam satu query. Router CPE di-resolve dengan urutan
+        yang sama seperti _get_mikrotik_config: router CPE, router paket, router default.
+        Returns: (expected, known)
+            expected: {router_id: {username: {'cpe_id', 'subscription_id', 'disabled', 'profile'}}}
+            known: {router_id: set(username)} semua username CPE termasuk yang belum/tidak aktif
+        """
+        self.env['isp.cpe'].flush_model()
+        self.env['isp.subscription'].flush_model()
+        self.env['isp.package'].flush_model()
+        default = self.env['isp.mikrotik.config'].get_default_config()
+        self.env.cr.execute("""
+            SELECT cpe.id,
+                   cpe.pppoe_username,
+                   COALESCE(cpe.mikrotik_id, package.mikrotik_id, %(default)s) AS router_id,
+                   sub.id,
+                   sub.state,
+                   profile.name
+              FROM isp_cpe cpe
+         LEFT JOIN isp_subscription sub ON sub.id = cpe.subscription_id
+         LEFT JOIN isp_package package ON package.id = sub.package_id
+         LEFT JOIN isp_mikrotik_profile profile ON profile.id = package.profile_id
+             WHERE cpe.pppoe_username IS NOT NULL
+               AND COALESCE(cpe.mikrotik_id, package.mikrotik_id, %(default)s) IN %(router_ids)s
+        """, {'default': default.id or None, 'router_ids': tuple(router_ids)})
+
+        expected = {}
+        known = {}
+        for cpe_id, username, router_id, subscription_id, state, profile in self.env.cr.fetchall():
+            known.setdefault(router_id, set()).add(username)
+            if state in ('open', 'isolated'):
+                expected.setdefault(router_id, {})[username] = {
+                    'cpe_id': cpe_id,
+                    'subscription_id': subscription_id,
+                    'disabled': state == 'isolated',
+                    'profile': profile,
+                }
+        return expected, known
+
+    @api.model
+    def _diff_router(self, router_id, index, expected, known):
+        """
+        Bandingkan snapshot satu router dengan status Odoo memakai operasi himpunan.
+        Returns: list vals isp.router.reconcile.line
+        """
+        router_names = set(index)
+        expected_names = set(expected)
+        vals_list = []
+
+        def line(username, issue, **values):
+            values.update({
+                'mikrotik_id': router_id,
+                'username': username,
+                'issue': issue,
+                'action': ISSUE_ACTIONS[issue],
+                # Secret yatim bisa milik layanan lain di router, hapus hanya setelah ditinjau
+                'selected': issue != 'orphan' and bool(ISSUE_ACTIONS[issue]),
+            })
+            return values
+
+        for username in sorted(expected_names - router_names):
+            state = expected[username]
+            vals_list.append(line(
+                username, 'missing',
+                cpe_id=state['cpe_id'],
+                subscription_id=state['subscription_id'],
+                expected_profile=state['profile'],
+                expected_disabled=state['disabled'],
+            ))
+
+        for username in sorted(router_names - known):
+            secret = index[username]
+            vals_list.append(line(
+                username, 'orphan',
+                router_profile=secret['profile'],
+                router_disabled=secret['disabled'],
+            ))
+
+        for username in sorted(expected_names & router_names):
+            state = expected[username]
+            secret = index[username]
+            wrong_profile = bool(state['profile']) and secret['profile'] != state['profile']
+            if secret['disabled'] != state['disabled']:
+                issue = 'enabled' if state['disabled'] else 'disabled'
+            elif wrong_profile:
+                issue = 'profile'
+            else:
+                continue
+            values = line(
+                username, issue,
+                cpe_id=state['cpe_id'],
+                subscription_id=state['subscription_id'],
+                expected_profile=state['profile'],
+                expected_disabled=state['disabled'],
+                router_profile=secret['profile'],
+                router_disabled=secret['disabled'],
+            )
+            if wrong_profile:
+                # Profile diperbaiki sekaligus dengan status secret
+                values.update({
+                    'action': 'disable' if state['disabled'] else 'enable',
+                    'selected': True,
+                })
+            vals_list.append(values)
+        return vals_list
+
+    def action_compare(self):
+        """
+        Ambil snapshot /ppp/secret semua router secara paralel (satu bulk read per router),
+        baca status Odoo dalam satu query, lalu simpan selisihnya sebagai baris yang bisa ditinjau.
+        """
+        self.ensure_one()
+        started = time.monotonic()
+        routers = self._get_routers()
+        if not routers:
+            raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
+
+        results = routers._run_on_routers(_snapshot_secrets)
+        expected, known = self._read_expected_state(routers.ids)
+
+        vals_list = []
+        errors = []
+        secret_count = 0
+        for router in routers:
+            index, error = results[router.id]
+            if error is not None:
+                errors.append(f'{router.name}: {error}')
+                continue
+            secret_count += len(index)
+            vals_list.extend(self._diff_router(
+                router.id, index, expected.get(router.id, {}), known.get(router.id, set())
+            ))
+
+        self.line_ids.unlink()
+        for vals in vals_list:
+            vals['reconcile_id'] = self.id
+        self.env['isp.router.reconcile.line'].create(vals_list)
+        duration = time.monotonic() - started
+        self.write({
+            'state': 'compared',
+            'date_compared': fields.Datetime.now(),
+            'duration': duration,
+            'secret_count': secret_count,
+            'expected_count': sum(len(names) for names in expected.values()),
+            'error_message': '\n'.join(errors) or False,
+        })
+        _logger.info(
+            f'Rekonsiliasi {self.name}: {secret_count} secret di {len(routers)} router, '
+            f'{len(vals_list)} selisih dalam {duration:.2f} detik'
+        )
+        return True
+
+    def action_apply(self):
+        """Masukkan baris terpilih ke antrian perintah router, per batch"""
+        self.ensure_one()
+        lines = self.line_ids.filtered(lambda line: line.selected and line.action and line.state == 'pending')
+        if not lines:
+            raise ValidationError('Tidak ada selisih terpilih yang bisa diterapkan!')
+
+        try:
+            batch_size = max(int(self.env['ir.config_parameter'].sudo().get_param(
+                'dkt_isp_billing.router_command_batch_size', 500)), 1)
+        except (TypeError, ValueError):
+            batch_size = 500
+        Command = self.env['isp.router.command']
+        for start in range(0, len(lines), batch_size):
+            batch = lines[start:start + batch_size]
+            Command._enqueue_many([{
+                'mikrotik_id': line.mikrotik_id.id,
+                'username': line.username,
+                'action': line.action,
+                'profile': line.expected_profile if line.action != 'remove' else False,
+                'subscription_id': line.subscription_id.id,
+                'cpe_id': line.cpe_id.id,
+            } for line in batch])
+            batch.write({'state': 'queued'})
+
+        self.state = 'applied'
+        self.message_post(body=f'{len(lines)} perbaikan dimasukkan ke antrian perintah router')
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses',
+                'message': f'{len(lines)} perbaikan dimasukkan ke antrian perintah router',
+                'type': 'success',
+            }
+        }
+
+    def action_select_all(self):
+        self.line_ids.filtered(lambda line: line.action and line.state == 'pending').write({'selected': True})
+
+    def action_unselect_all(self):
+        self.line_ids.filtered(lambda line: line.state == 'pending').write({'selected': False})
+
+    @api.model
+    def cron_reconcile(self):
+        """Rekonsiliasi terjadwal semua router aktif; hasilnya ditinjau sebelum diterapkan"""
+        reconcile = self.create({})
+        reconcile.action_compare()
+        return reconcile
+
+
+class ISPRouterReconcileLine(models.Model):
+    _name = 'isp.router.reconcile.line'
+    _description = 'Selisih Rekonsiliasi Router'
+    _order = 'reconcile_id, mikrotik_id, issue, username'
+
+    reconcile_id = fields.Many2one('isp.router.reconcile', string='Rekonsiliasi', required=True,
+                                   ondelete='cascade', index=True)
+    mikrotik_id = fields.Many2one('isp.mikrotik.config', string='Router', required=True, ondelete='cascade')
+    username = fields.Char('PPPoE Username', required=True)
+    issue = fields.Selection([
+        ('missing', 'Tidak Ada di Router'),
+        ('orphan', 'Yatim di Router'),
+        ('enabled', 'Aktif di Router, Terisolir di Odoo'),
+        ('disabled', 'Nonaktif di Router, Open di Odoo'),
+        ('profile', 'Profile Berbeda'),
+    ], string='Selisih', required=True)
+    cpe_id = fields.Many2one('isp.cpe', string='CPE', ondelete='set null')
+    subscription_id = fields.Many2one('isp.subscription', string='Subscription', ondelete='set null')
+    expected_profile = fields.Char('Profile Odoo')
+    router_profile = fields.Char('Profile Router')
+    expected_disabled = fields.Boolean('Nonaktif di Odoo')
+    router_disabled = fields.Boolean('Nonaktif di Router')
+    action = fields.Selection([
+        ('add', 'Buat Secret'),
+        ('enable', 'Enable Secret'),
+        ('disable', 'Disable Secret'),
+        ('remove', 'Hapus Secret'),
+    ], string='Perbaikan', help="Kosong berarti selisih harus diperbaiki manual")
+    selected = fields.Boolean('Terapkan')
+    state = fields.Selection([
+        ('pending', 'Belum Diterapkan'),
+        ('queued', 'Masuk Antrian'),
+    ], string='Status', default='pending')
\ No newline at end of file
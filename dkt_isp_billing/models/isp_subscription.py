@@ -2,11 +2,95 @@ from odoo import models, fields, api
 from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import str2bool
+from odoo.tools.sql import create_index
 import logging
-import routeros_api
+import psycopg2.errors
+import threading
+import time
 
 _logger = logging.getLogger(__name__)
 
+# Context untuk operasi massal: tanpa tracking, log chatter otomatis dan notifikasi bus
+BATCH_MODE_CONTEXT = {
+    'isp_batch_mode': True,
+    'tracking_disable': True,
+    'mail_notrack': True,
+    'mail_create_nolog': True,
+    'mail_auto_subscribe_no_notify': True,
+}
+
+
+def _period_months(rule_type, interval):
+    """Jumlah bulan dalam satu periode penagihan"""
+    months = interval or 1
+    if rule_type == 'quarterly':
+        months *= 3
+    return months
+
+
+def _next_period_date(base_date, rule_type, interval, due_day):
+    """Tanggal tagihan periode berikutnya dari base_date, disesuaikan ke tanggal jatuh tempo"""
+    next_date = base_date + relativedelta(months=_period_months(rule_type, interval))
+    try:
+        return next_date.replace(day=due_day)
+    except ValueError:  # Untuk bulan dengan tanggal < 31
+        # Jika tanggal jatuh tempo > hari dalam bulan, gunakan hari terakhir bulan
+        return next_date + relativedelta(day=31)
+
+
+def _period_range(period_date, rule_type, interval):
+    """Rentang periode tagihan (tanggal_awal, tanggal_akhir) yang memuat period_date"""
+    period_start = period_date.replace(day=1)
+    return period_start, period_start + relativedelta(months=_period_months(rule_type, interval), days=-1)
+
+
+class BillingContext:
+    """
+    Cache jurnal penjualan, akun pendapatan dan akun diskon selama satu billing run.
+    Kunci cache memuat write_date paket/produk/diskon, sehingga perubahan data
+    di tengah run otomatis membuat entri lama tidak dipakai lagi.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self._sale_journals = {}
+        self._income_accounts = {}
+        self._discount_accounts = {}
+
+    def get_sale_journal_id(self):
+        """ID jurnal penjualan untuk company aktif"""
+        company = self.env.company
+        if company.id not in self._sale_journals:
+            sale_journal = self.env['account.journal'].search([
+                ('type', '=', 'sale'),
+                ('company_id', '=', company.id)
+            ], limit=1)
+            self._sale_journals[company.id] = sale_journal.id
+        if not self._sale_journals[company.id]:
+            raise ValidationError('Tidak ditemukan jurnal penjualan. Silakan buat jurnal penjualan terlebih dahulu.')
+        return self._sale_journals[company.id]
+
+    def get_income_account_id(self, package):
+        """ID akun pendapatan dari produk paket atau kategori produknya"""
+        product = package.product_id
+        key = (self.env.company.id, package.id, package.write_date, product.id, product.write_date)
+        if key not in self._income_accounts:
+            income_account = product.property_account_income_id or \
+                            product.categ_id.property_account_income_categ_id
+            self._income_accounts[key] = income_account.id
+        if not self._income_accounts[key]:
+            raise ValidationError('Tidak ditemukan akun pendapatan pada produk/paket. Silakan atur akun pendapatan pada produk atau kategori produk.')
+        return self._income_accounts[key]
+
+    def get_discount_account_id(self, discount):
+        """ID akun diskon"""
+        key = (discount.id, discount.write_date)
+        if key not in self._discount_accounts:
+            self._discount_accounts[key] = discount.account_id.id
+        return self._discount_accounts[key]
+
+
 class ISPSubscription(models.Model):
     _name = 'isp.subscription'
     _description = 'ISP Subscription'
@@ -37,6 +121,8 @@ class ISPSubscription(models.Model):
         ('isolated', 'Terisolir'),
         ('terminated', 'Terminasi')
     ], string='Status', default='draft', tracking=True)
+    auto_isolated = fields.Boolean('Diisolir Otomatis', readonly=True, copy=False,
+                                   help="Diisolir oleh cron tunggakan dan dibuka kembali otomatis setelah tagihan lunas")
     
     amount = fields.Float('Jumlah Tagihan', related='package_id.price', store=True)
     
@@ -61,7 +147,9 @@ class ISPSubscription(models.Model):
     mikrotik_user = fields.Char('Mikrotik Username', related='cpe_id.pppoe_username', readonly=True)
     
     # Fields untuk invoice
-    invoice_ids = fields.One2many('account.move', 'subscription_id', string='Invoice', domain=[('move_type', '=', 'out_invoice')])
+    # Invoice sendiri (subscription_id) dan invoice gabungan (line isp_subscription_id)
+    invoice_ids = fields.Many2many('account.move', string='Invoice', compute='_compute_invoice_ids',
+                                   search='_search_invoice_ids')
     invoice_count = fields.Integer(string='Jumlah Invoice', compute='_compute_invoice_count')
     
     # Fields untuk invoice tracking
@@ -76,6 +164,13 @@ class ISPSubscription(models.Model):
          'CPE ini sudah memiliki subscription aktif!')
     ]
     
+    def init(self):
+        # Index parsial untuk klaim subscription jatuh tempo oleh worker billing
+        create_index(
+            self._cr, 'isp_subscription_billing_due_idx', self._table,
+            ['next_invoice_date', 'id'], where="state = 'open'"
+        )
+
     @api.model_create_multi
     def create(self, vals_list):
         for vals in vals_list:
@@ -108,19 +203,12 @@ class ISPSubscription(models.Model):
                 base_date = record.last_invoice_date
             else:
                 base_date = record.date_start
-                
-            # Hitung bulan berikutnya
-            if record.recurring_rule_type == 'monthly':
-                next_date = base_date + relativedelta(months=record.recurring_interval)
-            elif record.recurring_rule_type == 'quarterly':
-                next_date = base_date + relativedelta(months=3*record.recurring_interval)
-                
-            # Sesuaikan tanggal jatuh tempo
-            try:
-                record.next_invoice_date = next_date.replace(day=record.due_day)
-            except ValueError:  # Untuk bulan dengan tanggal < 31
-                # Jika tanggal jatuh tempo > hari dalam bulan, gunakan hari terakhir bulan
-                record.next_invoice_date = next_date + relativedelta(day=31)
+            if not base_date:
+                record.next_invoice_date = False
+                continue
+            record.next_invoice_date = _next_period_date(
+                base_date, record.recurring_rule_type, record.recurring_interval, record.due_day
+            )
 
     @api.depends('amount', 'discount_id', 'discount_type', 'discount_value')
     def _compute_discount_amount(self):
@@ -135,27 +223,29 @@ class ISPSubscription(models.Model):
                     record.discount_amount = record.discount_value
                 record.final_amount = record.amount - record.discount_amount
 
-    def _prepare_invoice_values(self):
-        """Menyiapkan nilai untuk pembuatan invoice dengan diskon"""
+    def _prepare_invoice_values(self, invoice_date=None, billing_context=None):
+        """
+        Menyiapkan nilai untuk pembuatan invoice dengan diskon.
+        Jurnal dan akun diambil dari billing_context agar tidak dicari ulang untuk setiap invoice.
+        """
         self.ensure_one()
-        
-        # Dapatkan jurnal penjualan
-        sale_journal = self.env['account.journal'].search([('type', '=', 'sale')], limit=1)
-        if not sale_journal:
-            raise ValidationError('Tidak ditemukan jurnal penjualan. Silakan buat jurnal penjualan terlebih dahulu.')
-            
-        # Dapatkan akun pendapatan dari produk/paket
-        income_account = self.package_id.product_id.property_account_income_id or \
-                        self.package_id.product_id.categ_id.property_account_income_categ_id
-        if not income_account:
-            raise ValidationError('Tidak ditemukan akun pendapatan pada produk/paket. Silakan atur akun pendapatan pada produk atau kategori produk.')
+        billing_context = billing_context or BillingContext(self.env)
+        sale_journal_id = billing_context.get_sale_journal_id()
+        income_account_id = billing_context.get_income_account_id(self.package_id)
+        # Paket dan router saat ditagih dibekukan di line untuk snapshot pendapatan
+        billing_keys = {
+            'isp_subscription_id': self.id,
+            'isp_package_id': self.package_id.id,
+            'isp_mikrotik_id': self._get_mikrotik_config().id,
+        }
         
         # Siapkan line invoice utama
         invoice_line = {
             'name': f'Subscription {self.name} - {self.package_id.name}',
             'quantity': 1,
             'price_unit': self.amount,
-            'account_id': income_account.id,
+            'account_id': income_account_id,
+            **billing_keys,
         }
         
         # Jika ada diskon, tambahkan line diskon
@@ -164,7 +254,8 @@ class ISPSubscription(models.Model):
                 'name': f'Diskon: {self.discount_id.name}',
                 'quantity': 1,
                 'price_unit': -self.discount_amount,  # Nilai negatif untuk pengurangan
-                'account_id': self.discount_id.account_id.id,
+                'account_id': billing_context.get_discount_account_id(self.discount_id),
+                **billing_keys,
             }
             invoice_lines = [(0, 0, invoice_line), (0, 0, invoice_line_discount)]
         else:
@@ -173,28 +264,136 @@ class ISPSubscription(models.Model):
         return {
             'move_type': 'out_invoice',
             'partner_id': self.partner_id.id,
-            'invoice_date': fields.Date.today(),
+            'invoice_date': invoice_date or fields.Date.today(),
             'subscription_id': self.id,
-            'journal_id': sale_journal.id,
+            'journal_id': sale_journal_id,
             'invoice_line_ids': invoice_lines,
         }
 
-    def _check_existing_invoice(self):
-        """Cek apakah sudah ada invoice di bulan berjalan"""
+    def _get_billing_period_date(self, billing_date):
+        """
+        Tanggal periode yang ditagih: next_invoice_date jika sudah jatuh tempo,
+        selain itu tanggal billing (penagihan lebih awal)
+        """
         self.ensure_one()
-        today = fields.Date.today()
+        if self.next_invoice_date and self.next_invoice_date <= billing_date:
+            return self.next_invoice_date
+        return billing_date
+
+    def _get_billing_period(self, period_date):
+        """
+        Rentang periode tagihan yang memuat period_date
+        Returns: (tanggal_awal, tanggal_akhir)
+        """
+        self.ensure_one()
+        return _period_range(period_date, self.recurring_rule_type, self.recurring_interval)
+
+    def _get_unbilled_periods(self, until_date):
+        """
+        Semua tanggal periode yang belum ditagih sampai until_date, dihitung dari
+        last_invoice_date (atau date_start), tipe penagihan dan tanggal jatuh tempo
+        """
+        self.ensure_one()
+        period_dates = []
+        period_date = self.next_invoice_date
+        while period_date and period_date <= until_date:
+            period_dates.append(period_date)
+            next_date = _next_period_date(
+                period_date, self.recurring_rule_type, self.recurring_interval, self.due_day
+            )
+            if next_date <= period_date:
+                break
+            period_date = next_date
+        return period_dates
+
+    @api.model
+    def _get_invoiced_periods(self, periods):
+        """
+        Guard invoice ganda untuk banyak subscription sekaligus.
+        periods: dict {subscription_id: [(tanggal_awal, tanggal_akhir), ...]}
+        Returns: set (subscription_id, tanggal_awal) untuk periode yang sudah memiliki invoice,
+        dimuat dengan satu query yang memakai index account_move(subscription_id, move_type, invoice_date)
+        dan account_move_line(isp_subscription_id) untuk invoice gabungan.
+        """
+        periods = {subscription_id: ranges for subscription_id, ranges in periods.items() if ranges}
+        if not periods:
+            return set()
+        self.env['account.move'].flush_model(['subscription_id', 'move_type', 'invoice_date'])
+        self.env['account.move.line'].flush_model(['isp_subscription_id', 'move_id'])
+        date_from = min(period[0] for ranges in periods.values() for period in ranges)
+        date_to = max(period[1] for ranges in periods.values() for period in ranges)
+        self.env.cr.execute("""
+            SELECT subscription_id, array_agg(DISTINCT invoice_date)
+              FROM (
+                    SELECT subscription_id, invoice_date
+                      FROM account_move
+                     WHERE subscription_id = ANY(%s)
+                       AND move_type = 'out_invoice'
+                       AND invoice_date BETWEEN %s AND %s
+                 UNION ALL
+                    SELECT line.isp_subscription_id, move.invoice_date
+                      FROM account_move_line line
+                      JOIN account_move move ON move.id = line.move_id
+                     WHERE line.isp_subscription_id = ANY(%s)
+                       AND move.move_type = 'out_invoice'
+                       AND move.invoice_date BETWEEN %s AND %s
+                   ) invoiced
+          GROUP BY subscription_id
+        """, (list(periods), date_from, date_to, list(periods), date_from, date_to))
+        invoiced_periods = set()
+        for subscription_id, invoice_dates in self.env.cr.fetchall():
+            for period_start, period_end in periods[subscription_id]:
+                if any(period_start <= invoice_date <= period_end for invoice_date in invoice_dates):
+                    invoiced_periods.add((subscription_id, period_start))
+        return invoiced_periods
+
+    def _get_pending_billing_periods(self, billing_date, catch_up=False):
+        """
+        Periode yang akan ditagih per subscription beserta status invoice-nya.
+        Tanpa catch_up hanya satu periode per subscription; dengan catch_up semua
+        periode yang terlewat sampai billing_date.
+        Returns: dict {subscription_id: [(tanggal_periode, sudah_ada_invoice), ...]}
+        """
+        period_dates = {}
+        for subscription in self:
+            if catch_up:
+                period_dates[subscription.id] = subscription._get_unbilled_periods(billing_date)
+            else:
+                period_dates[subscription.id] = [subscription._get_billing_period_date(billing_date)]
+
+        ranges = {}
+        for subscription in self:
+            ranges[subscription.id] = [
+                subscription._get_billing_period(period_date) for period_date in period_dates[subscription.id]
+            ]
+        invoiced_periods = self._get_invoiced_periods(ranges)
+        return {
+            subscription_id: [
+                (period_date, (subscription_id, period_range[0]) in invoiced_periods)
+                for period_date, period_range in zip(dates, ranges[subscription_id])
+            ]
+            for subscription_id, dates in period_dates.items()
+        }
+
+    def _check_existing_invoice(self, period_date=None):
+        """Cek apakah sudah ada invoice pada periode tagihan (default: periode berjalan)"""
+        self.ensure_one()
+        period_start, period_end = self._get_billing_period(period_date or fields.Date.today())
         existing_invoice = self.env['account.move'].search([
+            '|',
             ('subscription_id', '=', self.id),
+            ('line_ids.isp_subscription_id', '=', self.id),
             ('move_type', '=', 'out_invoice'),
-            ('invoice_date', '>=', today.replace(day=1)),  # awal bulan
-            ('invoice_date', '<=', (today.replace(day=1) + relativedelta(months=1, days=-1))),  # akhir bulan
+            ('invoice_date', '>=', period_start),
+            ('invoice_date', '<=', period_end),
         ], limit=1)
         return existing_invoice
 
     def unlink_draft_invoice(self):
         """Hapus invoice yang masih draft"""
         self.ensure_one()
-        draft_invoices = self.invoice_ids.filtered(lambda i: i.state == 'draft')
+        # Invoice gabungan ikut menagih subscription lain, jadi hanya invoice sendiri yang dihapus
+        draft_invoices = self.invoice_ids.filtered(lambda i: i.state == 'draft' and i.subscription_id == self)
         if draft_invoices:
             draft_invoices.unlink()
             return {
@@ -216,6 +415,66 @@ class ISPSubscription(models.Model):
             }
         }
 
+    def _get_invoice_domain(self):
+        return [
+            '|',
+            ('subscription_id', 'in', self.ids),
+            ('line_ids.isp_subscription_id', 'in', self.ids),
+            ('move_type', '=', 'out_invoice'),
+        ]
+
+    def _compute_invoice_ids(self):
+        """
+        Invoice customer per subscription dengan satu query: lewat subscription_id invoice
+        atau line invoice gabungan, sama seperti _get_invoiced_periods dan _get_dunning_candidates.
+        """
+        ids = [record.id for record in self if record.id]
+        invoice_ids = {}
+        if ids:
+            self.env['account.move'].flush_model(['subscription_id', 'move_type'])
+            self.env['account.move.line'].flush_model(['isp_subscription_id', 'move_id'])
+            self.env.cr.execute("""
+                SELECT subscription_id, array_agg(DISTINCT move_id ORDER BY move_id DESC)
+                  FROM (
+                        SELECT subscription_id, id AS move_id
+                          FROM account_move
+                         WHERE subscription_id = ANY(%s)
+                           AND move_type = 'out_invoice'
+                     UNION ALL
+                        SELECT line.isp_subscription_id, move.id
+                          FROM account_move_line line
+                          JOIN account_move move ON move.id = line.move_id
+                         WHERE line.isp_subscription_id = ANY(%s)
+                           AND move.move_type = 'out_invoice'
+                       ) invoices
+              GROUP BY subscription_id
+            """, (ids, ids))
+            invoice_ids = dict(self.env.cr.fetchall())
+        for record in self:
+            record.invoice_ids = [(6, 0, invoice_ids.get(record.id, []))]
+
+    def _search_invoice_ids(self, operator, value):
+        """Pencarian invoice_ids (termasuk domain path seperti invoice_ids.state) lewat subquery"""
+        if operator in ('=', '!=') and not value:
+            # Tanpa invoice sama sekali / punya minimal satu invoice
+            operator, value = ('not in' if operator == '=' else 'in'), self.env['account.move']._search([])
+        elif operator in ('=', '!='):
+            operator, value = ('in' if operator == '=' else 'not in'), [value]
+        if operator not in ('in', 'not in'):
+            raise ValidationError(f'Operator {operator} tidak didukung untuk pencarian invoice')
+        own = self.env['account.move']._search([
+            ('id', 'in', value), ('move_type', '=', 'out_invoice'), ('subscription_id', '!=', False),
+        ])
+        consolidated = self.env['account.move.line']._search([
+            ('move_id', 'in', value), ('move_id.move_type', '=', 'out_invoice'), ('isp_subscription_id', '!=', False),
+        ])
+        domain = [
+            '|',
+            ('id', 'in', own.subselect('subscription_id')),
+            ('id', 'in', consolidated.subselect('isp_subscription_id')),
+        ]
+        return domain if operator == 'in' else ['!'] + domain
+
     @api.depends('invoice_ids')
     def _compute_invoice_count(self):
         for record in self:
@@ -241,7 +500,41 @@ class ISPSubscription(models.Model):
                         record.invoice_paid_count += 1
                     elif invoice.payment_state in ['not_paid', 'partial'] and invoice.invoice_date_due < fields.Date.today():
                         record.invoice_overdue_count += 1
-                        record.total_unpaid_amount += invoice.amount_residual
+                        record.total_unpaid_amount += record._get_invoice_share(invoice) * invoice.amount_residual
+
+    def _get_invoice_share(self, invoice):
+        """Porsi subscription ini pada invoice: 1 untuk invoice sendiri, proporsional line pada invoice gabungan"""
+        self.ensure_one()
+        if invoice.subscription_id == self:
+            return 1.0
+        if not invoice.amount_total:
+            return 0.0
+        lines = invoice.invoice_line_ids.filtered(lambda line: line.isp_subscription_id == self)
+        return sum(lines.mapped('price_total')) / invoice.amount_total
+
+    def _with_batch_mode(self):
+        """Recordset dengan context mode batch (lihat BATCH_MODE_CONTEXT)"""
+        return self.with_context(**BATCH_MODE_CONTEXT)
+
+    def _notify_user(self, message, title='Sukses', notification_type='success'):
+        """Notifikasi bus ke user aktif, dilewati pada mode batch"""
+        if self.env.context.get('isp_batch_mode'):
+            return
+        self.env['bus.bus']._sendone(
+            self.env.user.partner_id,
+            'simple_notification',
+            {
+                'title': title,
+                'message': message,
+                'type': notification_type,
+            }
+        )
+
+    def _post_chatter(self, body, **kwargs):
+        """Post pesan di chatter subscription, dilewati pada mode batch"""
+        if self.env.context.get('isp_batch_mode'):
+            return False
+        return self.message_post(body=body, **kwargs)
 
     def generate_invoice(self):
         """Generate invoice for subscription"""
@@ -254,49 +547,42 @@ class ISPSubscription(models.Model):
         if self.state not in ['open', 'isolated']:
             raise ValidationError('Hanya subscription dengan status open atau terisolir yang dapat membuat invoice!')
 
-        # Cek invoice bulan berjalan
-        existing_invoice = self._check_existing_invoice()
+        self._lock_for_billing()
+
+        # Cek invoice pada periode yang akan ditagih
+        period_date = self._get_billing_period_date(fields.Date.today())
+        existing_invoice = self._check_existing_invoice(period_date)
         if existing_invoice:
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
                 'params': {
                     'title': 'Peringatan',
-                    'message': f'Invoice untuk bulan {fields.Date.today().strftime("%B %Y")} sudah dibuat dengan nomor {existing_invoice.name}',
+                    'message': f'Invoice untuk bulan {period_date.strftime("%B %Y")} sudah dibuat dengan nomor {existing_invoice.name}',
                     'type': 'warning',
                     'sticky': True,
                 }
             }
             
         # Buat invoice baru
-        invoice_vals = self._prepare_invoice_values()
+        invoice_vals = self._prepare_invoice_values(invoice_date=period_date)
         
         _logger.info(f'Creating invoice with values: {invoice_vals}')
         try:
             invoice = self.env['account.move'].create(invoice_vals)
             _logger.info(f'Invoice created with ID: {invoice.id}')
+            self._post_generated_invoices(invoice)
             
-            # Update tanggal tagihan terakhir
-            self.write({
-                'last_invoice_date': fields.Date.today(),
-                'next_invoice_date': fields.Date.today() + relativedelta(months=self.recurring_interval)
-            })
+            # Update tanggal tagihan terakhir, next_invoice_date dihitung ulang dari periode ini
+            self.write({'last_invoice_date': period_date})
             
             # Post message di chatter dengan link ke invoice
             msg = f'Invoice <a href="#" data-oe-model="account.move" data-oe-id="{invoice.id}">{invoice.name}</a> berhasil dibuat'
-            self.message_post(body=msg, message_type='notification')
+            self._post_chatter(msg, message_type='notification')
             _logger.info(f'Invoice {invoice.name} berhasil dibuat')
             
             # Tampilkan notifikasi sukses
-            self.env['bus.bus']._sendone(
-                self.env.user.partner_id,
-                'simple_notification',
-                {
-                    'title': 'Sukses',
-                    'message': f'Invoice {invoice.name} berhasil dibuat',
-                    'type': 'success',
-                }
-            )
+            self._notify_user(f'Invoice {invoice.name} berhasil dibuat')
             
             # Return action untuk membuka invoice
             return {
@@ -310,18 +596,559 @@ class ISPSubscription(models.Model):
         except Exception as e:
             error_msg = f'Gagal membuat invoice: {str(e)}'
             _logger.error(error_msg)
-            self.message_post(body=error_msg)
+            self._post_chatter(error_msg)
             raise ValidationError(error_msg)
 
-    def cron_generate_invoices(self):
-        """Cron job untuk membuat invoice otomatis"""
-        today = fields.Date.today()
-        subscriptions = self.search([
-            ('state', '=', 'open'),
-            ('next_invoice_date', '<=', today)
+    @api.model
+    def _get_billing_batch_size(self):
+        """Jumlah subscription per chunk pada billing massal"""
+        batch_size = self.env['ir.config_parameter'].sudo().get_param('dkt_isp_billing.billing_batch_size', 500)
+        try:
+            return max(int(batch_size), 1)
+        except (TypeError, ValueError):
+            return 500
+
+    @api.model
+    def _get_billing_flag(self, key):
+        """Nilai boolean parameter dkt_isp_billing.<key>"""
+        value = self.env['ir.config_parameter'].sudo().get_param(f'dkt_isp_billing.{key}', 'False')
+        return str2bool(value, False)
+
+    def _with_customer_siblings(self, until_date, catch_up=False):
+        """
+        Tambahkan subscription lain milik pelanggan yang sama dengan periode berikutnya sampai
+        until_date (akhir periode billing) agar semua tagihan pelanggan dalam periode tersebut
+        masuk ke satu invoice. Subscription yang sedang dikunci worker lain dilewati.
+        """
+        if not self:
+            return self
+        self.flush_model(['customer_id', 'state', 'next_invoice_date'])
+        self.env.cr.execute("""
+            SELECT id
+              FROM isp_subscription
+             WHERE customer_id = ANY(%s)
+               AND state = ANY(%s)
+               AND next_invoice_date <= %s
+               AND id != ALL(%s)
+          ORDER BY id
+               FOR UPDATE SKIP LOCKED
+        """, (self.customer_id.ids, ['open', 'isolated'] if catch_up else ['open'], until_date, self.ids))
+        return self | self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _consolidate_invoice_values(self, vals_list):
+        """
+        Menggabungkan nilai invoice menjadi satu invoice per pelanggan per periode billing
+        (awal periode dari _period_range), dengan satu line per subscription dan diskon.
+        Tanggal invoice gabungan adalah tanggal periode paling awal di dalamnya, sehingga
+        subscription dengan tanggal jatuh tempo berbeda tetap masuk satu invoice.
+        Biaya instalasi yang sudah dikonfirmasi tapi belum ditagih ditambahkan ke invoice
+        pertama pelanggan.
+        Returns: (vals_list, biaya instalasi per invoice)
+        """
+        grouped = {}
+        for vals in vals_list:
+            subscription = self.browse(vals['subscription_id'])
+            key = (vals['partner_id'], subscription._get_billing_period(vals['invoice_date'])[0])
+            if key in grouped:
+                invoice_vals = grouped[key]
+                invoice_vals['invoice_line_ids'] += vals['invoice_line_ids']
+                invoice_vals['invoice_date'] = min(invoice_vals['invoice_date'], vals['invoice_date'])
+                if invoice_vals['subscription_id'] != vals['subscription_id']:
+                    # Invoice gabungan beberapa subscription, link ada di line
+                    invoice_vals['subscription_id'] = False
+            else:
+                grouped[key] = dict(vals, invoice_line_ids=list(vals['invoice_line_ids']))
+
+        consolidated_vals = sorted(grouped.values(), key=lambda vals: (vals['partner_id'], vals['invoice_date']))
+        fees_list = [self.env['isp.installation.fee']] * len(consolidated_vals)
+        fees = self.env['isp.installation.fee'].search([
+            ('customer_id.partner_id', 'in', [vals['partner_id'] for vals in consolidated_vals]),
+            ('state', '=', 'confirmed'),
+            ('invoice_id', '=', False),
         ])
+        fees_by_partner = {}
+        for fee in fees:
+            fees_by_partner.setdefault(fee.customer_id.partner_id.id, []).append(fee.id)
+        for index, vals in enumerate(consolidated_vals):
+            fee_ids = fees_by_partner.pop(vals['partner_id'], None)
+            if fee_ids:
+                partner_fees = self.env['isp.installation.fee'].browse(fee_ids)
+                vals['invoice_line_ids'] += [(0, 0, fee._prepare_invoice_line()) for fee in partner_fees]
+                fees_list[index] = partner_fees
+        return consolidated_vals, fees_list
+
+    @api.model
+    def _post_generated_invoices(self, invoices):
+        """Posting invoice hasil billing sekaligus bila parameter billing_auto_post aktif"""
+        invoices = invoices.filtered(lambda invoice: invoice.state == 'draft')
+        if invoices and self._get_billing_flag('billing_auto_post'):
+            # Satu action_post untuk semua invoice agar penomoran dan validasi dilakukan sekaligus
+            invoices.action_post()
+
+    def _generate_invoices_batch(self, billing_date, billing_context=None, catch_up=False):
+        """
+        Membuat invoice untuk sekumpulan subscription dengan satu create(vals_list).
+        Dengan catch_up, setiap periode yang terlewat dibuatkan invoice dengan tanggal periodenya.
+        Pada mode invoice gabungan (billing_consolidated), subscription lain milik pelanggan yang sama
+        ikut ditagih sampai akhir bulan billing_date dan semua tagihan pelanggan per periode
+        digabung dalam satu invoice.
+        Returns: invoice yang berhasil dibuat
+        """
+        consolidated = self._get_billing_flag('billing_consolidated')
+        until_date = billing_date
+        subscriptions = self
+        if consolidated:
+            until_date = _period_range(billing_date, 'monthly', 1)[1]
+            subscriptions = self._with_customer_siblings(until_date, catch_up)
+        pending_periods = subscriptions._get_pending_billing_periods(until_date, catch_up=catch_up)
+        billing_context = billing_context or BillingContext(self.env)
+        vals_list = []
+        ids_by_period = {}
         for subscription in subscriptions:
-            subscription.generate_invoice()
+            periods = pending_periods[subscription.id]
+            if not periods:
+                continue
+            for period_date, invoiced in periods:
+                if not invoiced:
+                    vals_list.append(subscription._prepare_invoice_values(
+                        invoice_date=period_date, billing_context=billing_context
+                    ))
+            # Periode yang sudah punya invoice tetap dimajukan agar tidak jatuh tempo terus-menerus
+            ids_by_period.setdefault(periods[-1][0], []).append(subscription.id)
+
+        fees_list = []
+        if consolidated and vals_list:
+            vals_list, fees_list = self._consolidate_invoice_values(vals_list)
+
+        invoices = self.env['account.move'].create(vals_list) if vals_list else self.env['account.move']
+        for invoice, fees in zip(invoices, fees_list):
+            if fees:
+                fees.write({'invoice_id': invoice.id})
+        self._post_generated_invoices(invoices)
+        # Update tanggal tagihan terakhir per periode, next_invoice_date ikut dihitung ulang
+        for period_date, subscription_ids in ids_by_period.items():
+            self.browse(subscription_ids).write({'last_invoice_date': period_date})
+        if invoices and self.env.context.get('isp_batch_mode'):
+            self._log_customer_invoice_summary(invoices)
+        return invoices
+
+    @api.model
+    def _log_customer_invoice_summary(self, invoices):
+        """
+        Satu catatan ringkas per pelanggan untuk invoice yang dibuat pada mode batch,
+        hanya jika parameter dkt_isp_billing.billing_customer_summary diaktifkan
+        """
+        if not self._get_billing_flag('billing_customer_summary'):
+            return
+        bodies = {}
+        for invoice in invoices:
+            subscriptions = invoice.subscription_id or invoice.invoice_line_ids.isp_subscription_id
+            customer = subscriptions[:1].customer_id
+            if customer:
+                bodies.setdefault(customer.id, []).append(
+                    f'{", ".join(subscriptions.mapped("name"))} ({invoice.invoice_date}): {invoice.amount_total:,.2f}'
+                )
+        customers = self.env['isp.customer'].browse(list(bodies))
+        customers._message_log_batch(
+            bodies={customer_id: 'Invoice dibuat: ' + ', '.join(lines) for customer_id, lines in bodies.items()}
+        )
+
+    def _process_billing_chunk(self, billing_date, billing_context=None, catch_up=False):
+        """
+        Memproses satu chunk billing. Jika chunk gagal, chunk diulang per subscription
+        agar satu subscription bermasalah tidak menggagalkan subscription lainnya.
+        Returns: (invoices, failed_subscriptions)
+        """
+        try:
+            with self.env.cr.savepoint():
+                return self._generate_invoices_batch(billing_date, billing_context, catch_up), self.browse()
+        except Exception as e:
+            _logger.warning(f'Batch billing {len(self)} subscription gagal, diulang per subscription: {str(e)}')
+            self.env.invalidate_all()
+
+        invoices = self.env['account.move']
+        failed_ids = []
+        for subscription in self:
+            try:
+                with self.env.cr.savepoint():
+                    invoices |= subscription._generate_invoices_batch(billing_date, billing_context, catch_up)
+            except Exception as e:
+                _logger.error(f'Gagal membuat invoice untuk subscription {subscription.name}: {str(e)}')
+                self.env.invalidate_all()
+                failed_ids.append(subscription.id)
+        return invoices, self.browse(failed_ids)
+
+    @api.model
+    def _claim_due_subscriptions(self, billing_date, limit, after_id=0):
+        """
+        Mengklaim subscription jatuh tempo untuk worker billing ini.
+        Baris dikunci dengan FOR UPDATE SKIP LOCKED sehingga worker lain melewati
+        subscription yang sedang diproses dan setiap worker mendapat batch yang terpisah.
+        Kunci dilepas saat transaksi batch di-commit.
+        """
+        self.env['isp.subscription'].flush_model(['state', 'next_invoice_date'])
+        self.env.cr.execute("""
+            SELECT id
+              FROM isp_subscription
+             WHERE state = 'open'
+               AND next_invoice_date <= %s
+               AND id > %s
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, (billing_date, after_id, limit))
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _lock_for_billing(self):
+        """Kunci subscription sebelum billing manual agar tidak bentrok dengan worker cron"""
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute(
+                    'SELECT id FROM isp_subscription WHERE id = ANY(%s) FOR UPDATE NOWAIT',
+                    (self.ids,)
+                )
+        except psycopg2.errors.LockNotAvailable:
+            raise UserError('Subscription sedang diproses oleh billing otomatis, silakan coba beberapa saat lagi.')
+
+    @api.model
+    def cron_generate_invoices(self, batch_size=None, worker=1):
+        """
+        Cron job untuk membuat invoice otomatis secara batch.
+        Setiap worker mengklaim batch subscription jatuh tempo dengan SKIP LOCKED,
+        sehingga beberapa cron worker dapat berjalan paralel tanpa invoice ganda.
+        Progres dicatat di isp.billing.run sehingga run yang terputus dilanjutkan
+        dari checkpoint terakhir pada eksekusi cron berikutnya.
+        """
+        return self.env['isp.billing.run'].with_context(**BATCH_MODE_CONTEXT)._run_worker(
+            worker=worker, batch_size=batch_size
+        )
+
+    def _preview_billing(self, billing_date, catch_up=False):
+        """
+        Daftar invoice yang akan dibuat untuk subscription ini tanpa menulis apa pun
+        Returns: list of dict per periode
+        """
+        pending_periods = self._get_pending_billing_periods(billing_date, catch_up=catch_up)
+        preview = []
+        for subscription in self:
+            for period_date, invoiced in pending_periods[subscription.id]:
+                if invoiced:
+                    continue
+                preview.append({
+                    'subscription_id': subscription.id,
+                    'invoice_date': period_date,
+                    'amount': subscription.amount,
+                    'discount_amount': subscription.discount_amount,
+                    'final_amount': subscription.final_amount,
+                })
+        return preview
+
+    @api.model
+    def _forecast_billing(self, date_from, date_to, domain=None, with_details=False):
+        """
+        Proyeksi invoice yang akan dibuat cron billing antara date_from dan date_to tanpa menulis apa pun.
+        Subscription dibaca sekali dengan satu query, periode dihitung di memori dengan aturan
+        yang sama dengan next_invoice_date, dan invoice yang sudah ada disaring dengan satu query guard.
+        Periode yang sudah lewat sebelum date_from dihitung pada date_from (ditagih pada run pertama).
+        Returns: dict total beserta 'by_package' dan 'by_due_day' (dan 'invoices' bila with_details)
+        """
+        if date_from > date_to:
+            raise ValidationError('Tanggal awal forecast tidak boleh setelah tanggal akhir!')
+
+        self.flush_model([
+            'package_id', 'due_day', 'next_invoice_date', 'recurring_rule_type', 'recurring_interval',
+            'state', 'amount', 'discount_amount', 'final_amount',
+        ])
+        self.env['isp.package'].flush_model(['name'])
+        query = """
+            SELECT s.id, s.package_id, p.name, s.due_day, s.next_invoice_date,
+                   s.recurring_rule_type, s.recurring_interval,
+                   s.amount, s.discount_amount, s.final_amount
+              FROM isp_subscription s
+              JOIN isp_package p ON p.id = s.package_id
+             WHERE s.state = 'open'
+               AND s.next_invoice_date <= %s
+        """
+        params = [date_to]
+        if domain:
+            query += " AND s.id = ANY(%s)"
+            params.append(self.search(domain).ids)
+        self.env.cr.execute(query, params)
+        rows = self.env.cr.fetchall()
+
+        # Hitung semua periode di memori
+        periods = {}
+        ranges = {}
+        for subscription_id, _package_id, _package_name, due_day, period_date, rule_type, interval, *_amounts in rows:
+            subscription_periods = periods[subscription_id] = []
+            subscription_ranges = ranges[subscription_id] = []
+            while period_date <= date_to:
+                subscription_periods.append(period_date)
+                subscription_ranges.append(_period_range(period_date, rule_type, interval))
+                next_date = _next_period_date(period_date, rule_type, interval, due_day)
+                if next_date <= period_date:
+                    break
+                period_date = next_date
+        invoiced_periods = self._get_invoiced_periods(ranges)
+
+        totals = {'invoice_count': 0, 'amount': 0.0, 'discount_amount': 0.0, 'final_amount': 0.0}
+        by_package = {}
+        by_due_day = {}
+        invoices = []
+        for subscription_id, package_id, package_name, due_day, _next_date, _rule_type, _interval, amount, discount_amount, final_amount in rows:
+            for period_date, period_range in zip(periods[subscription_id], ranges[subscription_id]):
+                if (subscription_id, period_range[0]) in invoiced_periods:
+                    continue
+                package_totals = by_package.setdefault(package_id, {
+                    'package_id': package_id, 'package_name': package_name,
+                    'invoice_count': 0, 'amount': 0.0, 'discount_amount': 0.0, 'final_amount': 0.0,
+                })
+                due_day_totals = by_due_day.setdefault(due_day, {
+                    'due_day': due_day,
+                    'invoice_count': 0, 'amount': 0.0, 'discount_amount': 0.0, 'final_amount': 0.0,
+                })
+                for group_totals in (totals, package_totals, due_day_totals):
+                    group_totals['invoice_count'] += 1
+                    group_totals['amount'] += amount or 0.0
+                    group_totals['discount_amount'] += discount_amount or 0.0
+                    group_totals['final_amount'] += final_amount or 0.0
+                if with_details:
+                    invoices.append({
+                        'subscription_id': subscription_id,
+                        'package_id': package_id,
+                        'period_date': period_date,
+                        'invoice_date': max(period_date, date_from),
+                        'period_start': period_range[0],
+                        'period_end': period_range[1],
+                        'amount': amount or 0.0,
+                        'discount_amount': discount_amount or 0.0,
+                        'final_amount': final_amount or 0.0,
+                    })
+
+        return dict(
+            totals,
+            date_from=date_from,
+            date_to=date_to,
+            subscription_count=len(rows),
+            by_package=sorted(by_package.values(), key=lambda line: line['package_name']),
+            by_due_day=sorted(by_due_day.values(), key=lambda line: line['due_day']),
+            invoices=invoices,
+        )
+
+    @api.model
+    def _backfill_invoices(self, until_date=None, dry_run=False, domain=None, batch_size=None, auto_commit=False):
+        """
+        Engine catch-up: membuat invoice untuk semua periode yang terlewat sampai until_date,
+        per batch dengan tanggal invoice sesuai periodenya.
+        Dengan dry_run hanya mengembalikan daftar invoice yang akan dibuat.
+        Returns: dict ringkasan (dan daftar 'preview' untuk dry_run)
+        """
+        until_date = until_date or fields.Date.today()
+        batch_size = batch_size or self._get_billing_batch_size()
+        subscription_ids = self.search((domain or []) + [
+            ('state', 'in', ['open', 'isolated']),
+            ('next_invoice_date', '<=', until_date)
+        ], order='id').ids
+
+        billing_context = BillingContext(self.env)
+        preview = []
+        invoice_count = 0
+        failed_ids = []
+        for index in range(0, len(subscription_ids), batch_size):
+            chunk = self.browse(subscription_ids[index:index + batch_size])
+            if dry_run:
+                preview += chunk._preview_billing(until_date, catch_up=True)
+            else:
+                invoices, failed = chunk._process_billing_chunk(until_date, billing_context, catch_up=True)
+                invoice_count += len(invoices)
+                failed_ids += failed.ids
+                if auto_commit:
+                    self.env.cr.commit()
+                _logger.info(
+                    f'Backfill invoice s/d {until_date}: batch {index // batch_size + 1}, '
+                    f'{len(invoices)} invoice dari {len(chunk)} subscription'
+                )
+            self.env.invalidate_all()
+
+        return {
+            'until_date': until_date,
+            'subscription_count': len(subscription_ids),
+            'invoice_count': len(preview) if dry_run else invoice_count,
+            'failed_ids': failed_ids,
+            'preview': preview,
+        }
+
+    @api.model
+    def cron_backfill_invoices(self):
+        """Cron job untuk membuat invoice periode yang terlewat saat cron billing tidak berjalan"""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        return self._with_batch_mode()._backfill_invoices(auto_commit=auto_commit)
+
+    @api.model
+    def _get_isolation_grace_days(self):
+        """Masa tenggang (hari) setelah jatuh tempo invoice sebelum subscription diisolir"""
+        grace_days = self.env['ir.config_parameter'].sudo().get_param('dkt_isp_billing.isolation_grace_days', 0)
+        try:
+            return max(int(grace_days), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    @api.model
+    def _get_dunning_candidates(self, due_before):
+        """
+        Subscription yang perlu diisolir dan dibuka kembali, dipilih dengan satu query:
+        open dengan invoice posted belum lunas yang jatuh tempo sebelum due_before (lewat
+        subscription_id invoice atau line invoice gabungan), dan diisolir otomatis tanpa tunggakan lagi.
+        Returns: (ids_isolir, ids_buka_kembali)
+        """
+        self.flush_model(['state', 'auto_isolated'])
+        self.env['account.move'].flush_model(['subscription_id', 'move_type', 'state', 'payment_state', 'invoice_date_due'])
+        self.env['account.move.line'].flush_model(['isp_subscription_id', 'move_id'])
+        self.env.cr.execute("""
+            WITH overdue AS (
+                SELECT move.subscription_id AS subscription_id
+                  FROM account_move move
+                 WHERE move.subscription_id IS NOT NULL
+                   AND move.move_type = 'out_invoice'
+                   AND move.state = 'posted'
+                   AND move.payment_state IN ('not_paid', 'partial')
+                   AND move.invoice_date_due < %(due_before)s
+             UNION
+                SELECT line.isp_subscription_id
+                  FROM account_move_line line
+                  JOIN account_move move ON move.id = line.move_id
+                 WHERE line.isp_subscription_id IS NOT NULL
+                   AND move.move_type = 'out_invoice'
+                   AND move.state = 'posted'
+                   AND move.payment_state IN ('not_paid', 'partial')
+                   AND move.invoice_date_due < %(due_before)s
+            )
+            SELECT sub.id, sub.state
+              FROM isp_subscription sub
+         LEFT JOIN overdue ON overdue.subscription_id = sub.id
+             WHERE (sub.state = 'open' AND overdue.subscription_id IS NOT NULL)
+                OR (sub.state = 'isolated' AND sub.auto_isolated AND overdue.subscription_id IS NULL)
+          ORDER BY sub.id
+        """, {'due_before': due_before})
+        to_isolate, to_reconnect = [], []
+        for subscription_id, state in self.env.cr.fetchall():
+            (to_isolate if state == 'open' else to_reconnect).append(subscription_id)
+        return to_isolate, to_reconnect
+
+    def _get_mikrotik_config(self):
+        """Router subscription ini: router CPE, router paket, atau router default"""
+        self.ensure_one()
+        return (self.cpe_id.mikrotik_id
+                or self.package_id.mikrotik_id
+                or self.env['isp.mikrotik.config'].get_default_config())
+
+    def _push_secrets_disabled(self, disabled):
+        """
+        Kirim disabled=yes/no untuk secret semua subscription ini ke router masing-masing.
+        Setiap router dikerjakan oleh worker sendiri secara paralel; ID secret di-resolve dari
+        snapshot router dan perintah dikirim berkelompok.
+        Returns: subscription yang secret-nya sudah dalam status yang diminta
+        """
+        if not self:
+            return self
+        targets = {}
+        usernames_by_router = {}
+        for subscription in self:
+            mikrotik = subscription._get_mikrotik_config()
+            username = subscription.cpe_id.pppoe_username
+            if not mikrotik:
+                _logger.warning(f'Konfigurasi Mikrotik untuk subscription {subscription.name} tidak ditemukan')
+                continue
+            targets[subscription.id] = (mikrotik.id, username)
+            if username:
+                usernames_by_router.setdefault(mikrotik.id, set()).add(username)
+        if not usernames_by_router:
+            return self.browse()
+
+        results = self.env['isp.mikrotik.config']._set_secrets_disabled_per_router(
+            {config_id: sorted(usernames) for config_id, usernames in usernames_by_router.items()}, disabled
+        )
+        done = set()
+        for config_id, (usernames, missing) in results.items():
+            if missing:
+                _logger.warning(
+                    f'Secret tidak ditemukan/gagal diubah di Mikrotik #{config_id}: {", ".join(missing)}'
+                )
+            done.update((config_id, username) for username in usernames)
+        return self.filtered(lambda subscription: targets.get(subscription.id) in done)
+
+    def _isolate_batch(self):
+        """
+        Isolir banyak subscription sekaligus: disable secret di router, lalu tulis status
+        subscription, CPE dan pelanggan secara set-based (CPE/pelanggan hanya jika tidak
+        ada lagi subscription/CPE open lainnya, sama seperti action_isolate).
+        """
+        subscriptions = self._push_secrets_disabled(True)
+        if not subscriptions:
+            return subscriptions
+        subscriptions.write({'state': 'isolated', 'auto_isolated': True})
+
+        cpes = subscriptions.cpe_id
+        cpes_still_open = self.search([('cpe_id', 'in', cpes.ids), ('state', '=', 'open')]).cpe_id
+        isolated_cpes = (cpes - cpes_still_open).filtered(lambda cpe: cpe.state == 'open')
+        isolated_cpes.write({'state': 'isolated'})
+
+        customers = isolated_cpes.customer_id
+        customers_still_open = self.env['isp.cpe'].search([
+            ('customer_id', 'in', customers.ids),
+            ('state', '=', 'open')
+        ]).customer_id
+        (customers - customers_still_open).filtered(lambda customer: customer.state == 'open').write({'state': 'isolated'})
+        return subscriptions
+
+    def _reconnect_batch(self):
+        """Buka kembali banyak subscription sekaligus setelah tunggakan lunas"""
+        subscriptions = self._push_secrets_disabled(False)
+        if not subscriptions:
+            return subscriptions
+        subscriptions.write({'state': 'open', 'auto_isolated': False})
+        subscriptions.cpe_id.filtered(lambda cpe: cpe.state == 'isolated').write({'state': 'open'})
+        subscriptions.customer_id.filtered(lambda customer: customer.state == 'isolated').write({'state': 'open'})
+        return subscriptions
+
+    @api.model
+    def cron_check_due_date(self):
+        """
+        Cron tunggakan: isolir massal subscription open yang memiliki invoice lewat jatuh tempo
+        (setelah masa tenggang dkt_isp_billing.isolation_grace_days) dan buka kembali subscription
+        yang diisolir otomatis setelah tagihannya lunas. Diproses per batch dan di-commit per batch.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        subscriptions = self._with_batch_mode()
+        due_before = fields.Date.context_today(self) - timedelta(days=self._get_isolation_grace_days())
+        to_isolate, to_reconnect = subscriptions._get_dunning_candidates(due_before)
+        batch_size = self._get_billing_batch_size()
+        started = time.monotonic()
+
+        result = {'isolated': 0, 'reconnected': 0, 'failed': 0}
+        for subscription_ids, method, key in [(to_isolate, '_isolate_batch', 'isolated'),
+                                             (to_reconnect, '_reconnect_batch', 'reconnected')]:
+            for index in range(0, len(subscription_ids), batch_size):
+                chunk = subscriptions.browse(subscription_ids[index:index + batch_size])
+                try:
+                    with self.env.cr.savepoint():
+                        done = getattr(chunk, method)()
+                    result[key] += len(done)
+                    result['failed'] += len(chunk) - len(done)
+                except Exception as e:
+                    _logger.error(f'Cron tunggakan: batch {method} gagal: {str(e)}', exc_info=True)
+                    self.env.invalidate_all()
+                    result['failed'] += len(chunk)
+                if auto_commit:
+                    self.env.cr.commit()
+
+        _logger.info(
+            f'Cron tunggakan (jatuh tempo < {due_before}): {result["isolated"]} diisolir, '
+            f'{result["reconnected"]} dibuka kembali, {result["failed"]} gagal, '
+            f'{time.monotonic() - started:.2f} detik'
+        )
+        return result
 
     def _check_whatsapp_enabled(self):
         """Cek apakah fitur WhatsApp aktif di pengaturan Odoo"""
@@ -375,6 +1202,79 @@ class ISPSubscription(models.Model):
             _logger.error(f'Error saat mengirim notifikasi WhatsApp: {str(e)}')
             return False
 
+    def _use_router_queue(self):
+        """Perubahan router dari action UI dikirim lewat isp.router.command, bukan langsung"""
+        return self._get_billing_flag('router_command_async')
+
+    def _mark_open(self):
+        """Status Odoo setelah subscription diaktifkan"""
+        self.ensure_one()
+        self.write({'state': 'open', 'auto_isolated': False})
+
+        # Update status CPE jika belum aktif
+        if self.cpe_id.state != 'open':
+            self.cpe_id.write({'state': 'open'})
+
+        # Update status pelanggan jika belum aktif
+        if self.customer_id.state != 'open':
+            self.customer_id.write({'state': 'open'})
+
+    def _mark_isolated(self):
+        """Status Odoo setelah subscription diisolir manual"""
+        self.ensure_one()
+        self.write({'state': 'isolated', 'auto_isolated': False})
+
+        # Cek apakah masih ada subscription open untuk CPE ini
+        active_subs = self.search([
+            ('cpe_id', '=', self.cpe_id.id),
+            ('state', '=', 'open'),
+            ('id', '!=', self.id)
+        ])
+
+        if not active_subs:
+            # Jika tidak ada subscription open lain, isolir CPE
+            self.cpe_id.write({'state': 'isolated'})
+
+            # Cek apakah masih ada CPE open untuk pelanggan ini
+            active_cpes = self.env['isp.cpe'].search([
+                ('customer_id', '=', self.customer_id.id),
+                ('state', '=', 'open')
+            ])
+
+            if not active_cpes:
+                # Jika tidak ada CPE open lain, isolir pelanggan
+                self.customer_id.write({'state': 'isolated'})
+
+    def _mark_terminated(self):
+        """Status Odoo setelah subscription diterminasi"""
+        self.ensure_one()
+        self.write({'state': 'terminated'})
+
+        # Cek apakah masih ada subscription aktif untuk CPE ini
+        active_subs = self.search([
+            ('cpe_id', '=', self.cpe_id.id),
+            ('state', 'in', ['open', 'isolated']),
+            ('id', '!=', self.id)
+        ])
+
+        if not active_subs:
+            # Reset CPE ke draft
+            self.cpe_id.write({
+                'state': 'draft',
+                'pppoe_username': False,
+                'pppoe_password': False
+            })
+
+            # Cek apakah masih ada CPE aktif untuk pelanggan ini
+            active_cpes = self.env['isp.cpe'].search([
+                ('customer_id', '=', self.customer_id.id),
+                ('state', 'in', ['open', 'isolated'])
+            ])
+
+            if not active_cpes:
+                # Reset pelanggan ke draft
+                self.customer_id.write({'state': 'draft'})
+
     def action_open(self):
         """Aktivasi subscription dan enable PPPoE secret"""
         self.ensure_one()
@@ -396,98 +1296,65 @@ class ISPSubscription(models.Model):
             raise ValidationError('PPPoE Profile belum memiliki nama!')
             
         # Update profile di Mikrotik sesuai paket
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+        mikrotik = self._get_mikrotik_config()
         if not mikrotik:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
-            
-        try:
-            # Parse host dan port
-            host, port = mikrotik._parse_host_port()
-            
-            # Buat koneksi ke Mikrotik
-            connection = routeros_api.RouterOsApiPool(
-                host=str(host),
-                username=str(mikrotik.username),
-                password=str(mikrotik.password),
-                port=int(port),
-                plaintext_login=True
+
+        if self._use_router_queue():
+            # Perubahan router dicatat di transaksi yang sama dan dikirim oleh worker antrian
+            self.env['isp.router.command']._enqueue(
+                mikrotik, str(self.cpe_id.pppoe_username), 'enable',
+                profile=str(self.package_id.profile_id.name), subscription=self,
             )
+            self._mark_open()
+            self._notify_user('Subscription diaktifkan, perubahan router masuk antrian')
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'reload',
+            }
             
-            api = connection.get_api()
-            if not api:
-                raise ValidationError('Gagal terhubung ke Mikrotik!')
+        try:
+            with mikrotik._borrow_api() as api:
+                try:
+                    # Pastikan username dalam bentuk string
+                    pppoe_username = str(self.cpe_id.pppoe_username or '')
+                    profile_name = str(self.package_id.profile_id.name or '')
                 
-            try:
-                # Pastikan username dalam bentuk string
-                pppoe_username = str(self.cpe_id.pppoe_username or '')
-                profile_name = str(self.package_id.profile_id.name or '')
+                    # Cek PPPoE secret dari snapshot router, tanpa lookup per user
+                    secret_api = api.get_resource('/ppp/secret')
+                    secret = mikrotik._find_secret(api, pppoe_username)
+                    if not secret or not secret['id']:
+                        raise ValidationError(f'PPPoE secret {pppoe_username} tidak ditemukan di Mikrotik!')
+                    secret_id = secret['id']
                 
-                # Cek PPPoE secret
-                secret_api = api.get_resource('/ppp/secret')
-                secrets = secret_api.get(name=pppoe_username)
+                    # Secret yang profile dan statusnya sudah sesuai tidak ditulis ulang
+                    if secret['profile'] == profile_name and not secret['disabled']:
+                        _logger.info(f'Secret {pppoe_username} sudah aktif dengan profile {profile_name}, penulisan dilewati')
+                    else:
+                        # Update profile dan enable secret
+                        update_data = {
+                            'id': str(secret_id),
+                            'profile': profile_name,
+                            'disabled': 'no'
+                        }
+                        _logger.info(f'Updating secret with data: {update_data}')
+
+                        secret_api.set(**update_data)
+                        mikrotik._update_secret_index(pppoe_username, profile=profile_name, disabled=False)
                 
-                if not secrets:
-                    raise ValidationError(f'PPPoE secret {pppoe_username} tidak ditemukan di Mikrotik!')
+                    self._mark_open()
+                    self.cpe_id._mark_secrets_applied(mikrotik)
                     
-                _logger.info(f'Secret response from Mikrotik: {secrets}')
-                
-                # Update profile dan enable secret
-                secret = secrets[0]
-                if not secret:
-                    raise ValidationError(f'Gagal mendapatkan data secret untuk {pppoe_username}')
+                    # Tampilkan notifikasi sukses
+                    self._notify_user('Subscription berhasil diaktifkan')
                 
-                # Coba ambil ID dengan berbagai kemungkinan key
-                secret_id = secret.get('.id') or secret.get('id') or secret.get('.uid')
-                if not secret_id:
-                    # Jika tidak ada ID, coba list semua key yang ada
-                    available_keys = list(secret.keys())
-                    _logger.info(f'Available keys in secret: {available_keys}')
-                    raise ValidationError(f'Gagal mendapatkan ID secret untuk {pppoe_username}. Available keys: {available_keys}')
-                
-                _logger.info(f'Found secret ID: {secret_id}')
-                
-                # Update profile dan enable secret
-                update_data = {
-                    'id': str(secret_id),
-                    'profile': profile_name,
-                    'disabled': 'no'
-                }
-                _logger.info(f'Updating secret with data: {update_data}')
-                
-                secret_api.set(**update_data)
-                
-                # Update status
-                self.write({'state': 'open'})
-                
-                # Update status CPE jika belum aktif
-                if self.cpe_id.state != 'open':
-                    self.cpe_id.write({'state': 'open'})
-                    
-                # Update status pelanggan jika belum aktif
-                if self.customer_id.state != 'open':
-                    self.customer_id.write({'state': 'open'})
-                    
-                # Tampilkan notifikasi sukses
-                self.env['bus.bus']._sendone(
-                    self.env.user.partner_id,
-                    'simple_notification',
-                    {
-                        'title': 'Sukses',
-                        'message': 'Subscription berhasil diaktifkan',
-                        'type': 'success',
+                    return {
+                        'type': 'ir.actions.client',
+                        'tag': 'reload',
                     }
-                )
-                
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'reload',
-                }
-            except Exception as e:
-                _logger.error(f'Error saat mengaktifkan subscription: {str(e)}')
-                raise ValidationError(f'Gagal mengaktifkan subscription: {str(e)}')
-            finally:
-                if api:
-                    connection.disconnect()
+                except Exception as e:
+                    _logger.error(f'Error saat mengaktifkan subscription: {str(e)}')
+                    raise ValidationError(f'Gagal mengaktifkan subscription: {str(e)}')
         except Exception as e:
             _logger.error(f'Error saat koneksi ke Mikrotik: {str(e)}')
             raise ValidationError(f'Gagal terhubung ke Mikrotik: {str(e)}')
@@ -505,109 +1372,61 @@ class ISPSubscription(models.Model):
             raise ValidationError('CPE belum memiliki PPPoE username!')
             
         # Update profile di Mikrotik sesuai paket
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+        mikrotik = self._get_mikrotik_config()
         if not mikrotik:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
-            
-        try:
-            # Parse host dan port
-            host, port = mikrotik._parse_host_port()
-            
-            # Buat koneksi ke Mikrotik
-            connection = routeros_api.RouterOsApiPool(
-                host=str(host),
-                username=str(mikrotik.username),
-                password=str(mikrotik.password),
-                port=int(port),
-                plaintext_login=True
+
+        if self._use_router_queue():
+            self.env['isp.router.command']._enqueue(
+                mikrotik, str(self.cpe_id.pppoe_username), 'disable', subscription=self,
             )
+            self._mark_isolated()
+            self._notify_user('Subscription diisolir, perubahan router masuk antrian')
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'reload',
+            }
             
-            api = connection.get_api()
-            if not api:
-                raise ValidationError('Gagal terhubung ke Mikrotik!')
-                
-            try:
-                # Pastikan username dalam bentuk string
-                pppoe_username = str(self.cpe_id.pppoe_username or '')
-                
-                # Cek PPPoE secret
-                secret_api = api.get_resource('/ppp/secret')
-                secrets = secret_api.get(name=pppoe_username)
-                
-                if not secrets:
-                    raise ValidationError(f'PPPoE secret {pppoe_username} tidak ditemukan di Mikrotik!')
-                    
-                _logger.info(f'Secret response from Mikrotik: {secrets}')
-                
-                # Update profile dan enable secret
-                secret = secrets[0]
-                if not secret:
-                    raise ValidationError(f'Gagal mendapatkan data secret untuk {pppoe_username}')
-                
-                # Coba ambil ID dengan berbagai kemungkinan key
-                secret_id = secret.get('.id') or secret.get('id') or secret.get('.uid')
-                if not secret_id:
-                    # Jika tidak ada ID, coba list semua key yang ada
-                    available_keys = list(secret.keys())
-                    _logger.info(f'Available keys in secret: {available_keys}')
-                    raise ValidationError(f'Gagal mendapatkan ID secret untuk {pppoe_username}. Available keys: {available_keys}')
-                
-                _logger.info(f'Found secret ID: {secret_id}')
-                
-                # Disable secret
-                update_data = {
-                    'id': str(secret_id),
-                    'disabled': 'yes'
-                }
-                _logger.info(f'Updating secret with data: {update_data}')
+        try:
+            with mikrotik._borrow_api() as api:
+                try:
+                    # Pastikan username dalam bentuk string
+                    pppoe_username = str(self.cpe_id.pppoe_username or '')
                 
-                secret_api.set(**update_data)
+                    # Cek PPPoE secret dari snapshot router, tanpa lookup per user
+                    secret_api = api.get_resource('/ppp/secret')
+                    secret = mikrotik._find_secret(api, pppoe_username)
+                    if not secret or not secret['id']:
+                        raise ValidationError(f'PPPoE secret {pppoe_username} tidak ditemukan di Mikrotik!')
+                    secret_id = secret['id']
                 
-                # Update status
-                self.write({'state': 'isolated'})
+                    # Secret yang sudah disabled tidak ditulis ulang
+                    if secret['disabled']:
+                        _logger.info(f'Secret {pppoe_username} sudah disabled, penulisan dilewati')
+                    else:
+                        # Disable secret
+                        update_data = {
+                            'id': str(secret_id),
+                            'disabled': 'yes'
+                        }
+                        _logger.info(f'Updating secret with data: {update_data}')
+
+                        secret_api.set(**update_data)
+                        mikrotik._update_secret_index(pppoe_username, disabled=True)
                 
-                # Cek apakah masih ada subscription open untuk CPE ini
-                active_subs = self.search([
-                    ('cpe_id', '=', self.cpe_id.id),
-                    ('state', '=', 'open'),
-                    ('id', '!=', self.id)
-                ])
+                    self._mark_isolated()
+                    self.cpe_id._mark_secrets_applied(mikrotik)
                 
-                if not active_subs:
-                    # Jika tidak ada subscription open lain, isolir CPE
-                    self.cpe_id.write({'state': 'isolated'})
-                    
-                    # Cek apakah masih ada CPE open untuk pelanggan ini
-                    active_cpes = self.env['isp.cpe'].search([
-                        ('customer_id', '=', self.customer_id.id),
-                        ('state', '=', 'open')
-                    ])
-                    
-                    if not active_cpes:
-                        # Jika tidak ada CPE open lain, isolir pelanggan
-                        self.customer_id.write({'state': 'isolated'})
+                    # Tampilkan notifikasi sukses
+                    self._notify_user('Subscription berhasil diisolir')
                 
-                # Tampilkan notifikasi sukses
-                self.env['bus.bus']._sendone(
-                    self.env.user.partner_id,
-                    'simple_notification',
-                    {
-                        'title': 'Sukses',
-                        'message': 'Subscription berhasil diisolir',
-                        'type': 'success',
+                    return {
+                        'type': 'ir.actions.client',
+                        'tag': 'reload',
                     }
-                )
-                
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'reload',
-                }
-            except Exception as e:
-                _logger.error(f'Error saat mengisolir subscription: {str(e)}')
-                raise ValidationError(f'Gagal mengisolir subscription: {str(e)}')
-            finally:
-                if api:
-                    connection.disconnect()
+                except Exception as e:
+                    _logger.error(f'Error saat mengisolir subscription: {str(e)}')
+                    raise ValidationError(f'Gagal mengisolir subscription: {str(e)}')
         except Exception as e:
             _logger.error(f'Error saat koneksi ke Mikrotik: {str(e)}')
             raise ValidationError(f'Gagal terhubung ke Mikrotik: {str(e)}')
@@ -619,91 +1438,49 @@ class ISPSubscription(models.Model):
             raise ValidationError('Hanya subscription open atau terisolir yang dapat diterminasi!')
             
         # Update profile di Mikrotik sesuai paket
-        mikrotik = self.env['isp.mikrotik.config'].search([('active', '=', True)], limit=1)
+        mikrotik = self._get_mikrotik_config()
         if not mikrotik:
             raise ValidationError('Konfigurasi Mikrotik tidak ditemukan!')
+
+        if self._use_router_queue():
+            # Username dicatat di perintah sebelum CPE di-reset
+            if self.cpe_id.pppoe_username:
+                self.env['isp.router.command']._enqueue(
+                    mikrotik, str(self.cpe_id.pppoe_username), 'remove', subscription=self,
+                )
+            self._mark_terminated()
+            self._notify_user('Subscription diterminasi, penghapusan secret masuk antrian')
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'reload',
+            }
             
         try:
-            # Parse host dan port
-            host, port = mikrotik._parse_host_port()
-            
-            # Buat koneksi ke Mikrotik
-            connection = routeros_api.RouterOsApiPool(
-                host=str(host),
-                username=str(mikrotik.username),
-                password=str(mikrotik.password),
-                port=int(port),
-                plaintext_login=True
-            )
-            
-            api = connection.get_api()
-            if not api:
-                raise ValidationError('Gagal terhubung ke Mikrotik!')
+            with mikrotik._borrow_api() as api:
+                try:
+                    # Pastikan username dalam bentuk string
+                    pppoe_username = str(self.cpe_id.pppoe_username or '')
                 
-            try:
-                # Pastikan username dalam bentuk string
-                pppoe_username = str(self.cpe_id.pppoe_username or '')
-                
-                # Cek PPPoE secret
-                secret_api = api.get_resource('/ppp/secret')
-                secrets = secret_api.get(name=pppoe_username)
+                    # Cek PPPoE secret dari snapshot router
+                    secret_api = api.get_resource('/ppp/secret')
+                    secret = mikrotik._find_secret(api, pppoe_username)
+                    if secret and secret['id']:
+                        # Hapus secret dari Mikrotik
+                        secret_api.remove(id=str(secret['id']))
+                        mikrotik._forget_secrets([pppoe_username])
                 
-                if secrets:
-                    # Hapus secret dari Mikrotik
-                    secret = secrets[0]
-                    secret_id = secret.get('.id') or secret.get('id') or secret.get('.uid')
-                    if secret_id:
-                        secret_api.remove(id=str(secret_id))
+                    self._mark_terminated()
                 
-                # Update status subscription
-                self.write({'state': 'terminated'})
+                    # Tampilkan notifikasi sukses
+                    self._notify_user('Subscription berhasil diterminasi')
                 
-                # Cek apakah masih ada subscription aktif untuk CPE ini
-                active_subs = self.search([
-                    ('cpe_id', '=', self.cpe_id.id),
-                    ('state', 'in', ['open', 'isolated']),
-                    ('id', '!=', self.id)
-                ])
-                
-                if not active_subs:
-                    # Reset CPE ke draft
-                    self.cpe_id.write({
-                        'state': 'draft',
-                        'pppoe_username': False,
-                        'pppoe_password': False
-                    })
-                    
-                    # Cek apakah masih ada CPE aktif untuk pelanggan ini
-                    active_cpes = self.env['isp.cpe'].search([
-                        ('customer_id', '=', self.customer_id.id),
-                        ('state', 'in', ['open', 'isolated'])
-                    ])
-                    
-                    if not active_cpes:
-                        # Reset pelanggan ke draft
-                        self.customer_id.write({'state': 'draft'})
-                
-                # Tampilkan notifikasi sukses
-                self.env['bus.bus']._sendone(
-                    self.env.user.partner_id,
-                    'simple_notification',
-                    {
-                        'title': 'Sukses',
-                        'message': 'Subscription berhasil diterminasi',
-                        'type': 'success',
+                    return {
+                        'type': 'ir.actions.client',
+                        'tag': 'reload',
                     }
-                )
-                
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'reload',
-                }
-            except Exception as e:
-                _logger.error(f'Error saat terminasi subscription: {str(e)}')
-                raise ValidationError(f'Gagal terminasi subscription: {str(e)}')
-            finally:
-                if api:
-                    connection.disconnect()
+                except Exception as e:
+                    _logger.error(f'Error saat terminasi subscription: {str(e)}')
+                    raise ValidationError(f'Gagal terminasi subscription: {str(e)}')
         except Exception as e:
             _logger.error(f'Error saat koneksi ke Mikrotik: {str(e)}')
             raise ValidationError(f'Gagal terhubung ke Mikrotik: {str(e)}')
@@ -716,7 +1493,7 @@ class ISPSubscription(models.Model):
             'view_mode': 'tree,form',
             'res_model': 'account.move',
             'type': 'ir.actions.act_window',
-            'domain': [('subscription_id', '=', self.id), ('move_type', '=', 'out_invoice')],
+            'domain': self._get_invoice_domain(),
             'context': {'default_subscription_id': self.id, 'default_move_type': 'out_invoice'},
         }
         
@@ -1,2 +1 @@
-# Kosong untuk sekarang karena kita hanya punya template QWeb
-# Jika nanti ada model report khusus, bisa ditambahkan di sini 
\ No newline at end of file
+from . import isp_report
\ No newline at end of file
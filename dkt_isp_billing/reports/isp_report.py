@@ -0,0 +1,46 @@
+from odoo import models, api
+
+
+class ReportISPCustomer(models.AbstractModel):
+    _name = 'report.dkt_isp_billing.report_customer'
+    _description = 'Laporan Pelanggan'
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        return self.env['isp.report']._get_report_values(docids, data)
+
+
+class ReportISPCpe(models.AbstractModel):
+    _name = 'report.dkt_isp_billing.report_cpe'
+    _description = 'Laporan CPE'
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        return self.env['isp.report']._get_report_values(docids, data)
+
+
+class ReportISPPackage(models.AbstractModel):
+    _name = 'report.dkt_isp_billing.report_package'
+    _description = 'Laporan Paket'
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        return self.env['isp.report']._get_report_values(docids, data)
+
+
+class ReportISPFinancial(models.AbstractModel):
+    _name = 'report.dkt_isp_billing.report_financial'
+    _description = 'Laporan Keuangan'
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        return self.env['isp.report']._get_report_values(docids, data)
+
+
+class ReportISPProfitLoss(models.AbstractModel):
+    _name = 'report.dkt_isp_billing.report_profit_loss'
+    _description = 'Laporan Laba Rugi'
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        return self.env['isp.report']._get_report_values(docids, data)
\ No newline at end of file
@@ -0,0 +1,2 @@
+from . import test_isp_report
+from . import test_routeros_async
\ No newline at end of file
@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+from lxml import html
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestISPReportQueries(TransactionCase):
+    """Laporan pelanggan/CPE/paket dirender dengan jumlah query yang sama berapa pun jumlah barisnya"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True, mail_create_nolog=True))
+        today = fields.Date.today()
+        cls.reports = {
+            report_type: cls.env['isp.report'].create({
+                'name': f'Test {report_type}',
+                'report_type': report_type,
+                'date_from': today - timedelta(days=1),
+                'date_to': today + timedelta(days=1),
+            })
+            for report_type in ('customer', 'cpe', 'package')
+        }
+        cls.sequence = 0
+
+    def _create_rows(self, count):
+        """Buat pelanggan dengan CPE, paket dan subscription open masing-masing"""
+        for _index in range(count):
+            TestISPReportQueries.sequence += 1
+            number = TestISPReportQueries.sequence
+            profile = self.env['isp.mikrotik.profile'].create({
+                'name': f'TEST-PROFILE-{number}',
+                'rate_limit': '10M/20M',
+            })
+            package = self.env['isp.package'].create({
+                'name': f'Paket Test {number}',
+                'profile_id': profile.id,
+                'price': 150000,
+            })
+            customer = self.env['isp.customer'].create({
+                'name': f'Pelanggan Test {number}',
+                'mobile': f'0812{number:08d}',
+                'state': 'open',
+            })
+            cpe = self.env['isp.cpe'].create({
+                'name': f'CPE Test {number}',
+                'customer_id': customer.id,
+                'pppoe_username': f'test-report-{number}',
+                'pppoe_password': 'secret',
+                'state': 'open',
+            })
+            self.env['isp.subscription'].create({
+                'customer_id': customer.id,
+                'cpe_id': cpe.id,
+                'package_id': package.id,
+                'state': 'open',
+            })
+
+    def _render(self, report_type):
+        self.env.invalidate_all()
+        report_ref = f'dkt_isp_billing.action_report_{report_type}'
+        content, _format = self.env['ir.actions.report']._render_qweb_html(
+            report_ref, self.reports[report_type].ids)
+        return content
+
+    def _count_queries(self, report_type):
+        before = self.cr.sql_log_count
+        self._render(report_type)
+        return self.cr.sql_log_count - before
+
+    def test_query_count_independent_of_rows(self):
+        self._create_rows(5)
+        expected = {}
+        for report_type in self.reports:
+            # Render pertama mengompilasi template; yang diukur render berikutnya
+            self._render(report_type)
+            expected[report_type] = self._count_queries(report_type)
+
+        self._create_rows(45)
+        for report_type, count in expected.items():
+            with self.subTest(report_type=report_type), self.assertQueryCount(count):
+                self._render(report_type)
+
+    def test_customer_report_rows(self):
+        self._create_rows(3)
+        document = html.fromstring(self._render('customer'))
+        table = document.xpath('//table[contains(@class, "table-sm")]')[0]
+        headers = table.xpath('./thead/tr/th')
+        rows = table.xpath('./tbody/tr')
+        self.assertEqual(len(rows), 3)
+        for row in rows:
+            self.assertEqual(len(row.xpath('./td')), len(headers), 'Jumlah kolom harus sama dengan header')
+        # Paket aktif diambil dari subscription berstatus open
+        packages_column = [header.text_content().strip() for header in headers].index('Paket Aktif')
+        for row in rows:
+            self.assertTrue(row.xpath('./td')[packages_column].text_content().strip().startswith('Paket Test'))
\ No newline at end of file
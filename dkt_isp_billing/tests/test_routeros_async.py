@@ -0,0 +1,94 @@
+import asyncio
+
+from routeros_api import exceptions
+
+from odoo.tests.common import BaseCase, tagged
+
+from ..tools.routeros_async import AsyncRouterOsClient, encode_length, encode_sentence, read_sentence
+
+
+async def _read(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return await read_sentence(reader)
+
+
+class _FakeWriter:
+    """Writer tanpa socket: menyimpan data yang ditulis, tidak pernah ada balasan"""
+
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+    def close(self):
+        pass
+
+
+@tagged('post_install', '-at_install')
+class TestRouterOsProtocol(BaseCase):
+    """Encoding word/sentence dan pencocokan balasan per .tag pada client asyncio"""
+
+    def test_encode_length(self):
+        self.assertEqual(encode_length(0x7F), b'\x7f')
+        self.assertEqual(encode_length(0x80), b'\x80\x80')
+        self.assertEqual(encode_length(0x3FFF), b'\xbf\xff')
+        self.assertEqual(encode_length(0x4000), b'\xc0\x40\x00')
+        self.assertEqual(encode_length(0x200000), b'\xe0\x20\x00\x00')
+        self.assertEqual(encode_length(0x10000000), b'\xf0\x10\x00\x00\x00')
+
+    def test_sentence_round_trip(self):
+        words = ['/ppp/secret/set', '=.id=*1', '=comment=' + 'x' * 300, '=name=pelanggan-é', '.tag=7']
+        self.assertEqual(asyncio.run(_read(encode_sentence(words))), words)
+        self.assertEqual(asyncio.run(_read(b'\x00')), [])
+
+    def test_dispatch_by_tag(self):
+        async def scenario():
+            client = AsyncRouterOsClient('router.test')
+            loop = asyncio.get_running_loop()
+            first, second = loop.create_future(), loop.create_future()
+            client._pending = {
+                '1': {'future': first, 'rows': [], 'trap': None},
+                '2': {'future': second, 'rows': [], 'trap': None},
+            }
+            # Balasan dua perintah datang berselang-seling, dicocokkan lewat tag
+            client._dispatch(['!re', '=.id=*1', '=name=a', '.tag=1'])
+            client._dispatch(['!trap', '=message=no such item', '.tag=2'])
+            client._dispatch(['!re', '=.id=*2', '=name=b', '.tag=1'])
+            client._dispatch(['!done', '=ret=*3', '.tag=1'])
+            client._dispatch(['!done', '.tag=2'])
+            client._dispatch(['!done', '.tag=99'])
+            return client, first, second
+
+        client, first, second = asyncio.run(scenario())
+        self.assertEqual(first.result(), [{'id': '*1', 'name': 'a'}, {'id': '*2', 'name': 'b'}])
+        self.assertEqual(first.result().done_message, {'ret': '*3'})
+        with self.assertRaises(exceptions.RouterOsApiCommunicationError):
+            second.result()
+        self.assertEqual(client._pending, {})
+
+    def test_dispatch_fatal(self):
+        client = AsyncRouterOsClient('router.test')
+        with self.assertRaises(exceptions.FatalRouterOsApiError):
+            client._dispatch(['!fatal', 'session terminated'])
+
+    def test_call_timeout_forgets_tag(self):
+        async def scenario():
+            client = AsyncRouterOsClient('router.test', timeout=0.01)
+            client._writer = _FakeWriter()
+            client._reader_task = asyncio.get_running_loop().create_future()
+            with self.assertRaises(exceptions.RouterOsApiConnectionError):
+                await client.call('/ppp/secret', 'print')
+            return client
+
+        client = asyncio.run(scenario())
+        self.assertEqual(client._pending, {})
+        self.assertIn(b'.tag=1', client._writer.data)
\ No newline at end of file
@@ -0,0 +1 @@
+from . import routeros_async
\ No newline at end of file
@@ -0,0 +1,371 @@
+"""
+Client RouterOS API berbasis asyncio.
+
+Setiap perintah diberi .tag sehingga banyak perintah bisa berjalan bersamaan di satu socket
+(pipelining) dan balasannya dicocokkan per tag oleh satu reader task. Kode ORM yang sinkron
+memakai RouterOsAsyncPool, facade dengan antarmuka yang sama seperti routeros_api.RouterOsApiPool
+(get_api().get_resource(path).get/call/call_async/set/add/remove), sehingga bisa langsung
+dipakai oleh pool koneksi di isp_mikrotik.py. Event loop berjalan di satu thread latar per proses.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import os
+import socket
+import threading
+
+from routeros_api import exceptions
+
+_logger = logging.getLogger(__name__)
+
+
+def encode_length(length):
+    """Panjang word sesuai protokol RouterOS API (1-5 byte)"""
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words, encoding='utf-8'):
+    """Gabungkan word menjadi satu sentence yang diakhiri word kosong"""
+    data = bytearray()
+    for word in words:
+        raw = word.encode(encoding)
+        data += encode_length(len(raw)) + raw
+    data += b'\x00'
+    return bytes(data)
+
+
+async def read_length(reader):
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        extra, value = 1, first & 0x3F
+    elif first < 0xE0:
+        extra, value = 2, first & 0x1F
+    elif first < 0xF0:
+        extra, value = 3, first & 0x0F
+    elif first == 0xF0:
+        extra, value = 4, 0
+    else:
+        raise exceptions.RouterOsApiParsingError(f'Panjang word tidak valid: {first:#x}')
+    for byte in await reader.readexactly(extra):
+        value = (value << 8) | byte
+    return value
+
+
+async def read_sentence(reader, encoding='utf-8'):
+    words = []
+    while True:
+        length = await read_length(reader)
+        if not length:
+            return words
+        words.append((await reader.readexactly(length)).decode(encoding, errors='replace'))
+
+
+def _encode_key(key):
+    # Sama seperti routeros_api: id/proplist menjadi .id/.proplist, underscore menjadi strip
+    key = key.replace('_', '-')
+    return f'.{key}' if key in ('id', 'proplist') else key
+
+
+def _decode_key(key):
+    return key[1:] if key in ('.id', '.proplist') else key
+
+
+class RouterOsResponse(list):
+    """Baris !re dari satu perintah; atribut !done (misalnya ret dari add) ada di done_message"""
+
+    def __init__(self, rows=(), done_message=None):
+        super().__init__(rows)
+        self.done_message = done_message or {}
+
+
+class AsyncRouterOsClient:
+    """Koneksi RouterOS API asyncio dengan banyak perintah in-flight per socket"""
+
+    def __init__(self, host, port=8728, username='admin', password='', timeout=15.0, encoding='utf-8'):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.encoding = encoding
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._tags = itertools.count(1)
+
+    @property
+    def connected(self):
+        return bool(self._writer) and not self._writer.is_closing() and bool(self._reader_task) \
+            and not self._reader_task.done()
+
+    async def connect(self):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise exceptions.RouterOsApiConnectionError(f'Tidak dapat terhubung ke {self.host}:{self.port}: {e}')
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            except OSError:
+                pass
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+        try:
+            await self.login()
+        except Exception:
+            await self.close()
+            raise
+
+    async def login(self):
+        try:
+            response = await self.call('/', 'login', {'name': self.username, 'password': self.password})
+            challenge = response.done_message.get('ret')
+            if challenge:
+                # RouterOS sebelum 6.43: login dengan challenge MD5
+                digest = hashlib.md5(b'\x00' + self.password.encode(self.encoding) + bytes.fromhex(challenge))
+                await self.call('/', 'login', {'name': self.username, 'response': '00' + digest.hexdigest()})
+        except exceptions.RouterOsApiCommunicationError as e:
+            raise exceptions.RouterOsApiConnectionError(f'Login gagal: {e.original_message}')
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        if self._reader_task:
+            self._reader_task.cancel()
+        self._fail_pending(exceptions.RouterOsApiConnectionClosedError('Koneksi ditutup'))
+
+    def send(self, path, command, arguments=None, queries=None):
+        """
+        Tulis satu perintah ke socket dan kembalikan future balasannya tanpa menunggu.
+        Beberapa send berturut-turut dikirim dalam urutan pemanggilan (pipelining).
+        """
+        if not self.connected:
+            raise exceptions.RouterOsApiConnectionClosedError('Koneksi RouterOS tidak aktif')
+        if not path.endswith('/'):
+            path += '/'
+        if not path.startswith('/'):
+            path = '/' + path
+        tag = str(next(self._tags))
+        words = [path + command]
+        for key, value in (arguments or {}).items():
+            words.append(f'={_encode_key(key)}=' + ('' if value is None else str(value)))
+        for key, value in (queries or {}).items():
+            words.append(f'?{_encode_key(key)}=' + ('' if value is None else str(value)))
+        words.append(f'.tag={tag}')
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tag] = {'future': future, 'rows': [], 'trap': None}
+        self._writer.write(encode_sentence(words, self.encoding))
+        return future
+
+    async def call(self, path, command, arguments=None, queries=None):
+        """
+        Kirim satu perintah dan tunggu balasannya. Jika timeout, tag dibuang dari daftar
+        pending sehingga balasan yang datang terlambat diabaikan.
+        """
+        future = self.send(path, command, arguments, queries)
+        try:
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._forget(future)
+            raise exceptions.RouterOsApiConnectionError(f'Timeout menunggu balasan {path}{command}')
+
+    async def print(self, path, proplist=None, **queries):
+        arguments = {'.proplist': ','.join(proplist)} if proplist else None
+        return await self.call(path, 'print', arguments, queries)
+
+    async def set(self, path, **arguments):
+        return await self.call(path, 'set', arguments)
+
+    async def add(self, path, **arguments):
+        return await self.call(path, 'add', arguments)
+
+    async def remove(self, path, **arguments):
+        return await self.call(path, 'remove', arguments)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                words = await read_sentence(self._reader, self.encoding)
+                if not words:
+                    continue
+                self._dispatch(words)
+        except asyncio.CancelledError:
+            raise
+        except exceptions.FatalRouterOsApiError as e:
+            self._fail_pending(e)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            self._fail_pending(exceptions.RouterOsApiConnectionClosedError(f'Koneksi terputus: {e}'))
+        except Exception as e:
+            _logger.error(f'Reader RouterOS {self.host} berhenti: {str(e)}', exc_info=True)
+            self._fail_pending(exceptions.FatalRouterOsApiError(str(e)))
+        finally:
+            if self._writer:
+                self._writer.close()
+
+    def _dispatch(self, words):
+        reply = words[0]
+        attributes = {}
+        tag = None
+        for word in words[1:]:
+            if word.startswith('.tag='):
+                tag = word[5:]
+            elif word.startswith('='):
+                key, _sep, value = word[1:].partition('=')
+                attributes[_decode_key(key)] = value
+
+        if reply == '!fatal':
+            raise exceptions.FatalRouterOsApiError(attributes.get('message') or ' '.join(words[1:]))
+        pending = self._pending.get(tag)
+        if pending is None:
+            _logger.debug(f'Balasan RouterOS dengan tag tidak dikenal: {tag}')
+            return
+        if reply == '!re':
+            pending['rows'].append(attributes)
+        elif reply == '!trap':
+            pending['trap'] = attributes
+        elif reply == '!done':
+            del self._pending[tag]
+            future = pending['future']
+            if future.done():
+                return
+            if pending['trap'] is not None:
+                message = pending['trap'].get('message', '')
+                future.set_exception(exceptions.RouterOsApiCommunicationError(
+                    f'Error "{message}" executing command', message.encode(self.encoding)
+                ))
+            else:
+                future.set_result(RouterOsResponse(pending['rows'], attributes))
+
+    def _forget(self, future):
+        for tag, entry in list(self._pending.items()):
+            if entry['future'] is future:
+                del self._pending[tag]
+
+    def _fail_pending(self, error):
+        pending, self._pending = self._pending, {}
+        for entry in pending.values():
+            if not entry['future'].done():
+                entry['future'].set_exception(error)
+
+
+class _EventLoopThread:
+    """Satu event loop asyncio di thread latar per proses (dibuat ulang setelah fork)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def get_loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='routeros-async', daemon=True).start()
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+
+_event_loop = _EventLoopThread()
+
+
+class _Promise:
+    """Setara promise routeros_api: get() menunggu balasan perintah yang sudah dikirim"""
+
+    def __init__(self, future, timeout):
+        self._future = future
+        self._timeout = timeout
+
+    def get(self):
+        try:
+            return self._future.result(self._timeout)
+        except concurrent.futures.TimeoutError:
+            # Cadangan bila event loop macet: coroutine sendiri sudah dibatasi timeout client
+            self._future.cancel()
+            raise exceptions.RouterOsApiConnectionError('Timeout menunggu balasan RouterOS')
+
+
+class RouterOsAsyncResource:
+    def __init__(self, pool, path):
+        self.pool = pool
+        self.path = path
+
+    def get(self, **queries):
+        return self.call('print', {}, queries)
+
+    def call(self, command, arguments=None, queries=None):
+        return self.call_async(command, arguments, queries).get()
+
+    def call_async(self, command, arguments=None, queries=None):
+        # Timeout balasan ditangani AsyncRouterOsClient.call (tag dibuang, RouterOsApiConnectionError)
+        future = _event_loop.submit(self.pool.client.call(self.path, command, arguments, queries))
+        return _Promise(future, self.pool.timeout * 2 + 1)
+
+    def set(self, **arguments):
+        return self.call('set', arguments)
+
+    def add(self, **arguments):
+        return self.call('add', arguments)
+
+    def remove(self, **arguments):
+        return self.call('remove', arguments)
+
+
+class RouterOsAsyncApi:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def get_resource(self, path):
+        return RouterOsAsyncResource(self.pool, path)
+
+
+class RouterOsAsyncPool:
+    """
+    Facade sinkron untuk AsyncRouterOsClient dengan antarmuka RouterOsApiPool
+    (connected, get_api(), disconnect()). Perintah call_async dari beberapa resource
+    tetap berbagi satu socket dan dikirim tanpa menunggu balasan sebelumnya.
+    """
+
+    def __init__(self, host, username='admin', password='', port=8728, timeout=15.0):
+        self.timeout = timeout
+        self.client = AsyncRouterOsClient(host, port=port, username=username, password=password, timeout=timeout)
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    def get_api(self):
+        if not self.connected:
+            _event_loop.run(self.client.connect(), self.timeout * 2)
+        return RouterOsAsyncApi(self)
+
+    def disconnect(self):
+        try:
+            _event_loop.run(self.client.close(), self.timeout)
+        except Exception as e:
+            _logger.debug(f'Gagal menutup koneksi RouterOS: {str(e)}')
\ No newline at end of file
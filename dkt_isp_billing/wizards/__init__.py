@@ -1 +1,3 @@
-from . import isp_adopt_secret_wizard 
\ No newline at end of file
+from . import isp_adopt_secret_wizard
+from . import isp_billing_backfill_wizard
+from . import isp_billing_forecast_wizard
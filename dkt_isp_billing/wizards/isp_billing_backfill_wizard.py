@@ -0,0 +1,85 @@
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+class ISPBillingBackfillWizard(models.TransientModel):
+    _name = 'isp.billing.backfill.wizard'
+    _description = 'Wizard Backfill Invoice'
+
+    date_until = fields.Date('Tagih Sampai Tanggal', required=True, default=fields.Date.context_today)
+    subscription_ids = fields.Many2many('isp.subscription', string='Subscription',
+                                     help='Kosongkan untuk memproses semua subscription open/terisolir')
+    line_ids = fields.One2many('isp.billing.backfill.line', 'wizard_id', string='Invoice yang Akan Dibuat', readonly=True)
+    invoice_count = fields.Integer('Jumlah Invoice', compute='_compute_totals')
+    total_amount = fields.Float('Total Tagihan', compute='_compute_totals')
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if self.env.context.get('active_model') == 'isp.subscription' and self.env.context.get('active_ids'):
+            res['subscription_ids'] = [(6, 0, self.env.context['active_ids'])]
+        return res
+
+    @api.depends('line_ids', 'line_ids.final_amount')
+    def _compute_totals(self):
+        for wizard in self:
+            wizard.invoice_count = len(wizard.line_ids)
+            wizard.total_amount = sum(wizard.line_ids.mapped('final_amount'))
+
+    def _get_domain(self):
+        """Domain subscription yang diproses"""
+        self.ensure_one()
+        return [('id', 'in', self.subscription_ids.ids)] if self.subscription_ids else []
+
+    def _reopen(self):
+        """Tampilkan kembali wizard ini"""
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def action_preview(self):
+        """Dry-run: tampilkan invoice yang akan dibuat tanpa membuatnya"""
+        self.ensure_one()
+        result = self.env['isp.subscription']._backfill_invoices(
+            until_date=self.date_until, dry_run=True, domain=self._get_domain()
+        )
+        self.line_ids.unlink()
+        self.write({'line_ids': [(0, 0, line) for line in result['preview']]})
+        return self._reopen()
+
+    def action_generate(self):
+        """Buat semua invoice periode yang terlewat"""
+        self.ensure_one()
+        result = self.env['isp.subscription']._with_batch_mode()._backfill_invoices(
+            until_date=self.date_until, domain=self._get_domain()
+        )
+        if not result['invoice_count'] and not result['failed_ids']:
+            raise ValidationError('Tidak ada periode tagihan yang terlewat.')
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Sukses' if not result['failed_ids'] else 'Peringatan',
+                'message': f'{result["invoice_count"]} invoice dibuat, {len(result["failed_ids"])} subscription gagal',
+                'type': 'success' if not result['failed_ids'] else 'warning',
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
+
+
+class ISPBillingBackfillLine(models.TransientModel):
+    _name = 'isp.billing.backfill.line'
+    _description = 'Baris Backfill Invoice'
+    _order = 'subscription_id, invoice_date'
+
+    wizard_id = fields.Many2one('isp.billing.backfill.wizard', string='Wizard', required=True, ondelete='cascade')
+    subscription_id = fields.Many2one('isp.subscription', string='Subscription', required=True)
+    customer_id = fields.Many2one(related='subscription_id.customer_id', string='Pelanggan')
+    package_id = fields.Many2one(related='subscription_id.package_id', string='Paket')
+    invoice_date = fields.Date('Tanggal Invoice')
+    amount = fields.Float('Jumlah Tagihan')
+    discount_amount = fields.Float('Jumlah Diskon')
+    final_amount = fields.Float('Total Setelah Diskon')
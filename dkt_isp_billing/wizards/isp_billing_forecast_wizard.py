@@ -0,0 +1,88 @@
+from odoo import models, fields, api
+from dateutil.relativedelta import relativedelta
+
+class ISPBillingForecastWizard(models.TransientModel):
+    _name = 'isp.billing.forecast.wizard'
+    _description = 'Wizard Forecast Billing'
+
+    date_from = fields.Date('Dari Tanggal', required=True, default=fields.Date.context_today)
+    date_to = fields.Date('Sampai Tanggal', required=True,
+                          default=lambda self: fields.Date.context_today(self) + relativedelta(day=31))
+    subscription_ids = fields.Many2many('isp.subscription', string='Subscription',
+                                     help='Kosongkan untuk menghitung semua subscription open')
+
+    subscription_count = fields.Integer('Subscription Jatuh Tempo', readonly=True)
+    invoice_count = fields.Integer('Jumlah Invoice', readonly=True)
+    amount = fields.Float('Jumlah Tagihan', readonly=True)
+    discount_amount = fields.Float('Jumlah Diskon', readonly=True)
+    final_amount = fields.Float('Total Setelah Diskon', readonly=True)
+    package_line_ids = fields.One2many('isp.billing.forecast.line', 'wizard_id', string='Per Paket',
+                                       domain=[('group_type', '=', 'package')], readonly=True)
+    due_day_line_ids = fields.One2many('isp.billing.forecast.line', 'wizard_id', string='Per Tanggal Jatuh Tempo',
+                                       domain=[('group_type', '=', 'due_day')], readonly=True)
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if self.env.context.get('active_model') == 'isp.subscription' and self.env.context.get('active_ids'):
+            res['subscription_ids'] = [(6, 0, self.env.context['active_ids'])]
+        return res
+
+    def action_compute(self):
+        """Hitung forecast billing tanpa membuat invoice"""
+        self.ensure_one()
+        domain = [('id', 'in', self.subscription_ids.ids)] if self.subscription_ids else None
+        result = self.env['isp.subscription']._forecast_billing(self.date_from, self.date_to, domain=domain)
+
+        package_lines = [(0, 0, {
+            'group_type': 'package',
+            'package_id': line['package_id'],
+            'invoice_count': line['invoice_count'],
+            'amount': line['amount'],
+            'discount_amount': line['discount_amount'],
+            'final_amount': line['final_amount'],
+        }) for line in result['by_package']]
+        due_day_lines = [(0, 0, {
+            'group_type': 'due_day',
+            'due_day': line['due_day'],
+            'invoice_count': line['invoice_count'],
+            'amount': line['amount'],
+            'discount_amount': line['discount_amount'],
+            'final_amount': line['final_amount'],
+        }) for line in result['by_due_day']]
+
+        (self.package_line_ids | self.due_day_line_ids).unlink()
+        self.write({
+            'subscription_count': result['subscription_count'],
+            'invoice_count': result['invoice_count'],
+            'amount': result['amount'],
+            'discount_amount': result['discount_amount'],
+            'final_amount': result['final_amount'],
+            'package_line_ids': package_lines,
+            'due_day_line_ids': due_day_lines,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+
+class ISPBillingForecastLine(models.TransientModel):
+    _name = 'isp.billing.forecast.line'
+    _description = 'Baris Forecast Billing'
+    _order = 'group_type, due_day, id'
+
+    wizard_id = fields.Many2one('isp.billing.forecast.wizard', string='Wizard', required=True, ondelete='cascade')
+    group_type = fields.Selection([
+        ('package', 'Paket'),
+        ('due_day', 'Tanggal Jatuh Tempo')
+    ], string='Kelompok', required=True)
+    package_id = fields.Many2one('isp.package', string='Paket')
+    due_day = fields.Integer('Tanggal Jatuh Tempo')
+    invoice_count = fields.Integer('Jumlah Invoice')
+    amount = fields.Float('Jumlah Tagihan')
+    discount_amount = fields.Float('Jumlah Diskon')
+    final_amount = fields.Float('Total Setelah Diskon')